@@ -1,71 +1,34 @@
 """
 Module for interacting with AI services.
-This module provides functionality to analyze content using VertexAI (Gemini).
+This module provides functionality to analyze content using the configured model backend
+(VertexAI Gemini by default).
 """
 
 import configuration
 import base64
-import requests
 import json
-import io
-from typing import Iterator, Optional, Union, List, Dict, Any
-import PyPDF2
-import vertexai
-from vertexai.generative_models import GenerativeModel, Content, Part
+from typing import TYPE_CHECKING, Callable, Iterator, Optional, Tuple, Union, List, Dict, Any
 
-# Initialize VertexAI
-vertexai.init(project=configuration.PROJECT_ID, location=configuration.VERTEXT_AI_REGION_NAME)
+from document_text import extract_text_from_pdf
+from model_backend import backend_model_id, get_backend
+from result_cache import content_digest, get_result_cache, make_cache_key
+from structured_output import (
+    ANALYSIS_RESPONSE_SCHEMA, ANALYSIS_SCHEMA, check_schema, multi_country_response_schema, parse_json_response
+)
 
-def extract_text_from_pdf(pdf_data):
-    """
-    Extract text from PDF binary data.
-
-    Args:
-        pdf_data: Binary data of the PDF file
+if TYPE_CHECKING:
+    from vertexai.generative_models import Part
 
-    Returns:
-        Extracted text from the PDF
+def build_analysis_prompt(country: str) -> Tuple[str, str]:
     """
-    pdf_text = ""
-    try:
-        # Create a PDF file reader object
-        pdf_file = io.BytesIO(pdf_data)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-
-        # Extract text from each page
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            pdf_text += page.extract_text() + "\n\n"
-
-        if not pdf_text.strip():
-            pdf_text = "[PDF content could not be extracted. The PDF might be scanned or contain only images.]"
-    except Exception as e:
-        pdf_text = f"[Error extracting PDF content: {str(e)}]"
-
-    return pdf_text
-
-
-def analyze_content_with_gemini(
-    content_parts: List[Union[str, Part]],
-    country:str
-) -> Iterator[str]:
-    """
-    Analyze content using VertexAI (Gemini).
+    Build the system instruction and prompt used to analyze content for compliance.
 
     Args:
-        content_parts: List of content parts to analyze (text or Part objects)
-        prompt: The prompt to send to the model
-        system_instruction: The system instruction for the model
+        country: The country for which to check compliance
 
     Returns:
-        An iterator of response chunks from the model
+        A tuple containing the system instruction and the prompt
     """
-    # Initialize the Gemini model
-    model = GenerativeModel(configuration.MODEL_NAME)
-
-    # Create a chat session
-    chat = model.start_chat()
-
     system_instruction = f"""
                 You are a senior compliance officer for pharmaceutical regulations. 
                 Your task is to analyze the provided content and determine whether it complies with official medical norms in the specified {country}.
@@ -117,43 +80,301 @@ def analyze_content_with_gemini(
  
               """
 
-    # Create the user message with system instruction, prompt and content parts
+    return system_instruction, prompt
+
+
+def build_multi_country_prompt(countries: List[str]) -> Tuple[str, str]:
+    """
+    Build the system instruction and prompt used to analyze content for several countries at once.
+
+    Args:
+        countries: The countries for which to check compliance
+
+    Returns:
+        A tuple containing the system instruction and the prompt
+    """
+    country_list = ", ".join(countries)
+    country_keys = ", ".join(f'"{country}"' for country in countries)
+
+    system_instruction = f"""
+                You are a senior compliance officer for pharmaceutical regulations. 
+                Your task is to analyze the provided content and determine, separately for each of these countries, whether it complies with the official medical norms of that country: {country_list}.
+                """
+
+    prompt = f"""
+                You will be provided with the following document:
+
+                Follow these steps to determine compliance, separately for each country ({country_list}):
+
+                Analyze the document content provided.
+                Determine whether the overall content is compliant with official medical norms in the country or not. 
+                Also, present the overall percentage of non-compliance.
+                If the content is not compliant, present your analysis, clearly indicating the specific violations (if any), and the percentage of non-compliance for each page. 
+                Your analysis should show the percentage of non-compliance on each page of the document. It should also clearly mention which particular text in each page was not compliant.
+                Your representation should be a single JSON object with one key per country ({country_keys}),
+                and the value of each key should be the analysis for that country in the below format:
+                    {{
+                      "Compliant Status": "Compliant or Non Compliant",
+                      "Non-Compliance Percentage": XX,
+                      "Detailed Analysis": "detailed analysis of the document for this country",
+                      "Non-Compliant Pages": [
+                        {{
+                          "Page Number": X,
+                          "Page Non-Compliance Percentage": XX,
+                          "Non-Compliant Text": [
+                            {{
+                              "Text": "The specific non-compliant text from the document",
+                              "Reason": "The specific reason why this text violates regulations in this country"
+                            }}
+                            // Additional non-compliant items on this page
+                          ]
+                        }}
+                        // Additional non-compliant pages
+                      ]
+                    }}
+
+                  IMPORTANT INSTRUCTIONS:
+
+                    1. You MUST use this EXACT JSON structure with these EXACT field names, and the EXACT country names as keys.
+                    2. For "Non-Compliant Text", always use "Text" and "Reason" as the field names.
+                    3. For "Page Number", always use integer values (1, 2, 3, etc.).
+                    4. For "Page Non-Compliance Percentage" and "Non-Compliance Percentage", always use integer values (0-100).
+                    5. If a document is fully compliant for a country, return an empty array for its "Non-Compliant Pages".
+                    6. Do not include any explanatory text outside of the JSON structure.
+                    7. Ensure all JSON is properly formatted and valid.
+
+              """
+
+    return system_instruction, prompt
+
+
+def analysis_prompt_hash(country: Union[str, List[str]]) -> str:
+    """
+    Compute a digest of the analysis prompt, so that cached results are invalidated when the prompt changes.
+
+    Args:
+        country: The country, or list of countries, for which to check compliance
+
+    Returns:
+        The hexadecimal SHA-256 digest of the system instruction, prompt and response schema
+    """
+    if isinstance(country, str):
+        system_instruction, prompt = build_analysis_prompt(country)
+        schema = ANALYSIS_RESPONSE_SCHEMA
+    else:
+        system_instruction, prompt = build_multi_country_prompt(country)
+        schema = multi_country_response_schema(country)
+    if configuration.STRUCTURED_OUTPUT_ENABLED:
+        prompt += "\x1f" + json.dumps(schema, sort_keys=True)
+    return content_digest(system_instruction + "\x1f" + prompt)
+
+
+def response_schema(schema: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Get the schema the analysis response must follow.
+
+    Args:
+        schema: The schema of the response
+
+    Returns:
+        The schema, or None if structured output is disabled in the configuration
+    """
+    return schema if configuration.STRUCTURED_OUTPUT_ENABLED else None
+
+
+def cached_analysis(
+    content_hash: str,
+    country: Union[str, List[str]],
+    analyze: Callable[[], Iterator[str]]
+) -> Iterator[str]:
+    """
+    Serve an analysis from the result cache, or run it and cache the result.
+
+    Args:
+        content_hash: SHA-256 digest of the analyzed content
+        country: The country, or list of countries, for which to check compliance
+        analyze: A callable running the analysis and returning an iterator of response chunks
+
+    Returns:
+        An iterator of response chunks
+    """
+    if not configuration.RESULT_CACHE_ENABLED:
+        return analyze()
+
+    country_key = country if isinstance(country, str) else "|".join(country)
+    key = make_cache_key(content_hash, country_key, backend_model_id(), analysis_prompt_hash(country))
+    return get_result_cache().stream(key, analyze, validate=lambda result_text: is_valid_analysis(result_text, country))
+
+
+def is_valid_analysis(result_text: str, country: Union[str, List[str]]) -> bool:
+    """
+    Check that a response of the model is a complete analysis, worth caching.
+
+    Args:
+        result_text: The response text
+        country: The country, or list of countries, the analysis was requested for
+
+    Returns:
+        True if the response parses and every requested analysis matches the schema with a
+        known compliance status
+    """
+    def is_complete(analysis: Any) -> bool:
+        return (
+            isinstance(analysis, dict)
+            and not check_schema(analysis, ANALYSIS_SCHEMA)
+            and str(analysis["Compliant Status"]).strip().lower() in ("compliant", "non compliant")
+        )
+
+    if isinstance(country, str):
+        return is_complete(parse_json_response(result_text, ANALYSIS_SCHEMA))
+
+    result = parse_json_response(result_text)
+    if result is None:
+        return False
+    by_name = {str(key).strip().lower(): value for key, value in result.items()}
+    return all(is_complete(by_name.get(name.lower())) for name in country)
+
+
+def analyze_content(
+    content_parts: List[Union[str, "Part"]],
+    country: Union[str, List[str]]
+) -> Iterator[str]:
+    """
+    Analyze content for one country, or for several countries in a single model call.
+
+    Args:
+        content_parts: List of content parts to analyze (text or Part objects)
+        country: The country, or list of countries, for which to check compliance
+
+    Returns:
+        An iterator of response chunks from the model
+    """
+    if isinstance(country, str):
+        return analyze_content_with_gemini(content_parts=content_parts, country=country)
+    return analyze_content_for_countries(content_parts=content_parts, countries=country)
+
+
+def analyze_content_with_gemini(
+    content_parts: List[Union[str, "Part"]],
+    country:str
+) -> Iterator[str]:
+    """
+    Analyze content using the configured model backend.
+
+    Args:
+        content_parts: List of content parts to analyze (text or Part objects)
+        prompt: The prompt to send to the model
+        system_instruction: The system instruction for the model
+
+    Returns:
+        An iterator of response chunks from the model
+    """
+    system_instruction, prompt = build_analysis_prompt(country)
+
+    from vertexai.generative_models import Part
+
+    # Create the user message with the prompt and content parts
     user_message_parts = [
-        Part.from_text(f"System instruction: {system_instruction}\n\nAnalyze the following content:\n\n{prompt}")
+        Part.from_text(f"Analyze the following content:\n\n{prompt}")
     ]
 
     # Process content parts
+    user_message_parts.extend(_to_model_parts(content_parts))
+
+    # Send the message to the model and stream the response, constrained to the analysis schema
+    return get_backend().generate(
+        system_instruction, user_message_parts, response_schema=response_schema(ANALYSIS_RESPONSE_SCHEMA)
+    )
+
+
+def _to_model_parts(content_parts: List[Union[str, "Part", Dict[str, Any]]]) -> List["Part"]:
+    # The VertexAI SDK takes seconds to import, it is only loaded when the first analysis runs
+    from vertexai.generative_models import Part
+
+    model_parts = []
     for part in content_parts:
         if isinstance(part, str):
-            user_message_parts.append(Part.from_text(part))
+            model_parts.append(Part.from_text(part))
         elif isinstance(part, Part):
-            user_message_parts.append(part)
+            model_parts.append(part)
         elif isinstance(part, dict):
             if part.get("type") == "text":
-                user_message_parts.append(Part.from_text(part.get("text", "")))
+                model_parts.append(Part.from_text(part.get("text", "")))
             elif part.get("type") == "binary" and part.get("mime_type") == "application/pdf" and part.get("data"):
                 # For PDF, decode the base64 data and extract text
                 pdf_binary_data = base64.b64decode(part.get("data"))
                 extracted_text = extract_text_from_pdf(pdf_binary_data)
-                user_message_parts.append(Part.from_text(extracted_text))
+                model_parts.append(Part.from_text(extracted_text))
             elif part.get("type") == "binary":
                 # For other binary data, include a reference
-                user_message_parts.append(Part.from_text(f"[Binary content of type {part.get('mime_type', 'unknown')} was included]"))
+                model_parts.append(Part.from_text(f"[Binary content of type {part.get('mime_type', 'unknown')} was included]"))
+
+    return model_parts
+
+
+def analyze_content_for_countries(
+    content_parts: List[Union[str, "Part"]],
+    countries: List[str]
+) -> Iterator[str]:
+    """
+    Analyze content for several countries in a single call using the configured model backend.
+
+    The response is a JSON object keyed by country name, see split_country_results.
+
+    Args:
+        content_parts: List of content parts to analyze (text or Part objects)
+        countries: The countries for which to check compliance
+
+    Returns:
+        An iterator of response chunks from the model
+    """
+    system_instruction, prompt = build_multi_country_prompt(countries)
+
+    from vertexai.generative_models import Part
+
+    # Create the user message with the prompt and content parts, the content is only sent once
+    user_message_parts = [
+        Part.from_text(f"Analyze the following content:\n\n{prompt}")
+    ]
+    user_message_parts.extend(_to_model_parts(content_parts))
+
+    # Send the message to the model and stream the response, constrained to one analysis per country
+    return get_backend().generate(
+        system_instruction, user_message_parts, response_schema=response_schema(multi_country_response_schema(countries))
+    )
+
+
+def split_country_results(result: Dict[str, Any], countries: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Split the parsed response of a multi-country analysis into one analysis per country.
 
-    # Send the message to the model and get the response
-    response = chat.send_message(user_message_parts, stream=True)
+    Args:
+        result: The parsed JSON response, keyed by country name
+        countries: The countries that were requested
+
+    Returns:
+        A dictionary mapping each requested country to its analysis; countries missing from the
+        response get an "Unknown" status
+    """
+    by_name = {str(key).strip().lower(): value for key, value in result.items() if isinstance(value, dict)}
+
+    country_results = {}
+    for country in countries:
+        country_results[country] = by_name.get(country.lower()) or {
+            "Compliant Status": "Unknown",
+            "Non-Compliance Percentage": "0%",
+            "Detailed Analysis": f"No analysis was returned for {country}.",
+            "Non-Compliant Pages": []
+        }
+    return country_results
 
-    # Process the streaming response
-    for chunk in response:
-        if chunk.text:
-            yield chunk.text
 
 def extract_non_compliance_metrics(
         analysis_document: str, # This will always be a Text file
         country:str
 ) -> Iterator[str]:
     """
-        Analyze content using VertexAI (Gemini).
+        Analyze content using the configured model backend.
 
         Args:
             analysis_document: Binary data of the text file to analyze
@@ -162,12 +383,6 @@ def extract_non_compliance_metrics(
         Returns:
             An iterator of response chunks from the model
         """
-    # Initialize the Gemini model
-    model = GenerativeModel(configuration.MODEL_NAME)
-
-    # Create a chat session
-    chat = model.start_chat()
-
     system_instruction = f"""
                     You are a senior compliance officer for pharmaceutical regulations in {country}. 
                     Your task is to analyze a document and extract key metrics related to compliance with medical norms. 
@@ -195,15 +410,12 @@ def extract_non_compliance_metrics(
     # Convert analysis_document bytes to text
     document_text = analysis_document
 
-    # Create the user message with system instruction, prompt and document content
+    from vertexai.generative_models import Part
+
+    # Create the user message with prompt and document content
     user_message_parts = [
-        Part.from_text(f"System instruction: {system_instruction}\n\nAnalyze the following document:\n\n{prompt}\n\nDocument content:\n\n{document_text}")
+        Part.from_text(f"Analyze the following document:\n\n{prompt}\n\nDocument content:\n\n{document_text}")
     ]
 
-    # Send the message to the model and get the response
-    response = chat.send_message(user_message_parts, stream=True)
-
-    # Process the streaming response
-    for chunk in response:
-        if chunk.text:
-            yield chunk.text
+    # Send the message to the model and stream the response
+    return get_backend().generate(system_instruction, user_message_parts)
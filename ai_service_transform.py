@@ -4,49 +4,30 @@ This module provides functionality to transform non-compliant documents into com
 """
 
 import configuration
-import base64
-import requests
-import os
-import tempfile
-import io
-import PyPDF2
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
+import metrics
+import json
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Any, Dict, List, Optional, Tuple
 
 from data.country_data import COUNTRY_LANGUAGE_DESCRIPTION
+from document_text import extract_pdf_pages
+from model_backend import backend_model_id, get_backend
+from structured_output import parse_json_response
+from translation_memory import get_translation_memory
 
+# Shared pool bounding the number of concurrent page transformations across all requests
+_transform_executor = None
+_transform_executor_lock = threading.Lock()
 
-def extract_text_from_pdf(pdf_data):
-    """
-    Extract text from PDF binary data.
-
-    Args:
-        pdf_data: Binary data of the PDF file
-
-    Returns:
-        Extracted text from the PDF
-    """
-    pdf_text = ""
-    try:
-        # Create a PDF file reader object
-        pdf_file = io.BytesIO(pdf_data)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-
-        # Extract text from each page
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            pdf_text += page.extract_text() + "\n\n"
-
-        if not pdf_text.strip():
-            pdf_text = "[PDF content could not be extracted. The PDF might be scanned or contain only images.]"
-    except Exception as e:
-        pdf_text = f"[Error extracting PDF content: {str(e)}]"
+# Blank lines between paragraphs
+_PARAGRAPH_SEPARATOR = re.compile(r'(\n\s*\n)')
 
-    return pdf_text
 
-
-def transform_document_with_openai(
+@metrics.timed("transform")
+def transform_document_text(
         analysis_document: bytes, # This will always be a Text file
         non_compliant_document: bytes,
         non_compliant_document_pages: bytes,
@@ -54,123 +35,418 @@ def transform_document_with_openai(
         country: str
 ) -> str:
     """
-    Transform a non-compliant document into a compliant one using OpenAI.
+    Transform a non-compliant document into a compliant text using OpenAI.
+
+    The document is transformed page by page: the non-compliant pages are rewritten and the
+    other pages are only translated, all concurrently, and the pages are put back in order.
+    In the "spans" transform mode only the flagged texts are rewritten, see transform_page_spans.
 
     Args:
-        document_data: The document data as bytes
+        analysis_document: The detailed analysis of the document
+        non_compliant_document: The document data as bytes
+        non_compliant_document_pages: The non-compliant pages of the analysis
         file_type: The MIME type of the document
         country: The country for which to ensure compliance
 
     Returns:
-        Path to the transformed PDF document
+        The transformed text, pages are separated by blank lines
     """
-    # OpenAI API endpoint
-    api_url = f"{configuration.OPENAI_API_BASE_URL}/chat/completions"
+    pages = split_document_pages(non_compliant_document, file_type)
+    issues_by_page = group_issues_by_page(non_compliant_document_pages, len(pages))
+
+    futures = []
+    for page_number, page_text in enumerate(pages, start=1):
+        # Without page-level findings every page is rewritten using the detailed analysis
+        rewrite = page_number in issues_by_page or not issues_by_page
+        if not page_text.strip() or not (rewrite or configuration.TRANSFORM_TRANSLATE_COMPLIANT_PAGES):
+            # Empty pages, and compliant pages when they are not translated, are kept as they are
+            futures.append(None)
+            continue
+        if not rewrite:
+            # Pages without compliance issues are translated through the translation memory
+            futures.append(_submit(translate_page, page_text, country))
+            continue
+        if configuration.TRANSFORM_MODE == "spans" and issues_by_page:
+            # Only ask for replacements of the flagged spans, the rest of the page is translated
+            futures.append(_submit(
+                transform_page_spans, page_text, page_number, len(pages),
+                issues_by_page.get(page_number), analysis_document, country
+            ))
+            continue
+        futures.append(_submit(
+            transform_page, page_text, page_number, len(pages),
+            issues_by_page.get(page_number), analysis_document, country
+        ))
+
+    # Wait for every page, a failed page fails the whole transform instead of being left out
+    transformed_pages = [
+        future.result() if future is not None else page_text
+        for page_text, future in zip(pages, futures)
+    ]
+
+    return "\n\n".join(page.strip() for page in transformed_pages if page.strip())
 
-    # Prepare headers with an API key
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {configuration.OPENAI_API_KEY}"
-    }
 
-    # Process document data
+def split_document_pages(document_data: bytes, file_type: str) -> List[str]:
+    """
+    Split a document into the text of its pages.
+
+    Args:
+        document_data: The document data as bytes
+        file_type: The MIME type of the document
+
+    Returns:
+        The text of each page; text files are a single page unless they contain form feeds
+    """
     if file_type == "application/pdf":
-        # For PDF, extract text and send it to OpenAI
-        non_compliant_document_data = extract_text_from_pdf(non_compliant_document)
-    elif file_type == "text/plain":
-        # For text, we can decode and include it directly
-        non_compliant_document_data = non_compliant_document.decode('utf-8', errors='replace')
+        return extract_pdf_pages(document_data)
+    if file_type == "text/plain":
+        return document_data.decode('utf-8', errors='replace').split('\f')
+    raise ValueError(f"Unsupported file type: {file_type}")
 
-    analysis_document_data = analysis_document
 
+def group_issues_by_page(non_compliant_pages: List[Dict[str, Any]], page_count: int) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Group the non-compliant text items of an analysis by page.
+
+    Args:
+        non_compliant_pages: The "Non-Compliant Pages" of the analysis
+        page_count: The number of pages of the document
+
+    Returns:
+        A dictionary mapping page numbers (1-based) to their non-compliant text items; page
+        numbers outside of the document are attributed to its nearest page
+    """
+    issues_by_page: Dict[int, List[Dict[str, Any]]] = {}
+    for page in non_compliant_pages or []:
+        if not isinstance(page, dict):
+            continue
+        try:
+            page_number = int(str(page.get("Page Number", 1)).strip())
+        except ValueError:
+            page_number = 1
+        page_number = min(max(page_number, 1), max(page_count, 1))
+        issues_by_page.setdefault(page_number, []).extend(page.get("Non-Compliant Text") or [])
+    return issues_by_page
+
+
+def transform_page(
+        page_text: str,
+        page_number: int,
+        page_count: int,
+        issues: Optional[List[Dict[str, Any]]],
+        analysis_document: str,
+        country: str
+) -> str:
+    """
+    Rewrite a single page of a document to make it compliant.
+
+    Args:
+        page_text: The text of the page
+        page_number: The page number (1-based)
+        page_count: The number of pages of the document
+        issues: The non-compliant text items of the page, if any
+        analysis_document: The detailed analysis of the document, used when no issues are known
+        country: The country for which to ensure compliance
+
+    Returns:
+        The transformed text of the page
+    """
     language = COUNTRY_LANGUAGE_DESCRIPTION.get(country, "")
-    # Create the system instruction and prompt
     system_instruction = f"You are a senior compliance officer for pharmaceutical regulations in {country}."
 
+    if issues:
+        findings = "\n".join(
+            f"- Text: {item.get('Text', '')}\n  Reason: {item.get('Reason', '')}"
+            for item in issues if isinstance(item, dict)
+        )
+    else:
+        findings = analysis_document
+
     user_instruction = f"""
-    You will be provided with the following documents:
-    1.  Analysis Document: {analysis_document_data}
-    2.  Original Non Compliant Document: {non_compliant_document_data}
-    3.  Non Compliant Pagewise Document: {non_compliant_document_pages}
+    You will be provided with page {page_number} of {page_count} of a non-compliant document and the compliance issues found on it.
+
+    Page content:
+    {page_text}
+
+    Compliance issues:
+    {findings}
 
     Follow these steps to complete the task:
 
-    1.  **Analyze the Analysis Document:** Carefully review the analysis document to identify all areas of non-compliance with official {country} medical norms.
-    2.  **Analyze the Non Compliant Pagewise Document:** Carefully review the non-compliant pagewise document to identify all areas of non-compliance with official {country} medical norms. 
-    3.  **Reference the Original Non-Compliant Document:** Use the original non-compliant document as a reference to understand the context of each non-compliant item.
-    4.  **Translate into {language}:** Translate the original non-compliant document into {language}. Ensure the translation is accurate and maintains the original meaning.
-    5.  **Ensure Compliance:** While translating, ensure that all identified non-compliant items are corrected to fully comply with {country} medical norms. Use your expertise to make necessary adjustments and additions. 
-        **Please also ensure that all the content of the Original Non Compliant Document is there and there should not be any loss of data and all the pages of the original document should be there. 
-        **Try to convert the non compliance data into compliant one and add it to the final compliant version.
-    6.  **Generate Compliant PDF:** Create a final PDF version of the translated and compliant document. The PDF should be properly formatted and suitable for official use.
-    7.  **Error Handling:** If full compliance cannot be achieved due to missing information or conflicting regulations, provide a detailed explanation of the issues and suggest possible resolutions.
-    8.  **Language:** Ensure the final document is in {language} and adheres to professional language standards.
+    1.  **Translate into {language}:** Translate the page into {language}. Ensure the translation is accurate and maintains the original meaning.
+    2.  **Ensure Compliance:** While translating, correct the non-compliant items so that they fully comply with official {country} medical norms. Keep all the other content of the page, there should not be any loss of data.
+    3.  **Language:** Ensure the page is in {language} and adheres to professional language standards.
 
-    Your output should be a fully compliant PDF document in {language}, adhering to all official {country} medical norms. 
-    Please ensure that the document only consist of the translated and compliant content ONLY and no other information should be included especially system information should not be included in the final document which is added by you.
+    Output the translated and compliant content of this page ONLY, without any explanation, heading or system information added by you.
     """
 
+    # Send the prompt to the transformation model (OpenAI by default)
+    transformed_text = get_backend(configuration.TRANSFORM_BACKEND).complete(
+        system_instruction, user_instruction, temperature=0.5, max_tokens=configuration.TRANSFORM_PAGE_MAX_TOKENS
+    )
+    metrics.TRANSFORMED_PAGES.inc(mode="rewrite")
+    return transformed_text
 
-    # Prepare messages for the API
-    messages = [
-        {"role": "system", "content": system_instruction},
-        {"role": "user", "content": user_instruction}
-    ]
 
+def transform_page_spans(
+        page_text: str,
+        page_number: int,
+        page_count: int,
+        issues: Optional[List[Dict[str, Any]]],
+        analysis_document: str,
+        country: str
+) -> str:
+    """
+    Transform a single page of a document by replacing only its non-compliant texts.
 
-    # Prepare the request data
-    data = {
-        "model": configuration.OPENAI_MODEL_NAME,
-        "messages": messages,
-        "temperature": 0.5,
-        "max_tokens": 4000
+    The model is asked for a compliant replacement of each flagged text, and the unchanged text
+    around them is translated through the translation memory; like a rewritten page, the page is
+    translated even when compliant pages are not (configuration.TRANSFORM_TRANSLATE_COMPLIANT_PAGES).
+    When a flagged text cannot be found on the page, the whole page is rewritten instead (see
+    transform_page).
+
+    Args:
+        page_text: The text of the page
+        page_number: The page number (1-based)
+        page_count: The number of pages of the document
+        issues: The non-compliant text items of the page, if any
+        analysis_document: The detailed analysis of the document
+        country: The country for which to ensure compliance
+
+    Returns:
+        The transformed text of the page
+    """
+    spans = locate_spans(page_text, issues or [])
+    try:
+        if spans is None:
+            raise ValueError("flagged text not found on the page")
+        replacements = request_replacements(page_text, spans, country)
+    except ValueError as e:
+        print(f"Rewriting page {page_number} entirely: {str(e)}")
+        metrics.TRANSFORMED_PAGES.inc(mode="fallback")
+        return transform_page(page_text, page_number, page_count, issues, analysis_document, country)
+
+    # Splice the replacements between the translated unchanged texts
+    gaps = []
+    position = 0
+    for start, end, _ in spans:
+        gaps.append(page_text[position:start])
+        position = end
+    gaps.append(page_text[position:])
+    translated_gaps = translate_texts(gaps, country)
+    metrics.TRANSFORMED_PAGES.inc(mode="spans")
+
+    pieces = [translated_gaps[0]]
+    for replacement, gap in zip(replacements, translated_gaps[1:]):
+        pieces.append(replacement)
+        pieces.append(gap)
+    return "".join(pieces)
+
+
+def locate_spans(page_text: str, issues: List[Dict[str, Any]]) -> Optional[List[Tuple[int, int, Dict[str, Any]]]]:
+    """
+    Find the non-compliant texts of a page.
+
+    Args:
+        page_text: The text of the page
+        issues: The non-compliant text items of the page
+
+    Returns:
+        The (start, end, item) of each flagged text in page order, without overlaps, or None if
+        one of the texts cannot be found
+    """
+    spans = []
+    for item in issues:
+        text = str(item.get("Text", "")).strip() if isinstance(item, dict) else ""
+        if not text:
+            continue
+        start = page_text.find(text)
+        if start >= 0:
+            spans.append((start, start + len(text), item))
+            continue
+        # The extracted text often breaks lines differently than the quote of the model
+        match = re.search(r"\s+".join(re.escape(word) for word in text.split()), page_text)
+        if match is None:
+            return None
+        spans.append((match.start(), match.end(), item))
+
+    spans.sort(key=lambda span: span[0])
+    located = []
+    for span in spans:
+        if located and span[0] < located[-1][1]:
+            # Overlapping quotes are covered by the replacement of the first one
+            continue
+        located.append(span)
+    return located
+
+
+def request_replacements(page_text: str, spans: List[Tuple[int, int, Dict[str, Any]]], country: str) -> List[str]:
+    """
+    Ask the model for a compliant replacement of each flagged text of a page.
+
+    Args:
+        page_text: The text of the page, sent as context
+        spans: The flagged texts, see locate_spans
+        country: The country for which to ensure compliance
+
+    Returns:
+        The replacement of each flagged text, in the target language
+    """
+    if not spans:
+        return []
+
+    language = COUNTRY_LANGUAGE_DESCRIPTION.get(country, "")
+    system_instruction = f"You are a senior compliance officer for pharmaceutical regulations in {country}."
+    findings = json.dumps({
+        str(index): {"Text": page_text[start:end], "Reason": item.get("Reason", "")}
+        for index, (start, end, item) in enumerate(spans, start=1)
+    }, ensure_ascii=False, indent=2)
+
+    user_instruction = f"""
+    The following texts of a document do not comply with official {country} medical norms:
+    {findings}
+
+    Page content, for context only:
+    {page_text}
+
+    For each numbered text, write a replacement in {language} that complies with official {country} medical norms, keeps the original meaning as far as possible and fits in the page in place of the text.
+    Return a JSON object mapping each number to its replacement text, and nothing else.
+    """
+
+    schema = {
+        "type": "object",
+        "properties": {str(index): {"type": "string"} for index in range(1, len(spans) + 1)},
+        "required": [str(index) for index in range(1, len(spans) + 1)],
     }
+    response = "".join(get_backend(configuration.TRANSFORM_BACKEND).generate(
+        system_instruction, [user_instruction], response_schema=schema
+    ))
+    replacements = parse_json_response(response) or {}
 
-    # Make the API request
-    response = requests.post(api_url, headers=headers, json=data)
+    missing = [key for key in schema["required"] if not isinstance(replacements.get(key), str)]
+    if missing:
+        raise ValueError(f"no replacement returned for the flagged texts {', '.join(missing)}")
+    return [replacements[key] for key in schema["required"]]
 
-    if response.status_code != 200:
-        print(f"\nOpenAI API error: {response.status_code} - {response.text}\n")
-        raise Exception(f"OpenAI API error: {response.status_code} - {response.text}")
 
+def translate_texts(texts: List[str], country: str) -> List[str]:
+    """
+    Translate texts into the language of a country, paragraph by paragraph.
 
-    # Extract the response content
-    response_data = response.json()
-    transformed_content = response_data['choices'][0]['message']['content']
+    Paragraphs already translated before are taken from the translation memory; only the others
+    are sent to the model, in batches of at most configuration.TRANSLATION_BATCH_CHARS characters.
 
-    # Create a PDF with the transformed content
-    return create_pdf_from_text(transformed_content)
+    Args:
+        texts: The texts to translate
+        country: The country whose language to translate into
+
+    Returns:
+        The translated texts, with their surrounding whitespace preserved
+    """
+    language = COUNTRY_LANGUAGE_DESCRIPTION.get(country, "")
+    if not language:
+        return list(texts)
+
+    # Split the texts into paragraphs, keeping the separators so the layout can be restored
+    split_texts = [_PARAGRAPH_SEPARATOR.split(text) for text in texts]
+    segments = {
+        segment.strip()
+        for parts in split_texts for segment in parts[::2]
+        if any(char.isalpha() for char in segment)
+    }
 
-def create_pdf_from_text(text: str) -> str:
+    # Translations are only reused for the model that made them, e.g. never those of the fake backend
+    model = backend_model_id(configuration.TRANSFORM_BACKEND)
+    translations = {}
+    if configuration.TRANSLATION_MEMORY_ENABLED:
+        translations = get_translation_memory().get_many(language, segments, model)
+
+    # Only novel segments go to the model
+    missing = sorted(segments - set(translations))
+    batch: List[str] = []
+    batch_chars = 0
+    for index, segment in enumerate(missing):
+        batch.append(segment)
+        batch_chars += len(segment)
+        if batch_chars >= configuration.TRANSLATION_BATCH_CHARS or index == len(missing) - 1:
+            new_translations = _request_translations(batch, language)
+            translations.update(new_translations)
+            if configuration.TRANSLATION_MEMORY_ENABLED:
+                get_translation_memory().put_many(language, new_translations, model)
+            batch = []
+            batch_chars = 0
+
+    translated_texts = []
+    for parts in split_texts:
+        for index in range(0, len(parts), 2):
+            segment = parts[index].strip()
+            if segment in translations:
+                leading = parts[index][:len(parts[index]) - len(parts[index].lstrip())]
+                trailing = parts[index][len(parts[index].rstrip()):]
+                parts[index] = leading + translations[segment] + trailing
+        translated_texts.append("".join(parts))
+    return translated_texts
+
+
+def translate_page(page_text: str, country: str) -> str:
     """
-    Create a PDF file from a text.
+    Translate a page without compliance issues into the language of a country (see translate_texts).
 
     Args:
-        text: The text to include in the PDF
+        page_text: The text of the page
+        country: The country whose language to translate into
 
     Returns:
-        Path to the created PDF file
+        The translated text of the page
     """
-    # Create a temporary file for the PDF
-    fd, temp_path = tempfile.mkstemp(suffix='.pdf')
-    os.close(fd)
+    translated_text = translate_texts([page_text], country)[0]
+    metrics.TRANSFORMED_PAGES.inc(mode="translate")
+    return translated_text
+
+
+def _request_translations(segments: List[str], language: str) -> Dict[str, str]:
+    system_instruction = "You are a professional translator of pharmaceutical documents."
+    numbered = json.dumps({str(index): segment for index, segment in enumerate(segments, start=1)},
+                          ensure_ascii=False, indent=2)
+    user_instruction = f"""
+    Translate each of the following numbered text segments into {language}. Ensure each translation is accurate, maintains the original meaning and keeps any line breaks.
+    {numbered}
+
+    Return a JSON object mapping each number to its translation, and nothing else.
+    """
+
+    schema = {
+        "type": "object",
+        "properties": {str(index): {"type": "string"} for index in range(1, len(segments) + 1)},
+        "required": [str(index) for index in range(1, len(segments) + 1)],
+    }
+    response = "".join(get_backend(configuration.TRANSFORM_BACKEND).generate(
+        system_instruction, [user_instruction], response_schema=schema
+    ))
+    translated = parse_json_response(response) or {}
+
+    # Segments without a translation are kept as they are, and not cached
+    return {
+        segment: translated[str(index)]
+        for index, segment in enumerate(segments, start=1)
+        if isinstance(translated.get(str(index)), str)
+    }
 
-    # Create the PDF
-    doc = SimpleDocTemplate(temp_path, pagesize=letter)
-    styles = getSampleStyleSheet()
 
-    # Split the text into paragraphs
-    paragraphs = text.split('\n\n')
+def _submit(fn, *args) -> Future:
+    # Pages run in the context of the caller, so that their metrics carry the same labels
+    return _get_transform_executor().submit(copy_context().run, fn, *args)
 
-    # Create a list of followable
-    followable = []
-    for para in paragraphs:
-        if para.strip():
-            p = Paragraph(para.replace('\n', '<br/>'), styles['Normal'])
-            followable.append(p)
-            followable.append(Spacer(1, 12))
 
-    # Build the PDF
-    doc.build(followable)
+def _get_transform_executor() -> ThreadPoolExecutor:
+    global _transform_executor
+    if _transform_executor is None:
+        with _transform_executor_lock:
+            if _transform_executor is None:
+                _transform_executor = ThreadPoolExecutor(
+                    max_workers=configuration.TRANSFORM_MAX_WORKERS,
+                    thread_name_prefix="transform-page"
+                )
+    return _transform_executor
 
-    return temp_path
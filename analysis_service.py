@@ -0,0 +1,162 @@
+"""
+Module for running compliance analyses.
+This module ties the content processors to the AI service and turns the model response
+into the analysis data used by the web interface.
+"""
+
+from itertools import chain
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import metrics
+from ai_service import split_country_results
+from document_text import extract_text_from_pdf
+from processor import process_url, process_site, process_image, process_video
+from processor.document import analyze_document_data, read_document_file
+from structured_output import parse_analysis_response
+
+
+def run_analysis(
+    country: str,
+    content_type: str,
+    input_value: Optional[str] = None,
+    file_path: Optional[str] = None,
+    content_hash: Optional[str] = None,
+    on_chunk: Optional[Callable[[str], None]] = None
+) -> Dict[str, Any]:
+    """
+    Analyze a piece of content for compliance.
+
+    Args:
+        country: The country for which to check compliance
+        content_type: The type of content (URL, Website, Document, Image or Video)
+        input_value: The URL to analyze, or the start page of the site to crawl, for URL and Website content
+        file_path: Path to the uploaded file for the other content types
+        content_hash: SHA-256 digest of the uploaded file if already known
+        on_chunk: Optional callback receiving each chunk of the model response as it streams
+
+    Returns:
+        A dictionary with the analysis data to store in the session
+    """
+    result_text, file_type, document_data = _run_model(
+        country, content_type, input_value, file_path, content_hash, on_chunk
+    )
+
+    # Extract compliance status and other metrics from the result text
+    with metrics.analysis_labels(content_type, country), metrics.timed("parse"):
+        analysis_data = parse_analysis_response(result_text)
+
+    return _build_analysis(analysis_data, country, content_type, input_value, file_path, file_type, document_data)
+
+
+def run_multi_country_analysis(
+    countries: List[str],
+    content_type: str,
+    input_value: Optional[str] = None,
+    file_path: Optional[str] = None,
+    content_hash: Optional[str] = None,
+    on_chunk: Optional[Callable[[str], None]] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Analyze a piece of content for several countries with a single model call.
+
+    Args:
+        countries: The countries for which to check compliance
+        content_type: The type of content (URL, Website, Document, Image or Video)
+        input_value: The URL to analyze, or the start page of the site to crawl, for URL and Website content
+        file_path: Path to the uploaded file for the other content types
+        content_hash: SHA-256 digest of the uploaded file if already known
+        on_chunk: Optional callback receiving each chunk of the model response as it streams
+
+    Returns:
+        A dictionary mapping each country to its analysis data (see run_analysis)
+    """
+    result_text, file_type, document_data = _run_model(
+        countries, content_type, input_value, file_path, content_hash, on_chunk
+    )
+
+    with metrics.analysis_labels(content_type, countries), metrics.timed("parse"):
+        country_results = split_country_results(parse_analysis_response(result_text, schema=None), countries)
+
+    return {
+        country: _build_analysis(analysis_data, country, content_type, input_value, file_path, file_type, document_data)
+        for country, analysis_data in country_results.items()
+    }
+
+
+def _run_model(
+    country: Union[str, List[str]],
+    content_type: str,
+    input_value: Optional[str],
+    file_path: Optional[str],
+    content_hash: Optional[str],
+    on_chunk: Optional[Callable[[str], None]]
+) -> Tuple[str, Optional[str], Optional[bytes]]:
+    # Label the metrics of every stage of this analysis
+    with metrics.analysis_labels(content_type, country):
+        file_type = None
+        document_data = None
+
+        # Process the content based on the content type. The processors are generators, the content
+        # is only fetched, extracted and sent to the model when the first chunk is requested
+        with metrics.timed("process"):
+            if content_type == "URL":
+                chunks = process_url(url=input_value, country=country)
+            elif content_type == "Website":
+                chunks = process_site(url=input_value, country=country)
+            elif content_type == "Document":
+                # Read the document once, its contents are also needed for the original document text
+                document_data, file_type = read_document_file(file_path)
+                chunks = analyze_document_data(document_data, file_type, country)
+            elif content_type == "Image":
+                chunks = process_image(file_path=file_path, country=country, content_hash=content_hash)
+            elif content_type == "Video":
+                chunks = process_video(file_path=file_path, country=country, content_hash=content_hash)
+            else:
+                raise ValueError(f"Unsupported content type: {content_type}")
+            chunks = iter(chunks)
+            first_chunk = next(chunks, None)
+
+        result_chunks = []
+        with metrics.timed("response"):
+            for chunk in chain([] if first_chunk is None else [first_chunk], chunks):
+                result_chunks.append(chunk)
+                if on_chunk is not None:
+                    on_chunk(chunk)
+
+    return "".join(result_chunks), file_type, document_data
+
+
+def _build_analysis(
+    analysis_data: Dict[str, Any],
+    country: str,
+    content_type: str,
+    input_value: Optional[str],
+    file_path: Optional[str],
+    file_type: Optional[str],
+    document_data: Optional[bytes]
+) -> Dict[str, Any]:
+    analysis = {
+        'analysis_result': analysis_data.get("Detailed Analysis", "Error: No analysis result found."),
+        'compliance_status': analysis_data.get("Compliant Status", "Error: Compliance status not found."),
+        'is_compliant': str(analysis_data.get("Compliant Status", "")).lower() == "compliant",
+        'non_compliance_pages': analysis_data.get("Non-Compliant Pages", []),
+        'country': country,
+        'content_type': content_type,
+        'input_value': input_value if content_type in ("URL", "Website") else file_path,
+        'file_type': file_type,
+        'non_compliance_percentage': analysis_data.get("Non-Compliance Percentage", "0%"),
+    }
+
+    # Set the original document content if it's a document
+    if content_type == "Document" and file_path:
+        # Set original_document for both text files and PDFs
+        if file_type == "text/plain":
+            analysis['original_document'] = document_data.decode('utf-8', errors='ignore')
+        elif file_type == "application/pdf":
+            # For PDF files, extract the text content; it is cached for the transform step
+            analysis['original_document'] = extract_text_from_pdf(document_data)
+        else:
+            # For other non-text files, don't try to display the raw content
+            analysis['original_document'] = "Invalid file type. Only text files and PDFs are supported."
+
+    return analysis
@@ -1,37 +1,78 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file
+from flask import Flask, Response, g, render_template, request, jsonify, session, redirect, url_for, send_file
 import os
 import json
-import uuid
+import time
 from datetime import datetime
 from werkzeug.utils import secure_filename
 from flask_session import Session
 
 # Import custom modules
+import configuration
+import metrics
 from data.country_data import COUNTRY_LANGUAGE_DESCRIPTION
-from processor import process_document, process_url, process_image, process_video
 from processor.document import read_document_file
-from ai_service_transform import transform_document_with_openai
+from analysis_service import run_analysis
+from ai_service_transform import transform_document_text
+from result_cache import get_result_cache
+from result_store import get_result_store
+from translation_memory import get_translation_memory
+from site_crawler import get_page_cache
+from media_storage import save_stream
+from job_queue import get_job_queue, JOB_SUCCEEDED, JOB_FAILED
+from batch import expand_assets, run_batch
+from structured_output import IncrementalJSONParser
+from pdf_renderer import submit_render, wait_for_render
+from artifact_store import get_artifact_store, get_storage_manager
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
-
-# Configure a server-side session to prevent "cookie too large" warnings
-# This moves session data from client-side cookies to server-side storage,
-# which resolves issues with large session data exceeding the 4KB cookie size limit
-app.config['SESSION_TYPE'] = 'filesystem'  # Store sessions in files
-app.config['SESSION_FILE_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flask_session')
+# Use a shared SECRET_KEY when running several instances, so that each can read the session cookie
+app.secret_key = configuration.SECRET_KEY or os.urandom(24)
+app.config['MAX_CONTENT_LENGTH'] = configuration.MAX_UPLOAD_BYTES  # Uploads are streamed to disk, see save_upload
+
+# The session only holds the id of the current analysis, the analysis data itself lives in the
+# result store (see result_store.py). Flask's signed cookie session is enough for that, and a
+# server-side Flask-Session backend can still be selected with the SESSION_TYPE setting.
 app.config['SESSION_PERMANENT'] = False  # Sessions expire when the browser closes
-app.config['SESSION_USE_SIGNER'] = True  # Sign the session cookie for security
-Session(app)  # Initialize the server-side session
+if configuration.SESSION_TYPE != 'cookie':
+    app.config['SESSION_TYPE'] = configuration.SESSION_TYPE
+    app.config['SESSION_FILE_DIR'] = configuration.SESSION_FILE_DIR
+    app.config['SESSION_USE_SIGNER'] = True  # Sign the session cookie for security
+    Session(app)  # Initialize the server-side session
+
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    """Report uploads above the size limit with a clear message."""
+    return jsonify({
+        'error': f'The upload is larger than {configuration.MAX_UPLOAD_BYTES // (1024 * 1024)}MB, the largest file that '
+                 f'can be analyzed' + ('' if configuration.MEDIA_STAGING_URI else ' without media staging (MEDIA_STAGING_URI)')
+    }), 413
+
+
+# Registered first, so that the latency includes the other before_request hooks
+@app.before_request
+def start_request_timer():
+    """Record the start of the request for the request latency metric."""
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    """Record the time taken to produce the response."""
+    start = g.get('request_start')
+    if start is not None:
+        # Not set when an earlier before_request hook failed
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            endpoint=request.endpoint or 'unknown', method=request.method, status=response.status_code
+        )
+    return response
 
-# Create upload and session folders if they don't exist
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
 
-if not os.path.exists(app.config['SESSION_FILE_DIR']):
-    os.makedirs(app.config['SESSION_FILE_DIR'])
+@app.before_request
+def start_storage_sweeper():
+    """Start sweeping the uploads, sessions and generated files with the first request of the worker, not at import."""
+    get_storage_manager()
 
 
 @app.route('/')
@@ -40,10 +81,79 @@ def index():
     """Render the main page with the first tab active."""
     return render_template('index.html',
                            countries=list(COUNTRY_LANGUAGE_DESCRIPTION.keys()),
-                           content_types=["URL", "Document", "Image", "Video"],
+                           content_types=["URL", "Website", "Document", "Image", "Video"],
                            active_tab="analyze")
 
 
+def get_current_analysis() -> dict:
+    """
+    Load the analysis data of the current session from the result store.
+
+    Returns:
+        The analysis data, or None if the session has no (unexpired) analysis
+    """
+    analysis_id = session.get('analysis_id')
+    if analysis_id is None:
+        return None
+    return get_result_store().load(analysis_id)
+
+
+def set_current_analysis(analysis: dict) -> None:
+    """
+    Store analysis data in the result store and make it the analysis of the current session.
+
+    Args:
+        analysis: The analysis data
+    """
+    with metrics.timed("result_store_write"):
+        session['analysis_id'] = get_result_store().save(analysis)
+
+
+def save_upload(file) -> tuple[str, str]:
+    """
+    Save an uploaded file under a unique name in the upload storage.
+
+    The file is streamed to disk in chunks and hashed on the fly, so it is never held in memory.
+
+    Args:
+        file: The uploaded file from the request
+
+    Returns:
+        A tuple containing the path to the saved file and its SHA-256 digest
+    """
+    store = get_artifact_store("uploads")
+    upload_id = store.create(f"_{secure_filename(file.filename)}")
+    with metrics.timed("upload_save"):
+        digest, _ = save_stream(file.stream, store.temporary_path(upload_id))
+        return store.commit(upload_id), digest
+
+
+def get_analysis_input(content_type: str) -> tuple[str, str, str]:
+    """
+    Get the URL or save the uploaded file submitted for analysis.
+
+    Args:
+        content_type: The type of content (URL, Website, Document, Image or Video)
+
+    Returns:
+        A tuple containing the URL (for URL and Website content), and the path to the saved file and its
+        SHA-256 digest (for other content)
+    """
+    if content_type in ("URL", "Website"):
+        return request.form.get('input_value'), None, None
+
+    # Handle file upload
+    if 'file' not in request.files:
+        raise ValueError('No file part')
+
+    file = request.files['file']
+    if file.filename == '':
+        raise ValueError('No selected file')
+
+    file_path, content_hash = save_upload(file)
+    return None, file_path, content_hash
+
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
     """Process the content and analyze it."""
@@ -51,104 +161,194 @@ def analyze():
     country = request.form.get('country')
     content_type = request.form.get('content_type')
 
-    # Initialize variables
-    file_path = None
-    input_value = None
-    file_type = None
-
     try:
-        if content_type == "URL":
-            input_value = request.form.get('input_value')
-            # Process URL
-            result_text = ""
-            for chunk in process_url(url=input_value, country=country):
-                result_text += chunk
-        else:
-            # Handle file upload
-            if 'file' not in request.files:
-                return jsonify({'error': 'No file part'}), 400
-
-            file = request.files['file']
-            if file.filename == '':
-                return jsonify({'error': 'No selected file'}), 400
-
-            # Create a unique filename
-            filename = secure_filename(file.filename)
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            file.save(file_path)
-
-            # Process file based on content type
-            result_text = ""
-            if content_type == "Document":
-                for chunk in process_document(file_path=file_path, country=country):
-                    result_text += chunk
-                # Get a file type for later use
-                _, file_type = read_document_file(file_path)
-            elif content_type == "Image":
-                for chunk in process_image(file_path=file_path, country=country):
-                    result_text += chunk
-            elif content_type == "Video":
-                for chunk in process_video(file_path=file_path, country=country):
-                    result_text += chunk
-
-            input_value = file_path
-
-        # Extract compliance status and other metrics from the result text
-        json_data = extract_json_from_text(result_text)
-        analysis_data = json.loads(json_data)
-
-        # Determine compliance status
-        compliance_status = analysis_data.get("Compliant Status", "Error: Compliance status not found.")
-        is_compliant = analysis_data.get("Compliant Status", "").lower() == "compliant"
-        analysis_result = analysis_data.get("Detailed Analysis", "Error: No analysis result found.")
-        non_compliance_percentage = analysis_data.get("Non-Compliance Percentage", "0%")
-        non_compliance_pages = analysis_data.get("Non-Compliant Pages", [])
-
-        # Store data in session for use in other tabs
-        session['analysis_result'] = analysis_result
-        session['compliance_status'] = compliance_status
-        session['is_compliant'] = is_compliant
-        session['non_compliance_pages'] = non_compliance_pages
-        session['country'] = country
-        session['content_type'] = content_type
-        session['input_value'] = input_value
-        session['file_type'] = file_type
-        session['non_compliance_percentage'] = non_compliance_percentage
-
-        # Read the original document content if it's a document
-        if content_type == "Document" and file_path:
-            document_data, file_type = read_document_file(file_path)
-            # Set original_document for both text files and PDFs
-            if file_type == "text/plain":
-                session['original_document'] = document_data.decode('utf-8', errors='ignore')
-            elif file_type == "application/pdf":
-                # For PDF files, extract the text content
-                from ai_service import extract_text_from_pdf
-                pdf_text = extract_text_from_pdf(document_data)
-                session['original_document'] = pdf_text
-            else:
-                # For other non-text files, don't try to display the raw content
-                session['original_document'] = "Invalid file type. Only text files and PDFs are supported."
+        with metrics.analysis_labels(content_type, country):
+            input_value, file_path, content_hash = get_analysis_input(content_type)
+
+            # Run the analysis and store its data for use in other tabs
+            analysis = run_analysis(country, content_type, input_value=input_value, file_path=file_path,
+                                    content_hash=content_hash)
+            set_current_analysis(analysis)
 
         # Redirect to the result tab
         return redirect(url_for('results'))
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Submit the content for analysis as a background job and return the job id."""
+    # Get form data
+    country = request.form.get('country')
+    content_type = request.form.get('content_type')
+
+    try:
+        with metrics.analysis_labels(content_type, country):
+            input_value, file_path, content_hash = get_analysis_input(content_type)
+
+        job = get_job_queue().submit_streaming(run_analysis, country, content_type, input_value=input_value,
+                                               file_path=file_path, content_hash=content_hash)
+
+        return jsonify({
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': url_for('job_status', job_id=job.id),
+            'result_url': url_for('job_result', job_id=job.id),
+            'events_url': url_for('job_events', job_id=job.id),
+        }), 202
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/batch', methods=['POST'])
+def submit_batch():
+    """
+    Submit a batch of files, zip archives and URLs to analyze for several countries.
+
+    The form takes any number of 'files', 'urls' (one per field or one per line) and 'countries'.
+    The consolidated report is the result of the returned job.
+    """
+    countries = request.form.getlist('countries')
+    urls = [url.strip() for value in request.form.getlist('urls') for url in value.splitlines() if url.strip()]
+    files = [file for file in request.files.getlist('files') if file.filename]
+
+    if not countries:
+        return jsonify({'error': 'No countries selected'}), 400
+    # Checked before anything is saved or queued, a batch job is only reported when it is polled
+    unsupported = [country for country in countries if country not in COUNTRY_LANGUAGE_DESCRIPTION]
+    if unsupported:
+        return jsonify({'error': f'Unsupported country: {", ".join(unsupported)}'}), 400
+    if not urls and not files:
+        return jsonify({'error': 'No files or URLs submitted'}), 400
+
+    try:
+        # Save the uploads and unpack zip archives next to them
+        uploads = get_artifact_store("uploads")
+        batch_folder = uploads.make_directory(uploads.create("_batch"))
+        locations = [(url, url) for url in urls]
+        for file in files:
+            file_path, _ = save_upload(file)
+            locations.append((file.filename, file_path))
+        assets = expand_assets(locations, batch_folder)
+
+        job = get_job_queue().submit(run_batch, assets, countries)
+
+        return jsonify({
+            'job_id': job.id,
+            'status': job.status,
+            'assets': len(assets),
+            'status_url': url_for('job_status', job_id=job.id),
+            'result_url': url_for('job_result', job_id=job.id),
+        }), 202
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Return the status of an analysis job."""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Return the analysis data of a finished job."""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    if job.status == JOB_FAILED:
+        return jsonify({'error': job.error}), 500
+    if job.status != JOB_SUCCEEDED:
+        return jsonify(job.to_dict()), 202
+
+    return jsonify(job.result)
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Stream the model output of an analysis job to the browser as Server-Sent Events."""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    view_url = url_for('job_view', job_id=job.id)
+    # Resume after the last chunk the browser received when it reconnects
+    last_event_id = request.headers.get('Last-Event-ID', '0')
+    start = int(last_event_id) if last_event_id.isdigit() else 0
+
+    def sse(event, data, event_id=None):
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        return f"id: {event_id}\n{message}" if event_id is not None else message
+
+    def generate():
+        parser = IncrementalJSONParser(["Compliant Status", "Non-Compliance Percentage"])
+        seen = start
+        while True:
+            chunks, done = job.wait_for_chunks(seen, timeout=15)
+            for chunk in chunks:
+                seen += 1
+                yield sse('chunk', {'text': chunk}, event_id=seen)
+                # Send the summary fields as soon as they can be parsed from the partial response
+                for field, value in parser.feed(chunk):
+                    yield sse('field', {'name': field, 'value': value})
+
+            if done:
+                if job.status == JOB_FAILED:
+                    yield sse('failed', {'error': job.error})
+                else:
+                    yield sse('done', {'view_url': view_url})
+                return
+
+            if not chunks:
+                # Keep the connection open through proxies while the model is thinking
+                yield ": keep-alive\n\n"
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/jobs/<job_id>/view')
+def job_view(job_id):
+    """Make the analysis data of a finished job the current analysis and show the result tab."""
+    job = get_job_queue().get(job_id)
+    if job is None or job.status != JOB_SUCCEEDED:
+        return redirect(url_for('index'))
+
+    # Batch jobs produce a consolidated report rather than a single analysis
+    if not isinstance(job.result, dict) or 'compliance_status' not in job.result:
+        return redirect(url_for('job_result', job_id=job_id))
+
+    set_current_analysis(job.result)
+    return redirect(url_for('results'))
+
+
 @app.route('/results')
 def results():
     """Render the result tab."""
-    if 'analysis_result' not in session:
+    analysis = get_current_analysis()
+    if analysis is None:
         return redirect(url_for('index'))
 
     # Get original document content if available
-    original_document = session.get('original_document', '')
+    original_document = analysis.get('original_document', '')
 
     # Get the analysis data and sanitize the non-compliant sections
-    non_compliance_pages = session.get('non_compliance_pages', {})
+    non_compliance_pages = analysis.get('non_compliance_pages', {})
 
     # Process each non-compliant page to ensure all control characters are properly escaped
     for page in non_compliance_pages:
@@ -166,11 +366,11 @@ def results():
         non_compliance_pages["Detailed Analysis"] = non_compliance_pages["Detailed Analysis"].replace("\n", "\\n").replace("\r", "\\r")
 
     return render_template('results.html',
-                           compliance_status=session['compliance_status'],
-                           is_compliant= session['is_compliant'],
-                           non_compliance_pages=session['non_compliance_pages'],
-                           non_compliance_percentage=session['non_compliance_percentage'],
-                           analysis_result=session['analysis_result'],
+                           compliance_status=analysis['compliance_status'],
+                           is_compliant= analysis['is_compliant'],
+                           non_compliance_pages=analysis['non_compliance_pages'],
+                           non_compliance_percentage=analysis['non_compliance_percentage'],
+                           analysis_result=analysis['analysis_result'],
                            original_document=original_document,
                            active_tab="results")
 
@@ -178,7 +378,8 @@ def results():
 @app.route('/transform')
 def transform():
     """Render the transform tab."""
-    if 'analysis_result' not in session or session.get('is_compliant', True):
+    analysis = get_current_analysis()
+    if analysis is None or analysis.get('is_compliant', True):
         return redirect(url_for('index'))
 
     return render_template('transform.html', active_tab="transform")
@@ -187,37 +388,44 @@ def transform():
 @app.route('/transform_document', methods=['POST'])
 def transform_document():
     """Transform the document to make it compliant."""
-    if 'analysis_result' not in session:
+    analysis = get_current_analysis()
+    if analysis is None:
         return jsonify({'error': 'No analysis result found'}), 400
 
     try:
-        # Get data from the session
-        analysis_result = session['analysis_result']
-        input_value = session['input_value']
-        non_compliance_pages = session['non_compliance_pages']
-        country = session['country']
-        file_type = session['file_type']
+        # Get the analysis data
+        analysis_result = analysis['analysis_result']
+        input_value = analysis['input_value']
+        non_compliance_pages = analysis['non_compliance_pages']
+        country = analysis['country']
+        file_type = analysis['file_type']
 
         # Read the document file
         document_data, _ = read_document_file(input_value)
 
-        # Transform the document
-        transformed_pdf_path = transform_document_with_openai(
-            analysis_result,
-            document_data,
-            non_compliance_pages,
-            file_type,
-            country
-        )
+        with metrics.analysis_labels(analysis['content_type'], country):
+            # Transform the document
+            transformed_text = transform_document_text(
+                analysis_result,
+                document_data,
+                non_compliance_pages,
+                file_type,
+                country
+            )
+
+            # Render the PDF in the background, the download waits for it if needed
+            artifact_id = submit_render(transformed_text)
 
         # Create a unique filename for the transformed document
         base_filename = os.path.splitext(os.path.basename(input_value))[0]
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_filename = f"{base_filename}_transformed_{timestamp}.pdf"
 
-        # Store the path in session for download
-        session['transformed_pdf_path'] = transformed_pdf_path
-        session['transformed_pdf_filename'] = output_filename
+        # Store the artifact with the analysis for download
+        get_result_store().update(session['analysis_id'], {
+            'transformed_artifact_id': artifact_id,
+            'transformed_pdf_filename': output_filename,
+        })
 
         return jsonify({'success': True, 'message': 'Document transformed successfully'})
 
@@ -228,164 +436,56 @@ def transform_document():
 @app.route('/download_transformed')
 def download_transformed():
     """Download the transformed document."""
-    if 'transformed_pdf_path' not in session:
+    analysis = get_current_analysis()
+    if analysis is None or 'transformed_artifact_id' not in analysis:
         return redirect(url_for('index'))
 
-    return send_file(
-        session['transformed_pdf_path'],
-        as_attachment=True,
-        download_name=session['transformed_pdf_filename']
-    )
-
-
-def extract_json_from_text(text):
-    """Extract JSON from text that might contain Markdown or other formatting."""
-    if not text:
-        return "{}"
-
-    # Try to find JSON between triple backticks (Markdown code blocks)
-    import re
-    json_pattern = r'```(?:json)?\s*([\s\S]*?)\s*```'
-    matches = re.findall(json_pattern, text)
-
-    if matches:
-        # Try each match until we find valid JSON
-        for match in matches:
-            try:
-                # Validate that this is actually JSON
-                json.loads(match.strip())
-                return match.strip()
-            except json.JSONDecodeError:
-                continue
-
-    # If no valid JSON found in code blocks, try to find JSON objects directly
-    # Look for text that starts with { and ends with }
-    json_pattern = r'(\{[\s\S]*?\})'
-    matches = re.findall(json_pattern, text)
-
-    if matches:
-        # Sort matches by length (descending) to try the largest JSON objects first
-        matches.sort(key=len, reverse=True)
-
-        # Try each match until we find valid JSON
-        for match in matches:
-            try:
-                # Validate that this is actually JSON
-                json.loads(match.strip())
-                return match.strip()
-            except json.JSONDecodeError:
-                continue
-
-    # If we still haven't found valid JSON, try to create a basic JSON structure
-    # Look for key patterns like "Compliant Status: X" and convert to JSON
     try:
-        result = {}
-
-        # Extract compliance status (the new format uses "Compliant Status")
-        status_match = re.search(r'Compliant Status:?\s*([A-Za-z\s]+)', text, re.IGNORECASE)
-        if status_match:
-            result["Compliant Status"] = status_match.group(1).strip()
-        else:
-            # Try an old format as a fallback
-            status_match = re.search(r'Compliance Status:?\s*([A-Za-z\s]+)', text, re.IGNORECASE)
-            if status_match:
-                result["Compliant Status"] = status_match.group(1).strip()
-
-        # Extract percentage (a new format uses "Non-Compliance Percentage")
-        percentage_match = re.search(r'Non-Compliance Percentage:?\s*(\d+(?:\.\d+)?)\s*%?', text, re.IGNORECASE)
-        if percentage_match:
-            result["Non-Compliance Percentage"] = percentage_match.group(1).strip() + "%"
-        else:
-            # Try an old format as a fallback
-            percentage_match = re.search(r'Percentage of Non-Compliance:?\s*(\d+(?:\.\d+)?)\s*%?', text, re.IGNORECASE)
-            if percentage_match:
-                result["Non-Compliance Percentage"] = percentage_match.group(1).strip() + "%"
-
-        # Extract detailed analysis
-        detailed_analysis_match = re.search(r'Detailed Analysis:?\s*([^\n]+(?:\n[^\n]+)*?)(?:\n\n|\n(?=Non-Compliant Pages))', text, re.IGNORECASE)
-        if detailed_analysis_match:
-            result["Detailed Analysis"] = detailed_analysis_match.group(1).strip()
-
-        # Extract non-compliant pages
-        pages = []
-
-        # Try to find page blocks
-        page_blocks = re.finditer(
-            r'Page Number:?\s*(\d+)(?:\s*Percentage of Non-Compliance:?\s*(\d+(?:\.\d+)?)\s*%?)?', 
-            text, re.IGNORECASE
-        )
-
-        for page_match in page_blocks:
-            page_number = page_match.group(1).strip()
-            page_percentage = page_match.group(2).strip() + "%" if page_match.group(2) else "100%"
-
-            # Find the start position of this page block
-            start_pos = page_match.start()
+        transformed_pdf_path = wait_for_render(analysis['transformed_artifact_id'])
+    except Exception as e:
+        return jsonify({'error': f'Error rendering the transformed document: {str(e)}'}), 500
 
-            # Find the next page block or end of a text
-            next_page_match = re.search(r'Page Number:?\s*\d+', text[start_pos + 1:], re.IGNORECASE)
-            end_pos = start_pos + 1 + next_page_match.start() if next_page_match else len(text)
+    if transformed_pdf_path is None:
+        # The transformed document has expired, it has to be transformed again
+        return redirect(url_for('index'))
 
-            # Extract the page block text
-            page_block_text = text[start_pos:end_pos]
+    return send_file(
+        transformed_pdf_path,
+        as_attachment=True,
+        download_name=analysis['transformed_pdf_filename']
+    )
 
-            # Extract non-compliant text items
-            non_compliant_texts = []
-            text_blocks = re.finditer(
-                r'Text:?\s*([^\n]+)(?:\s*Reason:?\s*([^\n]+))?', 
-                page_block_text, re.IGNORECASE
-            )
 
-            for text_match in text_blocks:
-                text_item = {
-                    "Text": text_match.group(1).strip() if text_match.group(1) else "",
-                    "Reason": text_match.group(2).strip() if text_match.group(2) else "No reason provided"
-                }
-                non_compliant_texts.append(text_item)
-
-            page = {
-                "Page Number": page_number,
-                "Percentage of Non-Compliance": page_percentage,
-                "Non-Compliant Text": non_compliant_texts
-            }
-            pages.append(page)
-
-        if pages:
-            result["Non-Compliant Pages"] = pages
-        else:
-            # Fallback to old format if no pages found
-            sections = []
-            section_matches = re.finditer(
-                r'Headline:?\s*([^\n]+)(?:\s*Details:?\s*([^\n]+))?(?:\s*Percentage:?\s*(\d+(?:\.\d+)?)\s*%?)?', text,
-                re.IGNORECASE)
-
-            for match in section_matches:
-                section = {
-                    "Headline": match.group(1).strip() if match.group(1) else "Unknown Section",
-                    "Details": match.group(2).strip() if match.group(2) else "No details available",
-                    "Percentage": match.group(3).strip() + "%" if match.group(3) else "0%"
-                }
-                sections.append(section)
-
-            if sections:
-                result["Non-Compliant Sections"] = sections
-            else:
-                result["Non-Compliant Pages"] = []
-
-        # If we have at least some data, return the constructed JSON
-        if len(result) > 0:
-            return json.dumps(result)
-    except Exception as e:
-        print(f"Error parsing text: {str(e)}")
-        pass
-
-    # If all else fails, return a default JSON structure
-    return json.dumps({
-        "Compliant Status": "Unknown",
-        "Non-Compliance Percentage": "0%",
-        "Detailed Analysis": "No detailed analysis available.",
-        "Non-Compliant Pages": []
-    })
+@app.route('/cache_stats')
+def cache_stats():
+    """Return the counters of the analysis result cache, translation memory and crawled page cache, and the storage usage."""
+    stats = get_result_cache().stats()
+    stats['translation_memory'] = get_translation_memory().stats()
+    stats['crawl_cache'] = get_page_cache().stats()
+    stats['storage'] = get_storage_manager().stats()
+    return jsonify(stats)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Return the latency, size, cache and storage metrics in the Prometheus text format."""
+    for category, store_stats in get_storage_manager().stats().items():
+        metrics.STORAGE_FILES.set(store_stats['files'], category=category)
+        metrics.STORAGE_BYTES.set(store_stats['bytes'], category=category)
+        metrics.STORAGE_REMOVED.set(store_stats['expired'], category=category, reason='expired')
+        metrics.STORAGE_REMOVED.set(store_stats['evicted'], category=category, reason='evicted')
+
+    caches = {
+        'result_cache': get_result_cache().stats(),
+        'translation_memory': get_translation_memory().stats(),
+        'crawl_cache': get_page_cache().stats(),
+    }
+    for cache, cache_stats in caches.items():
+        for event in ('hits', 'misses', 'stores', 'evictions'):
+            metrics.CACHE_EVENTS.set(cache_stats[event], cache=cache, event=event)
+        metrics.CACHE_ENTRIES.set(cache_stats['entries'], cache=cache)
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,357 @@
+"""
+Module for storing the files written by the application: uploads, server-side sessions and
+generated files such as the transformed PDF documents.
+This module keeps each category of files in a managed directory, sharded by the first characters
+of the file ids, and a background sweeper removes the files older than the TTL of their category
+and the oldest files beyond its quota, so that disk usage stays bounded.
+"""
+
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import configuration
+
+# Artifact ids are generated by the store, anything else is rejected to stay inside its directory
+_ARTIFACT_ID = re.compile(r'^[0-9a-f]{32}[A-Za-z0-9_.-]*$')
+# Files of artifacts still being written: the temporary content and the pending marker of a render
+_IN_PROGRESS_SUFFIXES = (".tmp", ".pending")
+
+
+class ArtifactStore:
+    """
+    Directory of files that expire after a TTL, with an optional quota on their total size.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: int, max_bytes: int = 0, sharded: bool = True,
+                 min_age_seconds: int = 60):
+        """
+        Args:
+            directory: Directory holding the artifacts
+            ttl_seconds: Time after which an artifact expires
+            max_bytes: Maximum total size of the artifacts, the oldest ones are removed beyond it; 0 for no quota
+            sharded: Whether artifacts are spread over subdirectories named after the first characters of their id
+            min_age_seconds: Artifacts younger than this are never removed to enforce the quota, as
+                they may still be in use by the request that created them or a later step of the same
+                analysis, e.g. its transformation
+        """
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.sharded = sharded
+        self.min_age_seconds = min_age_seconds
+        self._lock = threading.Lock()
+        self._files = 0
+        self._bytes = 0
+        self._expired = 0
+        self._evicted = 0
+        # The existing files are counted by the first sweep of the storage manager
+        os.makedirs(directory, exist_ok=True)
+
+    def create(self, suffix: str = "") -> str:
+        """
+        Reserve the id of a new artifact.
+
+        The artifact exists once its content has been written to temporary_path and committed.
+
+        Args:
+            suffix: End of the artifact file name, e.g. ".pdf"
+
+        Returns:
+            The artifact id
+        """
+        return uuid.uuid4().hex + suffix
+
+    def path(self, artifact_id: str) -> str:
+        """
+        Get the path of an artifact, whether it exists or not.
+
+        Args:
+            artifact_id: The artifact id
+
+        Returns:
+            The path of the artifact file
+        """
+        if not _ARTIFACT_ID.match(artifact_id):
+            raise ValueError(f"Invalid artifact id: {artifact_id}")
+        if self.sharded:
+            return os.path.join(self.directory, artifact_id[:2], artifact_id)
+        return os.path.join(self.directory, artifact_id)
+
+    def temporary_path(self, artifact_id: str) -> str:
+        """
+        Get the path to write the content of an artifact to before committing it.
+
+        Args:
+            artifact_id: The artifact id
+
+        Returns:
+            The temporary path
+        """
+        path = self.path(artifact_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path + ".tmp"
+
+    def commit(self, artifact_id: str) -> str:
+        """
+        Publish an artifact written to its temporary path, so readers never see a partial file.
+
+        Args:
+            artifact_id: The artifact id
+
+        Returns:
+            The path of the artifact
+        """
+        path = self.path(artifact_id)
+        os.replace(path + ".tmp", path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._files += 1
+            self._bytes += size
+        return path
+
+    def make_directory(self, artifact_id: str) -> str:
+        """
+        Create an artifact that is a directory, e.g. to unpack an archive into.
+
+        The files of the directory expire one by one and the directory is removed once empty.
+
+        Args:
+            artifact_id: The artifact id
+
+        Returns:
+            The path of the directory
+        """
+        path = self.path(artifact_id)
+        os.makedirs(path)
+        return path
+
+    def get(self, artifact_id: str) -> Optional[str]:
+        """
+        Look up an artifact.
+
+        Args:
+            artifact_id: The artifact id
+
+        Returns:
+            The path of the artifact, or None if it does not exist or has expired
+        """
+        try:
+            path = self.path(artifact_id)
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                return None
+        except (ValueError, OSError):
+            return None
+        return path
+
+    def sweep(self) -> int:
+        """
+        Remove the expired artifacts, abandoned temporary files and empty directories, then the
+        oldest artifacts while the quota is exceeded, and recount the size of the store.
+
+        Returns:
+            The number of removed files
+        """
+        now = time.time()
+        expired = 0
+        files = []
+        for root, _, names in os.walk(self.directory, topdown=False):
+            for name in names:
+                if name.startswith("__"):
+                    # Bookkeeping files of the session backend
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                    if now - stat.st_mtime > self.ttl_seconds:
+                        os.remove(path)
+                        expired += 1
+                    else:
+                        files.append((stat.st_mtime, stat.st_size, path))
+                except OSError:
+                    # Removed concurrently by another worker
+                    continue
+            if root != self.directory:
+                try:
+                    # Freshly created directories are about to be written to
+                    if now - os.path.getmtime(root) > self.min_age_seconds and not os.listdir(root):
+                        os.rmdir(root)
+                except OSError:
+                    continue
+
+        total = sum(size for _, size, _ in files)
+        evicted = 0
+        if self.max_bytes and total > self.max_bytes:
+            files.sort()
+            paths = {path for _, _, path in files}
+            for mtime, size, path in files:
+                if total <= self.max_bytes or now - mtime < self.min_age_seconds:
+                    break
+                if path.endswith(_IN_PROGRESS_SUFFIXES) or path + ".pending" in paths:
+                    # Still being written, e.g. a PDF render, which only expires with the TTL
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                evicted += 1
+
+        with self._lock:
+            self._files = len(files) - evicted
+            self._bytes = total
+            self._expired += expired
+            self._evicted += evicted
+        return expired + evicted
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the size of the store and its removal counters.
+
+        Returns:
+            A dictionary with the number of files and bytes held (as of the last sweep, plus the
+            artifacts committed since), the quota, and the number of expired and evicted files
+        """
+        with self._lock:
+            return {
+                "files": self._files,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "expired": self._expired,
+                "evicted": self._evicted,
+            }
+
+
+class StorageManager:
+    """
+    Set of artifact stores, one per category of files, swept periodically by a background thread.
+    """
+
+    def __init__(self, stores: Dict[str, ArtifactStore], sweep_interval_seconds: int):
+        """
+        Args:
+            stores: The artifact stores by category
+            sweep_interval_seconds: Time between two sweeps of all the stores
+        """
+        self.stores = stores
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def store(self, category: str) -> ArtifactStore:
+        """
+        Get the artifact store of a category.
+
+        Args:
+            category: The category of files
+
+        Returns:
+            The ArtifactStore of the category
+        """
+        if category not in self.stores:
+            raise ValueError(f"Unknown storage category: {category}")
+        return self.stores[category]
+
+    def sweep(self) -> Dict[str, int]:
+        """
+        Sweep all the stores.
+
+        Returns:
+            A dictionary mapping each category to the number of removed files
+        """
+        removed = {}
+        for category, store in self.stores.items():
+            try:
+                removed[category] = store.sweep()
+            except Exception as e:
+                print(f"Error sweeping the {category} storage: {str(e)}")
+        return removed
+
+    def start(self) -> None:
+        """
+        Start the background sweeper thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="storage-sweeper", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background sweeper thread.
+        """
+        self._stopped.set()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the statistics of all the stores.
+
+        Returns:
+            A dictionary mapping each category to the statistics of its store
+        """
+        return {category: store.stats() for category, store in self.stores.items()}
+
+    def _run(self) -> None:
+        # The first sweep runs right away, in the background rather than in the starting process
+        self.sweep()
+        while not self._stopped.wait(self.sweep_interval_seconds):
+            self.sweep()
+
+
+_storage_manager = None
+_storage_manager_lock = threading.Lock()
+
+
+def get_storage_manager() -> StorageManager:
+    """
+    Get the process-wide storage manager, creating it and starting its sweeper on first use.
+
+    Returns:
+        The shared StorageManager instance
+    """
+    global _storage_manager
+    if _storage_manager is None:
+        with _storage_manager_lock:
+            if _storage_manager is None:
+                stores = {
+                    "uploads": ArtifactStore(
+                        configuration.UPLOAD_DIR,
+                        configuration.UPLOAD_TTL_SECONDS,
+                        configuration.UPLOAD_QUOTA_BYTES,
+                        min_age_seconds=configuration.STORAGE_MIN_EVICTION_AGE_SECONDS
+                    ),
+                    "artifacts": ArtifactStore(
+                        configuration.ARTIFACT_DIR,
+                        configuration.ARTIFACT_TTL_SECONDS,
+                        configuration.ARTIFACT_QUOTA_BYTES,
+                        min_age_seconds=configuration.STORAGE_MIN_EVICTION_AGE_SECONDS
+                    ),
+                }
+                if configuration.SESSION_TYPE == "filesystem":
+                    # The session backend names its files itself, they are only swept
+                    stores["sessions"] = ArtifactStore(
+                        configuration.SESSION_FILE_DIR,
+                        configuration.SESSION_FILE_TTL_SECONDS,
+                        configuration.SESSION_FILE_QUOTA_BYTES,
+                        sharded=False,
+                        min_age_seconds=configuration.STORAGE_MIN_EVICTION_AGE_SECONDS
+                    )
+                manager = StorageManager(stores, configuration.STORAGE_SWEEP_INTERVAL_SECONDS)
+                manager.start()
+                _storage_manager = manager
+    return _storage_manager
+
+
+def get_artifact_store(category: str = "artifacts") -> ArtifactStore:
+    """
+    Get the process-wide artifact store of a category.
+
+    Args:
+        category: The category of files (uploads, artifacts or sessions)
+
+    Returns:
+        The shared ArtifactStore instance
+    """
+    return get_storage_manager().store(category)
@@ -0,0 +1,255 @@
+"""
+Module for analyzing many assets for several countries in one batch.
+This module fans a list of files, zip archives and URLs out through the regular analysis for each
+selected country with bounded concurrency, and consolidates the results into a single report.
+
+It can also be used from the command line:
+    python batch.py --country Switzerland --country Mexico campaign.zip https://example.com flyer.pdf
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import configuration
+from data.country_data import COUNTRY_LANGUAGE_DESCRIPTION
+
+# Content type used for each supported file extension
+CONTENT_TYPES_BY_EXTENSION = {
+    '.pdf': "Document",
+    '.txt': "Document",
+    '.jpeg': "Image",
+    '.jpg': "Image",
+    '.png': "Image",
+    '.mp4': "Video",
+    '.webm': "Video",
+    '.mkv': "Video",
+}
+
+
+def is_url(location: str) -> bool:
+    return location.startswith(('http://', 'https://'))
+
+
+def get_content_type(location: str) -> str:
+    """
+    Determine the content type of an asset.
+
+    Args:
+        location: A URL or the path to a file
+
+    Returns:
+        The content type (URL, Document, Image or Video)
+    """
+    if is_url(location):
+        return "URL"
+
+    file_extension = os.path.splitext(location)[1].lower()
+    if file_extension not in CONTENT_TYPES_BY_EXTENSION:
+        raise ValueError(f"Unsupported file type: {file_extension}")
+    return CONTENT_TYPES_BY_EXTENSION[file_extension]
+
+
+def extract_zip(zip_path: str, destination: str) -> List[Tuple[str, str]]:
+    """
+    Extract the supported files of a zip archive.
+
+    Archives with more than configuration.BATCH_ZIP_MAX_MEMBERS entries, or whose supported files
+    add up to more than configuration.MAX_UPLOAD_BYTES uncompressed, are rejected.
+
+    Args:
+        zip_path: Path to the zip archive
+        destination: Directory to extract the files to
+
+    Returns:
+        A list of tuples containing the name of each file in the archive and the path it was extracted to
+    """
+    assets = []
+    with zipfile.ZipFile(zip_path) as archive:
+        members = []
+        for index, info in enumerate(archive.infolist()):
+            name = info.filename
+            base_name = os.path.basename(name)
+            # Skip directories, hidden files and macOS resource forks
+            if info.is_dir() or not base_name or base_name.startswith('.') or name.startswith('__MACOSX/'):
+                continue
+            if os.path.splitext(base_name)[1].lower() not in CONTENT_TYPES_BY_EXTENSION:
+                continue
+            members.append((index, info, base_name))
+
+        # Check the sizes declared by the archive before writing anything
+        if len(archive.infolist()) > configuration.BATCH_ZIP_MAX_MEMBERS:
+            raise ValueError(f"Too many files in {os.path.basename(zip_path)}, "
+                             f"the limit is {configuration.BATCH_ZIP_MAX_MEMBERS}")
+        if sum(info.file_size for _, info, _ in members) > configuration.MAX_UPLOAD_BYTES:
+            raise ValueError(f"The files in {os.path.basename(zip_path)} are larger than the upload limit")
+
+        total_size = 0
+        for index, info, base_name in members:
+            # Never use the archive paths on disk, they could point outside of the destination
+            file_path = os.path.join(destination, f"{index}_{base_name}")
+            with archive.open(info) as source, open(file_path, "wb") as target:
+                while True:
+                    chunk = source.read(configuration.UPLOAD_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    # The declared sizes are not trusted, the extracted data is counted as well
+                    total_size += len(chunk)
+                    if total_size > configuration.MAX_UPLOAD_BYTES:
+                        raise ValueError(f"The files in {os.path.basename(zip_path)} are larger than the upload limit")
+                    target.write(chunk)
+            assets.append((info.filename, file_path))
+
+    return assets
+
+
+def expand_assets(locations: List[Tuple[str, str]], destination: str) -> List[Tuple[str, str]]:
+    """
+    Replace the zip archives in a list of assets by the files they contain.
+
+    Args:
+        locations: A list of tuples containing the name and the URL or file path of each asset
+        destination: Directory to extract zip archives to
+
+    Returns:
+        A list of tuples containing the name and the URL or file path of each asset
+    """
+    assets = []
+    for name, location in locations:
+        if not is_url(location) and location.lower().endswith('.zip'):
+            assets.extend(
+                (f"{name}/{member}", path) for member, path in extract_zip(location, destination)
+            )
+        else:
+            assets.append((name, location))
+    return assets
+
+
+def run_batch(
+    assets: List[Tuple[str, str]],
+    countries: List[str],
+    max_workers: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Analyze every asset for every country.
+
+    Args:
+        assets: A list of tuples containing the name and the URL or file path of each asset
+        countries: The countries for which to check compliance
+        max_workers: Maximum number of concurrent analyses, configuration.BATCH_MAX_WORKERS by default
+
+    Returns:
+        The consolidated report
+    """
+    for country in countries:
+        if country not in COUNTRY_LANGUAGE_DESCRIPTION:
+            raise ValueError(f"Unsupported country: {country}")
+
+    # Imported here so that the batch helpers can be used without loading the AI services
+    from analysis_service import run_analysis, run_multi_country_analysis
+
+    def analyze(name: str, location: str, asset_countries: List[str]) -> List[Dict[str, Any]]:
+        entries = [{"asset": name, "country": country} for country in asset_countries]
+        try:
+            content_type = get_content_type(location)
+            for entry in entries:
+                entry["content_type"] = content_type
+            if content_type == "URL":
+                arguments = {"input_value": location}
+            else:
+                arguments = {"file_path": location}
+            if len(asset_countries) > 1:
+                # A single model call covers every country of the asset
+                analyses = run_multi_country_analysis(asset_countries, content_type, **arguments)
+            else:
+                analyses = {asset_countries[0]: run_analysis(asset_countries[0], content_type, **arguments)}
+        except Exception as e:
+            for entry in entries:
+                entry.update({"status": "failed", "error": str(e)})
+            return entries
+
+        for entry in entries:
+            analysis = analyses[entry["country"]]
+            entry.update({
+                "status": "succeeded",
+                "compliance_status": analysis["compliance_status"],
+                "is_compliant": analysis["is_compliant"],
+                "non_compliance_percentage": analysis["non_compliance_percentage"],
+                "analysis_result": analysis["analysis_result"],
+                "non_compliance_pages": analysis["non_compliance_pages"],
+            })
+        return entries
+
+    if configuration.BATCH_MULTI_COUNTRY:
+        tasks = [(name, location, countries) for name, location in assets]
+    else:
+        tasks = [(name, location, [country]) for name, location in assets for country in countries]
+
+    with ThreadPoolExecutor(max_workers=max_workers or configuration.BATCH_MAX_WORKERS) as executor:
+        futures = [executor.submit(analyze, *task) for task in tasks]
+        results = [entry for future in futures for entry in future.result()]
+
+    return build_report(results, len(assets), countries)
+
+
+def build_report(results: List[Dict[str, Any]], asset_count: int, countries: List[str]) -> Dict[str, Any]:
+    """
+    Consolidate the results of a batch into a report with per-country totals.
+
+    Args:
+        results: The result of each (asset, country) analysis
+        asset_count: The number of analyzed assets
+        countries: The countries for which compliance was checked
+
+    Returns:
+        The report
+    """
+    summary = {country: {"compliant": 0, "non_compliant": 0, "failed": 0} for country in countries}
+    for result in results:
+        totals = summary[result["country"]]
+        if result["status"] == "failed":
+            totals["failed"] += 1
+        elif result["is_compliant"]:
+            totals["compliant"] += 1
+        else:
+            totals["non_compliant"] += 1
+
+    return {
+        "assets": asset_count,
+        "countries": countries,
+        "analyses": len(results),
+        "failed": sum(totals["failed"] for totals in summary.values()),
+        "summary": summary,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a batch of files, zip archives and URLs for compliance.")
+    parser.add_argument("assets", nargs="+", help="files, zip archives or URLs to analyze")
+    parser.add_argument("--country", dest="countries", action="append", required=True,
+                        choices=list(COUNTRY_LANGUAGE_DESCRIPTION.keys()), help="country to check (repeatable)")
+    parser.add_argument("--workers", type=int, default=configuration.BATCH_MAX_WORKERS,
+                        help="maximum number of concurrent analyses")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as extract_dir:
+        assets = expand_assets([(location, location) for location in args.assets], extract_dir)
+        report = run_batch(assets, args.countries, max_workers=args.workers)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
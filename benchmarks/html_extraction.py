@@ -0,0 +1,120 @@
+"""
+Benchmark of the extraction of the text of web pages.
+Compares the previous BeautifulSoup extraction (full document tree, then removal of scripts,
+styles and navigation chrome) with the streaming extractor of html_text, on synthetic product
+pages with heavy navigation, inline scripts and a long content section. Reports the time and
+the peak memory allocated by each, and whether both extract the same text.
+
+The previous extraction requires beautifulsoup4, which the application no longer depends on:
+install it with `pip install -r benchmarks/requirements.txt`.
+
+Usage:
+    python benchmarks/html_extraction.py [--sizes 200 2000 10000] [--chunk-size 65536]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from html_text import stream_html_to_text
+
+_CHROME_TAGS = ["nav", "header", "footer", "aside", "form", "noscript", "svg", "iframe", "button"]
+_CHROME_ROLES = {"navigation", "banner", "contentinfo", "search", "dialog"}
+_CHROME_NAMES = {
+    "cookie-banner", "cookie-bar", "cookie-consent", "cookie-notice", "cookie-policy", "consent-banner",
+    "gdpr", "gdpr-banner", "breadcrumb", "breadcrumbs", "navbar", "menu", "main-menu", "mega-menu", "skip-link",
+}
+_CONTENT_TAGS = {"html", "body", "main", "article"}
+
+
+def _is_chrome(element) -> bool:
+    if element.name in _CONTENT_TAGS:
+        return False
+    if element.get("role") in _CHROME_ROLES:
+        return True
+    names = " ".join([element.get("id") or ""] + (element.get("class") or [])).lower().split()
+    return not _CHROME_NAMES.isdisjoint(names)
+
+
+def legacy_extract_text(data: bytes) -> str:
+    # Previous fetch_url_content, after the download of the whole response
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(data.decode("utf-8"), 'html.parser')
+    for script in soup(["script", "style"]):
+        script.extract()
+    for element in soup(_CHROME_TAGS):
+        if element.name in ("header", "footer") and element.find_parent(["article", "main"]):
+            continue
+        element.extract()
+    for element in soup.find_all(_is_chrome):
+        element.extract()
+    return soup.get_text(separator='\n', strip=True)
+
+
+def make_page(size_kb: int) -> bytes:
+    menu = "".join(f'<li class="menu-item"><a href="/category/{item}">Category {item}</a></li>' for item in range(60))
+    head = (
+        '<!DOCTYPE html><html lang="en"><head><meta charset="utf-8"><title>Product</title>'
+        '<style>' + ".c{color:#333;margin:0 auto}" * 200 + '</style>'
+        '<script>' + "window.dataLayer.push({event:'view',items:[1,2,3]});" * 200 + '</script></head><body>'
+        '<div id="cookie-consent">We use cookies. <button>Accept</button></div>'
+        f'<header role="banner"><nav class="navbar"><ul>{menu}</ul></nav></header>'
+        '<main><article><header><h1>Product X&nbsp;&mdash; Prescribing information</h1></header>'
+    )
+    tail = (
+        '</article><aside>Related products</aside></main>'
+        f'<footer role="contentinfo"><ul>{menu}</ul>&copy; 2024 Company</footer></body></html>'
+    )
+    section = (
+        '<section><h2>Indications &amp; usage {0}</h2><p>Product X is indicated for the treatment of '
+        'adults with condition {0}. <strong>Clinically proven</strong> to reduce symptoms in '
+        '<em>most</em> patients.</p><table><tr><td>Dose</td><td>{0} mg</td></tr></table>'
+        '<script>track("section-{0}")</script></section>'
+    )
+    body = []
+    size = len(head) + len(tail)
+    number = 0
+    while size < size_kb * 1024:
+        body.append(section.format(number))
+        size += len(body[-1])
+        number += 1
+    return (head + "".join(body) + tail).encode("utf-8")
+
+
+def measure(function):
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    # Memory is traced in a second run, tracing slows down the allocations
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 2000, 10000], help="page sizes in kB")
+    parser.add_argument("--chunk-size", type=int, default=64 * 1024, help="bytes per streamed chunk")
+    args = parser.parse_args()
+
+    print(f"{'size':>8} {'previous':>10} {'peak':>9} {'streamed':>10} {'peak':>9}  same text")
+    for size_kb in args.sizes:
+        data = make_page(size_kb)
+        chunks = lambda: (data[index:index + args.chunk_size] for index in range(0, len(data), args.chunk_size))
+        before, before_time, before_peak = measure(lambda: legacy_extract_text(data))
+        (after, _), after_time, after_peak = measure(
+            lambda: stream_html_to_text(chunks(), max_bytes=len(data), skip_chrome=True)
+        )
+        print(f"{len(data) / 1024:>6.0f}kB {before_time * 1e3:>8.0f}ms {before_peak / 2 ** 20:>7.1f}MB "
+              f"{after_time * 1e3:>8.0f}ms {after_peak / 2 ** 20:>7.1f}MB  {'yes' if before == after else 'no'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Import-time benchmark and regression check of the application startup.
+Imports the application in a fresh interpreter with `python -X importtime`, reports the modules
+that take the longest to import, and fails when the import exceeds a time budget or when one of
+the heavy dependencies that must be loaded lazily (on first use) is imported at startup.
+
+Usage:
+    python benchmarks/import_time.py [--module app] [--runs 3] [--top 15] [--budget-ms 1500]
+
+The exit status is 1 when the check fails, so the script can run as a CI step.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dependencies that take seconds to import and are only needed by some requests
+LAZY_MODULES = ("vertexai", "google.cloud.aiplatform", "reportlab", "PyPDF2")
+
+
+def import_times(module: str) -> List[Tuple[str, int, int]]:
+    """
+    Import a module in a new interpreter and collect the import time of every module.
+
+    Args:
+        module: The module to import
+
+    Returns:
+        A list of tuples containing the module name, its own import time and its cumulative
+        import time, both in microseconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-W", "ignore", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times.append((name.strip(), int(own), int(cumulative)))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app", help="module to import")
+    parser.add_argument("--runs", type=int, default=3, help="number of imports, the fastest one is reported")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest modules to show")
+    parser.add_argument("--budget-ms", type=float, default=1500, help="maximum import time of the module")
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    times = min(runs, key=lambda run: next(cumulative for name, _, cumulative in run if name == args.module))
+    total = next(cumulative for name, _, cumulative in times if name == args.module)
+
+    print(f"import {args.module}: {total / 1000:.1f} ms (best of {args.runs}, budget {args.budget_ms:.0f} ms)")
+    print(f"\n{'cumulative':>12} {'self':>10}  module")
+    for name, own, cumulative in sorted(times, key=lambda item: item[2], reverse=True)[:args.top]:
+        print(f"{cumulative / 1000:>10.1f}ms {own / 1000:>8.1f}ms  {name}")
+
+    eager = sorted({
+        name for name, _, _ in times
+        if any(name == lazy or name.startswith(lazy + ".") for lazy in LAZY_MODULES)
+    })
+    failures = []
+    if total / 1000 > args.budget_ms:
+        failures.append(f"import time {total / 1000:.1f} ms exceeds the budget of {args.budget_ms:.0f} ms")
+    if eager:
+        roots = sorted({lazy for lazy in LAZY_MODULES for name in eager if name == lazy or name.startswith(lazy + ".")})
+        failures.append(f"modules that should be imported lazily are imported at startup: {', '.join(roots)}")
+
+    print()
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+"""
+End-to-end load benchmark of the web application.
+Starts the application under gunicorn with the fake model backend, and has concurrent users
+upload fixture documents, images and videos of various sizes to /analyze, view /results, and,
+for documents, call /transform_document and /download_transformed. Reports the p50/p95/p99
+latency and throughput of every endpoint, and the peak RSS and disk I/O of the server processes,
+so that gunicorn worker/thread configurations can be compared and regressions caught.
+
+Documents are transformed in the "spans" mode, and the exit status is 1 when no page had its
+flagged texts replaced, or when a flagged text was not found and its page was rewritten instead.
+
+Usage:
+    python benchmarks/load_test.py [--workers 1] [--threads 8] [--users 8] [--duration 60]
+                                   [--model-latency 0.5] [--json results.json]
+                                   [--baseline baseline.json] [--tolerance 0.25]
+
+With --baseline, the exit status is 1 when the p95 latency of an endpoint, or the throughput,
+is worse than the baseline by more than the tolerance, so the script can run as a CI step.
+RSS and disk I/O are read from /proc and are only reported on Linux.
+"""
+
+import argparse
+import json
+import os
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Fixtures as (content type, file name, size): pages for documents, bytes for images and videos
+FIXTURES = [
+    ("Document", "small.pdf", 2),
+    ("Document", "medium.pdf", 25),  # Analyzed in page ranges, see PDF_FAN_OUT_MIN_PAGES
+    ("Document", "large.pdf", 120),
+    ("Document", "notes.txt", 40),
+    ("Image", "small.png", 64 * 1024),
+    ("Image", "large.png", 4 * 1024 * 1024),
+    ("Video", "short.mp4", 2 * 1024 * 1024),
+    ("Video", "long.mp4", 24 * 1024 * 1024),  # Staged instead of inlined, see MEDIA_INLINE_MAX_BYTES
+]
+COUNTRIES = ("Switzerland", "Mexico", "Brazil")
+
+
+def make_pdf(path: str, pages: int) -> None:
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    pdf = canvas.Canvas(path, pagesize=letter)
+    for page in range(1, pages + 1):
+        text = pdf.beginText(72, 720)
+        for line in range(40):
+            text.textLine(f"Page {page}, line {line}: this medicine cures all symptoms within a day.")
+        pdf.drawText(text)
+        pdf.showPage()
+    pdf.save()
+
+
+def make_png(path: str, size: int) -> None:
+    # Random pixels do not compress, so the file is about as large as the raw image
+    side = max(int((size / 3) ** 0.5), 1)
+    rows = b"".join(b"\x00" + os.urandom(side * 3) for _ in range(side))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    with open(path, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        file.write(chunk(b"IHDR", struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0)))
+        file.write(chunk(b"IDAT", zlib.compress(rows, 1)))
+        file.write(chunk(b"IEND", b""))
+
+
+def make_video(path: str, size: int) -> None:
+    # The fake model does not decode the video, an MP4 header followed by random data is enough
+    with open(path, "wb") as file:
+        file.write(struct.pack(">I", 24) + b"ftypisom" + b"\x00\x00\x02\x00isomiso2")
+        file.write(os.urandom(size))
+
+
+def make_fixtures(directory: str) -> List[Tuple[str, str]]:
+    """
+    Create the fixture files.
+
+    Args:
+        directory: Directory to create the files in
+
+    Returns:
+        A list of tuples containing the content type and path of each fixture
+    """
+    fixtures = []
+    for content_type, name, size in FIXTURES:
+        path = os.path.join(directory, name)
+        if name.endswith(".pdf"):
+            make_pdf(path, size)
+        elif name.endswith(".txt"):
+            with open(path, "w") as file:
+                file.write("\f".join(f"Page {page}\n\nThis medicine cures all symptoms within a day." for page in range(size)))
+        elif content_type == "Image":
+            make_png(path, size)
+        else:
+            make_video(path, size)
+        fixtures.append((content_type, path))
+    return fixtures
+
+
+def start_server(args: argparse.Namespace, directory: str) -> subprocess.Popen:
+    """
+    Start the application under gunicorn with the fake model backend and wait until it serves.
+
+    Args:
+        args: The command line arguments
+        directory: Directory for the data of the server (uploads, stores and caches)
+
+    Returns:
+        The gunicorn process
+    """
+    env = dict(
+        os.environ,
+        MODEL_BACKEND="fake",
+        TRANSFORM_BACKEND="fake",
+        TRANSFORM_MODE="spans",
+        FAKE_MODEL_LATENCY_SECONDS=str(args.model_latency),
+        SECRET_KEY="load-test",  # Shared by the workers, so that any worker can read the session
+        RESULT_CACHE_ENABLED="true" if args.cache else "false",
+        RESULT_CACHE_PATH=os.path.join(directory, "analysis_results.sqlite3"),
+        RESULT_STORE_URL="sqlite://" + os.path.join(directory, "analyses.sqlite3"),
+        TRANSLATION_MEMORY_PATH=os.path.join(directory, "translation_memory.sqlite3"),
+        UPLOAD_DIR=os.path.join(directory, "uploads"),
+        ARTIFACT_DIR=os.path.join(directory, "artifacts"),
+        MEDIA_STAGING_URI="file://" + os.path.join(directory, "staging"),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{args.port}", "--workers", str(args.workers),
+         "--threads", str(args.threads), "--timeout", "0", "--log-level", "warning", "wsgi:app"],
+        cwd=ROOT, env=env
+    )
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The server exited during startup")
+        try:
+            requests.get(f"http://127.0.0.1:{args.port}/", timeout=1)
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("The server did not start within 60 seconds")
+
+
+class ResourceSampler:
+    """
+    Samples the RSS of a process and its descendants, and measures their disk I/O.
+    """
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._io_start = self._io()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _pids(self) -> List[int]:
+        children: Dict[int, List[int]] = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as file:
+                    # The parent pid follows the command name, which is in parentheses
+                    parent = int(file.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(parent, []).append(int(entry))
+        pids = [self.pid]
+        for pid in pids:
+            pids.extend(children.get(pid, []))
+        return pids
+
+    def _rss(self) -> int:
+        total = 0
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/status") as file:
+                    for line in file:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1]) * 1024
+            except OSError:
+                continue
+        return total
+
+    def _io(self) -> Dict[int, Dict[str, int]]:
+        counters = {}
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/io") as file:
+                    counters[pid] = {key: int(value) for key, value in (line.split(": ") for line in file)}
+            except (OSError, ValueError):
+                continue
+        return counters
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self._rss())
+
+    def stop(self) -> Dict[str, int]:
+        """
+        Stop sampling.
+
+        Returns:
+            A dictionary with the peak RSS and the bytes read from and written to disk, in bytes
+        """
+        self._stopped.set()
+        self._thread.join()
+        io_end = self._io()
+        read = written = 0
+        for pid, counters in io_end.items():
+            start = self._io_start.get(pid, {})
+            read += counters.get("read_bytes", 0) - start.get("read_bytes", 0)
+            written += counters.get("write_bytes", 0) - start.get("write_bytes", 0)
+        return {"peak_rss_bytes": self.peak_rss, "disk_read_bytes": read, "disk_write_bytes": written}
+
+
+def run_user(base_url: str, fixtures: List[Tuple[str, str]], deadline: float, seed: int,
+             latencies: Dict[str, List[float]], errors: Dict[str, int], lock: threading.Lock) -> int:
+    """
+    Run analysis scenarios as one user until the deadline.
+
+    Args:
+        base_url: The URL of the server
+        fixtures: The fixture files
+        deadline: Time at which to stop
+        seed: Seed of the random choice of fixtures and countries
+        latencies: Latencies in seconds per endpoint, appended to
+        errors: Number of failed requests per endpoint, incremented
+        lock: Lock protecting latencies and errors
+
+    Returns:
+        The number of completed scenarios
+    """
+    rng = random.Random(seed)
+    http = requests.Session()
+    scenarios = 0
+
+    def call(endpoint: str, method: str, path: str, **kwargs) -> Optional[requests.Response]:
+        start = time.perf_counter()
+        try:
+            response = http.request(method, base_url + path, allow_redirects=False, timeout=600, **kwargs)
+            failed = response.status_code >= 400
+        except requests.RequestException:
+            response, failed = None, True
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.setdefault(endpoint, []).append(elapsed)
+            if failed:
+                errors[endpoint] = errors.get(endpoint, 0) + 1
+        return None if failed else response
+
+    while time.time() < deadline:
+        content_type, path = rng.choice(fixtures)
+        with open(path, "rb") as file:
+            response = call("analyze", "POST", "/analyze", data={
+                "country": rng.choice(COUNTRIES), "content_type": content_type
+            }, files={"file": (os.path.basename(path), file)})
+        if response is None:
+            continue
+        if call("results", "GET", "/results") is None:
+            continue
+        if content_type == "Document":
+            if call("transform_document", "POST", "/transform_document") is None:
+                continue
+            if call("download_transformed", "GET", "/download_transformed") is None:
+                continue
+        scenarios += 1
+    return scenarios
+
+
+def transformed_pages(base_url: str, workers: int) -> Dict[str, float]:
+    """
+    Read the number of transformed pages per mode from the metrics of the server.
+
+    Metrics are kept per worker and every request is served by one of them, so with several
+    workers /metrics is read several times and the largest count of each mode is kept.
+
+    Args:
+        base_url: The URL of the server
+        workers: The number of gunicorn workers
+
+    Returns:
+        A dictionary mapping each transform mode (spans, rewrite, translate, fallback) to its count
+    """
+    pages: Dict[str, float] = {}
+    for _ in range(1 if workers == 1 else 4 * workers):
+        scraped: Dict[str, float] = {}
+        for line in requests.get(base_url + "/metrics", timeout=60).text.splitlines():
+            if line.startswith("compliance_transformed_pages_total{"):
+                labels, value = line.rsplit(" ", 1)
+                mode = labels.split('mode="', 1)[1].split('"', 1)[0]
+                scraped[mode] = scraped.get(mode, 0) + float(value)
+        for mode, count in scraped.items():
+            pages[mode] = max(pages.get(mode, 0), count)
+    return pages
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=1, help="number of gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="number of threads per gunicorn worker")
+    parser.add_argument("--users", type=int, default=8, help="number of concurrent users")
+    parser.add_argument("--duration", type=float, default=60, help="duration of the load in seconds")
+    parser.add_argument("--model-latency", type=float, default=0.5, help="time to first chunk of the fake model")
+    parser.add_argument("--cache", action="store_true", help="enable the analysis result cache")
+    parser.add_argument("--port", type=int, default=8765, help="port of the server")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random choices of the users")
+    parser.add_argument("--json", help="file to write the results to, e.g. to use as a baseline")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression against the baseline")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="load_test_") as directory:
+        fixture_directory = os.path.join(directory, "fixtures")
+        os.makedirs(fixture_directory)
+        fixtures = make_fixtures(fixture_directory)
+
+        server = start_server(args, os.path.join(directory, "server"))
+        try:
+            sampler = ResourceSampler(server.pid) if os.path.exists("/proc/self/io") else None
+            latencies: Dict[str, List[float]] = {}
+            errors: Dict[str, int] = {}
+            lock = threading.Lock()
+
+            start = time.perf_counter()
+            deadline = time.time() + args.duration
+            with ThreadPoolExecutor(max_workers=args.users) as executor:
+                futures = [
+                    executor.submit(run_user, f"http://127.0.0.1:{args.port}", fixtures, deadline,
+                                    args.seed + user, latencies, errors, lock)
+                    for user in range(args.users)
+                ]
+                scenarios = sum(future.result() for future in futures)
+            elapsed = time.perf_counter() - start
+            resources = sampler.stop() if sampler else {}
+            pages = transformed_pages(f"http://127.0.0.1:{args.port}", args.workers)
+        finally:
+            server.terminate()
+            server.wait()
+
+    results = {
+        "config": {key: getattr(args, key) for key in ("workers", "threads", "users", "duration", "model_latency", "cache")},
+        "elapsed_seconds": elapsed,
+        "scenarios": scenarios,
+        "throughput": sum(len(values) for values in latencies.values()) / elapsed,
+        "endpoints": {
+            endpoint: {
+                "requests": len(values),
+                "errors": errors.get(endpoint, 0),
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+            }
+            for endpoint, values in latencies.items()
+        },
+        "transformed_pages": pages,
+        **resources,
+    }
+
+    print(f"{args.workers} worker(s) x {args.threads} thread(s), {args.users} users, {elapsed:.1f}s: "
+          f"{scenarios} scenarios, {results['throughput']:.1f} requests/s")
+    print(f"\n{'endpoint':<22} {'requests':>8} {'errors':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for endpoint, stats in results["endpoints"].items():
+        print(f"{endpoint:<22} {stats['requests']:>8} {stats['errors']:>7} {stats['p50_ms']:>7.0f}ms "
+              f"{stats['p95_ms']:>7.0f}ms {stats['p99_ms']:>7.0f}ms")
+    if resources:
+        print(f"\npeak RSS {resources['peak_rss_bytes'] / 2 ** 20:.0f} MB, "
+              f"disk read {resources['disk_read_bytes'] / 2 ** 20:.1f} MB, "
+              f"disk write {resources['disk_write_bytes'] / 2 ** 20:.1f} MB")
+    print("transformed pages: " + (", ".join(f"{mode} {count:.0f}" for mode, count in sorted(pages.items())) or "none"))
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+    failures = []
+    transforms = results["endpoints"].get("transform_document", {})
+    if transforms.get("requests", 0) > transforms.get("errors", 0):
+        # The transform benchmark is only meaningful if the flagged texts were actually replaced
+        if not pages.get("spans"):
+            failures.append("no page was transformed in the spans mode")
+        if pages.get("fallback"):
+            failures.append(f"{pages['fallback']:.0f} page(s) rewritten entirely, their flagged texts were not found")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if results["throughput"] < baseline["throughput"] * (1 - args.tolerance):
+            failures.append(f"throughput {results['throughput']:.1f} requests/s, baseline {baseline['throughput']:.1f}")
+        for endpoint, stats in results["endpoints"].items():
+            baseline_stats = baseline["endpoints"].get(endpoint)
+            if baseline_stats and stats["p95_ms"] > baseline_stats["p95_ms"] * (1 + args.tolerance):
+                failures.append(f"{endpoint} p95 {stats['p95_ms']:.0f} ms, baseline {baseline_stats['p95_ms']:.0f} ms")
+
+    if failures or args.baseline:
+        print()
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        if failures:
+            sys.exit(1)
+        print("OK")
+
+
+if __name__ == "__main__":
+    main()
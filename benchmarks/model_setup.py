@@ -0,0 +1,70 @@
+"""
+Micro-benchmark of the per-request model setup overhead.
+Compares creating a new GenerativeModel, chat session and prediction client for every request
+(the previous behaviour) with looking the model up in the shared model registry.
+
+No request is sent to the model, so the benchmark runs offline with anonymous credentials.
+
+Usage:
+    python benchmarks/model_setup.py [--requests 200]
+"""
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vertexai
+from google.auth.credentials import AnonymousCredentials
+from vertexai.generative_models import GenerativeModel
+
+import configuration
+from ai_service import build_analysis_prompt
+from model_registry import get_model, clear_models
+
+
+def per_request_setup(system_instruction: str) -> None:
+    model = GenerativeModel(configuration.MODEL_NAME)
+    model.start_chat()
+    # The prediction client (and its gRPC channel) is created lazily on the first call
+    model._prediction_client
+
+
+def registry_setup(system_instruction: str) -> None:
+    model = get_model(configuration.MODEL_NAME, system_instruction)
+    model._prediction_client
+
+
+def measure(setup, system_instruction: str, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        setup(system_instruction)
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="number of simulated requests")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    vertexai.init(project=configuration.PROJECT_ID, location=configuration.VERTEXT_AI_REGION_NAME,
+                  credentials=AnonymousCredentials())
+    system_instruction, _ = build_analysis_prompt("Switzerland")
+
+    clear_models()
+    before = measure(per_request_setup, system_instruction, args.requests)
+    after = measure(registry_setup, system_instruction, args.requests)
+
+    print(f"requests:                  {args.requests}")
+    print(f"new model per request:     {before * 1e6:10.1f} us/request")
+    print(f"shared model registry:     {after * 1e6:10.1f} us/request")
+    print(f"speed-up:                  {before / after:10.1f}x")
+    print("Not included: the TLS handshake of each new gRPC channel, paid on the first call of every new client.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark of the parsing of large model responses.
+Compares the previous regex based extraction (non-greedy scan of every {...} candidate, and a
+plain text fallback searching the rest of the response again for every page) with the
+single-pass parser of structured_output, on synthetic responses with many non-compliant pages.
+
+Usage:
+    python benchmarks/structured_output.py [--pages 100 1000 4000] [--chunk-size 64]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from structured_output import ANALYSIS_SCHEMA, IncrementalJSONParser, parse_analysis_response
+
+
+def legacy_extract_json(text: str) -> str:
+    # JSON part of the previous extract_json_from_text
+    for match in re.findall(r'```(?:json)?\s*([\s\S]*?)\s*```', text):
+        try:
+            json.loads(match.strip())
+            return match.strip()
+        except json.JSONDecodeError:
+            continue
+
+    matches = re.findall(r'(\{[\s\S]*?\})', text)
+    matches.sort(key=len, reverse=True)
+    for match in matches:
+        try:
+            json.loads(match.strip())
+            return match.strip()
+        except json.JSONDecodeError:
+            continue
+
+    # Page blocks of the previous plain text fallback
+    pages = []
+    for page_match in re.finditer(r'Page Number:?\s*(\d+)', text, re.IGNORECASE):
+        start_pos = page_match.start()
+        next_page_match = re.search(r'Page Number:?\s*\d+', text[start_pos + 1:], re.IGNORECASE)
+        end_pos = start_pos + 1 + next_page_match.start() if next_page_match else len(text)
+        page_block_text = text[start_pos:end_pos]
+        pages.append({
+            "Page Number": page_match.group(1),
+            "Non-Compliant Text": [match.group(1) for match in re.finditer(r'Text:?\s*([^\n]+)', page_block_text)]
+        })
+    return json.dumps({"Non-Compliant Pages": pages})
+
+
+def make_analysis(pages: int) -> dict:
+    return {
+        "Compliant Status": "Non Compliant",
+        "Non-Compliance Percentage": 35,
+        "Detailed Analysis": "The claims about efficacy are not supported. " * 20,
+        "Non-Compliant Pages": [
+            {
+                "Page Number": page,
+                "Page Non-Compliance Percentage": page % 100,
+                "Non-Compliant Text": [
+                    {"Text": f"Claim {item} on page {page} {{guaranteed}} results", "Reason": "Unsupported claim. " * 5}
+                    for item in range(5)
+                ]
+            }
+            for page in range(1, pages + 1)
+        ]
+    }
+
+
+def make_responses(pages: int) -> dict:
+    analysis = make_analysis(pages)
+    plain_text = "\n".join(
+        f"Page Number: {page['Page Number']}\n" + "\n".join(
+            f"Text: {item['Text']}\nReason: {item['Reason']}" for item in page["Non-Compliant Text"]
+        )
+        for page in analysis["Non-Compliant Pages"]
+    )
+    return {
+        "fenced JSON": "Here is the analysis:\n```json\n" + json.dumps(analysis, indent=2) + "\n```\n",
+        "unfenced JSON": "Analysis {as requested}:\n" + json.dumps(analysis, indent=2) + "\nEnd.",
+        "plain text": "Compliant Status: Non Compliant\nNon-Compliance Percentage: 35%\n\n" + plain_text,
+    }
+
+
+def measure(function, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def stream(text: str, chunk_size: int) -> None:
+    parser = IncrementalJSONParser(["Compliant Status", "Non-Compliance Percentage"])
+    for index in range(0, len(text), chunk_size):
+        parser.feed(text[index:index + chunk_size])
+    parser.close(ANALYSIS_SCHEMA)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[100, 1000, 4000], help="pages of the synthetic responses")
+    parser.add_argument("--chunk-size", type=int, default=64, help="characters per streamed chunk")
+    args = parser.parse_args()
+
+    print(f"{'response':<15} {'pages':>6} {'size':>10} {'previous':>12} {'single pass':>12} {'streamed':>12}"
+          f"  previous found the JSON")
+    for pages in args.pages:
+        for name, text in make_responses(pages).items():
+            before = measure(lambda: legacy_extract_json(text))
+            after = measure(lambda: parse_analysis_response(text))
+            streamed = measure(lambda: stream(text, args.chunk_size))
+            # The non-greedy scan cannot match nested objects, the previous version then fell back to plain text
+            found = "Compliant Status" in json.loads(legacy_extract_json(text)) if "JSON" in name else None
+            print(f"{name:<15} {pages:>6} {len(text) / 1024:>8.0f}kB {before * 1e3:>10.1f}ms "
+                  f"{after * 1e3:>10.1f}ms {streamed * 1e3:>10.1f}ms  {'-' if found is None else 'yes' if found else 'no'}")
+
+
+if __name__ == "__main__":
+    main()
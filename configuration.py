@@ -1,13 +1,138 @@
-import os
-from dotenv import load_dotenv
-
-load_dotenv()  # Load environment variables from .env file
-
-# Add your VertextAI details here
-PROJECT_ID = "poc-projects-462113"
-VERTEXT_AI_REGION_NAME = "us-central1"
-MODEL_NAME = "gemini-2.5-pro"
-# Add your OpenAI API details here
-OPENAI_API_BASE_URL = "https://api.openai.com/v1"
-OPENAI_MODEL_NAME = "gpt-4.1"
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")  # Get API key from environment
\ No newline at end of file
+import os
+from dotenv import load_dotenv
+
+load_dotenv()  # Load environment variables from .env file
+
+# Add your VertextAI details here
+PROJECT_ID = "poc-projects-462113"
+VERTEXT_AI_REGION_NAME = "us-central1"
+MODEL_NAME = "gemini-2.5-pro"
+# Add your OpenAI API details here
+OPENAI_API_BASE_URL = "https://api.openai.com/v1"
+OPENAI_MODEL_NAME = "gpt-4.1"
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")  # Get API key from environment
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Analysis result cache settings
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", os.path.join(BASE_DIR, "cache", "analysis_results.sqlite3"))
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get("RESULT_CACHE_TTL_SECONDS", 7 * 24 * 60 * 60))  # One week
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", 5000))
+
+# Background analysis job settings
+JOB_QUEUE_BACKEND = os.environ.get("JOB_QUEUE_BACKEND", "thread")  # "thread" or "process"
+JOB_QUEUE_MAX_WORKERS = int(os.environ.get("JOB_QUEUE_MAX_WORKERS", 4))
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 60 * 60))  # Keep finished jobs for an hour
+
+# Page-parallel analysis of long PDF documents
+PDF_FAN_OUT_MIN_PAGES = int(os.environ.get("PDF_FAN_OUT_MIN_PAGES", 20))  # Split PDFs with at least this many pages
+PDF_FAN_OUT_PAGES_PER_CHUNK = int(os.environ.get("PDF_FAN_OUT_PAGES_PER_CHUNK", 10))
+PDF_FAN_OUT_MAX_WORKERS = int(os.environ.get("PDF_FAN_OUT_MAX_WORKERS", 4))  # Concurrent page-range analyses per process
+
+# Number of PDF documents whose extracted page text is kept in memory
+DOCUMENT_TEXT_CACHE_MAX_ENTRIES = int(os.environ.get("DOCUMENT_TEXT_CACHE_MAX_ENTRIES", 64))
+
+# Upload and media handling
+UPLOAD_CHUNK_BYTES = int(os.environ.get("UPLOAD_CHUNK_BYTES", 1024 * 1024))  # Uploads are streamed to disk 1MB at a time
+MEDIA_INLINE_MAX_BYTES = int(os.environ.get("MEDIA_INLINE_MAX_BYTES", 16 * 1024 * 1024))  # Larger media is passed by URI
+# Where large media files are staged for the model, e.g. "gs://bucket/staging" or "file:///tmp/staging" for local development
+MEDIA_STAGING_URI = os.environ.get("MEDIA_STAGING_URI", "")
+# Without staging every upload is sent inline, so uploads are limited to what the model accepts inline
+MAX_UPLOAD_BYTES = int(os.environ.get(
+    "MAX_UPLOAD_BYTES", 512 * 1024 * 1024 if MEDIA_STAGING_URI else MEDIA_INLINE_MAX_BYTES
+))
+
+# Storage of the uploaded files, swept with the other stored files (see artifact_store.py)
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", os.path.join(BASE_DIR, "uploads"))
+UPLOAD_TTL_SECONDS = int(os.environ.get("UPLOAD_TTL_SECONDS", 24 * 60 * 60))  # As long as the analyses referencing them
+UPLOAD_QUOTA_BYTES = int(os.environ.get("UPLOAD_QUOTA_BYTES", 20 * 1024 * 1024 * 1024))  # 0 for no quota
+STORAGE_SWEEP_INTERVAL_SECONDS = int(os.environ.get("STORAGE_SWEEP_INTERVAL_SECONDS", 300))
+# Files younger than this are never evicted for a quota: longer than an analysis, its transform and the render
+STORAGE_MIN_EVICTION_AGE_SECONDS = int(os.environ.get("STORAGE_MIN_EVICTION_AGE_SECONDS", 60 * 60))
+
+# Outgoing HTTP requests (OpenAI API and URL fetching)
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 10))  # Keep-alive connections per host
+# Per-host pool sizes as "host=size,host=size"
+HTTP_HOST_POOL_SIZES = {
+    host.strip(): int(size)
+    for host, size in (
+        item.split("=", 1) for item in os.environ.get("HTTP_HOST_POOL_SIZES", "api.openai.com=16").split(",") if "=" in item
+    )
+}
+HTTP_TIMEOUT = (5, 30)  # Default (connect, read) timeouts in seconds
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", 3))
+HTTP_BACKOFF_FACTOR = float(os.environ.get("HTTP_BACKOFF_FACTOR", 1.0))  # Waits 1s, 2s, 4s... unless Retry-After says otherwise
+URL_FETCH_TIMEOUT = (5, 10)
+URL_FETCH_MAX_BYTES = int(os.environ.get("URL_FETCH_MAX_BYTES", 10 * 1024 * 1024))  # Larger pages are truncated
+URL_FETCH_USER_AGENT = os.environ.get(
+    "URL_FETCH_USER_AGENT",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+)
+OPENAI_TIMEOUT = (5, int(os.environ.get("OPENAI_TIMEOUT_SECONDS", 120)))  # Calls are not retried after a read timeout
+
+# Web site crawling ("Website" content type)
+CRAWL_MAX_DEPTH = int(os.environ.get("CRAWL_MAX_DEPTH", 2))  # Links followed from the start page
+CRAWL_MAX_PAGES = int(os.environ.get("CRAWL_MAX_PAGES", 40))
+CRAWL_MAX_WORKERS = int(os.environ.get("CRAWL_MAX_WORKERS", 8))  # Pages fetched concurrently across all crawls
+CRAWL_HOST_MIN_INTERVAL_SECONDS = float(os.environ.get("CRAWL_HOST_MIN_INTERVAL_SECONDS", 0.25))  # Between requests to a host
+CRAWL_CACHE_ENABLED = os.environ.get("CRAWL_CACHE_ENABLED", "true").lower() == "true"
+CRAWL_CACHE_PATH = os.environ.get("CRAWL_CACHE_PATH", os.path.join(BASE_DIR, "cache", "crawled_pages.sqlite3"))
+CRAWL_CACHE_MAX_ENTRIES = int(os.environ.get("CRAWL_CACHE_MAX_ENTRIES", 20000))
+
+# Session and analysis data storage
+SECRET_KEY = os.environ.get("SECRET_KEY")  # Must be shared by all instances when running more than one
+# "cookie" keeps the (tiny) session in a signed cookie; any Flask-Session type such as "redis" or "filesystem" also works
+SESSION_TYPE = os.environ.get("SESSION_TYPE", "cookie")
+SESSION_FILE_DIR = os.environ.get("SESSION_FILE_DIR", os.path.join(BASE_DIR, "flask_session"))  # "filesystem" sessions
+SESSION_FILE_TTL_SECONDS = int(os.environ.get("SESSION_FILE_TTL_SECONDS", 24 * 60 * 60))
+SESSION_FILE_QUOTA_BYTES = int(os.environ.get("SESSION_FILE_QUOTA_BYTES", 256 * 1024 * 1024))  # 0 for no quota
+# sqlite:///path/to/file.sqlite3, redis://host:port/db or memory:// (in-process stand-in for Redis)
+RESULT_STORE_URL = os.environ.get("RESULT_STORE_URL", "sqlite://" + os.path.join(BASE_DIR, "cache", "analyses.sqlite3"))
+RESULT_STORE_TTL_SECONDS = int(os.environ.get("RESULT_STORE_TTL_SECONDS", 24 * 60 * 60))  # Keep analyses for a day
+
+# Maximum number of concurrent analyses in a batch
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", 4))
+BATCH_ZIP_MAX_MEMBERS = int(os.environ.get("BATCH_ZIP_MAX_MEMBERS", 1000))  # Entries of an uploaded zip archive
+# Analyze each asset for all countries of a batch with a single model call
+BATCH_MULTI_COUNTRY = os.environ.get("BATCH_MULTI_COUNTRY", "true").lower() == "true"
+# Constrain the analysis responses of the model to a JSON schema (structured output mode)
+STRUCTURED_OUTPUT_ENABLED = os.environ.get("STRUCTURED_OUTPUT_ENABLED", "true").lower() == "true"
+
+# Model backends: "vertex" (Gemini), "openai" or "fake" (deterministic local stand-in for load tests)
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "vertex")
+TRANSFORM_BACKEND = os.environ.get("TRANSFORM_BACKEND", "openai")
+FAKE_MODEL_LATENCY_SECONDS = float(os.environ.get("FAKE_MODEL_LATENCY_SECONDS", 0.5))  # Time to the first chunk
+FAKE_MODEL_CHUNK_SIZE = int(os.environ.get("FAKE_MODEL_CHUNK_SIZE", 64))  # Characters per streamed chunk
+FAKE_MODEL_CHUNK_DELAY_SECONDS = float(os.environ.get("FAKE_MODEL_CHUNK_DELAY_SECONDS", 0.01))
+FAKE_MODEL_ERROR_RATE = float(os.environ.get("FAKE_MODEL_ERROR_RATE", 0.0))  # Fraction of failing calls
+FAKE_MODEL_SEED = int(os.environ.get("FAKE_MODEL_SEED", 0))
+
+# Page-parallel document transformation
+TRANSFORM_MAX_WORKERS = int(os.environ.get("TRANSFORM_MAX_WORKERS", 8))  # Concurrent page transformations
+TRANSFORM_PAGE_MAX_TOKENS = int(os.environ.get("TRANSFORM_PAGE_MAX_TOKENS", 4000))
+# Translate the text without compliance issues, otherwise it is kept in its original language
+TRANSFORM_TRANSLATE_COMPLIANT_PAGES = os.environ.get("TRANSFORM_TRANSLATE_COMPLIANT_PAGES", "true").lower() == "true"
+# "spans" only asks the model for replacements of the flagged texts, "pages" rewrites the flagged pages entirely
+TRANSFORM_MODE = os.environ.get("TRANSFORM_MODE", "spans")
+
+# Translation memory of the transform step, translated paragraphs are reused across documents
+TRANSLATION_MEMORY_ENABLED = os.environ.get("TRANSLATION_MEMORY_ENABLED", "true").lower() == "true"
+TRANSLATION_MEMORY_PATH = os.environ.get("TRANSLATION_MEMORY_PATH", os.path.join(BASE_DIR, "cache", "translation_memory.sqlite3"))
+TRANSLATION_MEMORY_MAX_ENTRIES = int(os.environ.get("TRANSLATION_MEMORY_MAX_ENTRIES", 100000))
+TRANSLATION_BATCH_CHARS = int(os.environ.get("TRANSLATION_BATCH_CHARS", 8000))  # Characters of novel text per translation call
+
+# Generated files such as the transformed PDF documents, removed once expired
+ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR", os.path.join(BASE_DIR, "cache", "artifacts"))
+ARTIFACT_TTL_SECONDS = int(os.environ.get("ARTIFACT_TTL_SECONDS", 24 * 60 * 60))
+ARTIFACT_QUOTA_BYTES = int(os.environ.get("ARTIFACT_QUOTA_BYTES", 1024 * 1024 * 1024))  # 0 for no quota
+# Background rendering of the transformed PDF documents
+PDF_RENDER_MAX_WORKERS = int(os.environ.get("PDF_RENDER_MAX_WORKERS", 2))  # Concurrent renders
+PDF_RENDER_WAIT_SECONDS = float(os.environ.get("PDF_RENDER_WAIT_SECONDS", 120))  # Wait of a download for a pending render
+
+# Token budget of the content sent to the model, larger content is analyzed in chunks (0 for no budget)
+MODEL_INPUT_TOKEN_BUDGET = int(os.environ.get("MODEL_INPUT_TOKEN_BUDGET", 50000))
+PDF_PAGE_TOKENS = int(os.environ.get("PDF_PAGE_TOKENS", 258))  # Tokens counted by Gemini per PDF page
+# Remove boilerplate (navigation, repeated headers and footers) from extracted text before analyzing it
+INPUT_TRIMMING_ENABLED = os.environ.get("INPUT_TRIMMING_ENABLED", "true").lower() == "true"
+BOILERPLATE_MIN_PAGE_FRACTION = float(os.environ.get("BOILERPLATE_MIN_PAGE_FRACTION", 0.5))  # Lines on half the pages are boilerplate
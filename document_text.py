@@ -0,0 +1,73 @@
+"""
+Module for extracting text from documents.
+This module parses each PDF document once and keeps its per-page text in memory, keyed by the
+hash of the document content, so that all the places needing the text share a single extraction.
+"""
+
+import io
+import threading
+from collections import OrderedDict
+from typing import List
+
+import configuration
+import metrics
+from result_cache import content_digest
+
+# Per-page text of recently extracted PDF documents, keyed by content hash, least recently used first
+_page_cache: "OrderedDict[str, List[str]]" = OrderedDict()
+_page_cache_lock = threading.Lock()
+
+
+def extract_pdf_pages(pdf_data: bytes) -> List[str]:
+    """
+    Extract the text of each page of a PDF document.
+
+    Args:
+        pdf_data: Binary data of the PDF file
+
+    Returns:
+        A list with the text of each page
+    """
+    key = content_digest(pdf_data)
+    with _page_cache_lock:
+        pages = _page_cache.get(key)
+        if pages is not None:
+            _page_cache.move_to_end(key)
+            return pages
+
+    # Parse outside of the lock so that different documents can be extracted concurrently
+    import PyPDF2
+
+    with metrics.timed("pdf_extract"):
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_data))
+        pages = [page.extract_text() for page in pdf_reader.pages]
+
+    with _page_cache_lock:
+        _page_cache[key] = pages
+        _page_cache.move_to_end(key)
+        while len(_page_cache) > configuration.DOCUMENT_TEXT_CACHE_MAX_ENTRIES:
+            _page_cache.popitem(last=False)
+
+    return pages
+
+
+def extract_text_from_pdf(pdf_data: bytes) -> str:
+    """
+    Extract text from PDF binary data.
+
+    Args:
+        pdf_data: Binary data of the PDF file
+
+    Returns:
+        Extracted text from the PDF
+    """
+    try:
+        pages = extract_pdf_pages(pdf_data)
+        pdf_text = "".join(page + "\n\n" for page in pages)
+
+        if not pdf_text.strip():
+            pdf_text = "[PDF content could not be extracted. The PDF might be scanned or contain only images.]"
+    except Exception as e:
+        pdf_text = f"[Error extracting PDF content: {str(e)}]"
+
+    return pdf_text
@@ -0,0 +1,232 @@
+"""
+Module for extracting the text of web pages.
+This module converts HTML to text in a single streaming pass with the standard library parser:
+no document tree is built, the subtrees that are not content (scripts, styles and, when input
+trimming is enabled, the navigation chrome) are skipped as they are parsed, and the response is
+read in chunks up to a byte limit. The links of the page can be collected for crawling.
+"""
+
+import codecs
+import re
+from html.parser import HTMLParser
+from typing import Iterable, List, Optional, Tuple
+
+import configuration
+
+# Elements whose content is never text
+_NON_TEXT_TAGS = {"script", "style", "noscript", "template", "svg", "iframe", "object"}
+# Page elements that are not content: navigation, site header and footer, forms and embeds
+_CHROME_TAGS = {"nav", "header", "footer", "aside", "form", "button"}
+_CHROME_ROLES = {"navigation", "banner", "contentinfo", "search", "dialog"}
+# Cookie and consent banners, menus and breadcrumbs, identified by a whole token of their id or
+# class: wrappers such as <body class="cookies-not-set"> or <div class="has-mega-menu"> are content
+_CHROME_NAMES = {
+    "cookie-banner", "cookie-bar", "cookie-consent", "cookie-notice", "cookie-policy", "consent-banner",
+    "gdpr", "gdpr-banner", "breadcrumb", "breadcrumbs", "navbar", "menu", "main-menu", "mega-menu", "skip-link",
+}
+# Document and content wrappers, never skipped whatever their attributes
+_CONTENT_TAGS = {"html", "body", "main", "article"}
+# Elements without an end tag, which cannot enclose a skipped subtree
+_VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"
+}
+# Elements whose end tag may be omitted before a sibling of the same name
+_IMPLIED_END_TAGS = {"li", "p", "dt", "dd", "option", "tr", "td", "th"}
+_META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([\w.:-]+)', re.IGNORECASE)
+
+
+class HTMLTextExtractor(HTMLParser):
+    """
+    Streaming HTML to text converter.
+
+    Only the names of the open elements are kept, to find where a skipped subtree ends. The text
+    is the stripped text of every text node outside of the skipped elements, one per line, like
+    BeautifulSoup's get_text(separator='\\n', strip=True).
+    """
+
+    def __init__(self, skip_chrome: bool = True, collect_links: bool = False):
+        """
+        Args:
+            skip_chrome: Whether to skip the navigation chrome as well as the non-text elements
+            collect_links: Whether to collect the targets of the links, including the skipped ones
+        """
+        super().__init__(convert_charrefs=True)
+        self.skip_chrome = skip_chrome
+        self.collect_links = collect_links
+        self.lines: List[str] = []
+        self.links: List[str] = []
+        self._data: List[str] = []
+        self._open: List[str] = []
+        # Depth of the skipped element in the open elements, None when not skipping
+        self._skipped_at: Optional[int] = None
+        # Number of open article and main elements, whose header and footer are content
+        self._content_depth = 0
+
+    def _flush(self) -> None:
+        if self._data:
+            text = "".join(self._data).strip()
+            if text:
+                self.lines.append(text)
+            self._data = []
+
+    def _is_skipped(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> bool:
+        if tag in _NON_TEXT_TAGS:
+            return True
+        if not self.skip_chrome or tag in _CONTENT_TAGS:
+            return False
+        if tag in _CHROME_TAGS:
+            return not (tag in ("header", "footer") and self._content_depth)
+        attributes = dict(attrs)
+        if attributes.get("role") in _CHROME_ROLES:
+            return True
+        names = f"{attributes.get('id') or ''} {attributes.get('class') or ''}".lower().split()
+        return not _CHROME_NAMES.isdisjoint(names)
+
+    def _close(self, depth: int) -> None:
+        # Close the open elements down to the given depth
+        while len(self._open) > depth:
+            if self._open.pop() in ("article", "main"):
+                self._content_depth -= 1
+        if self._skipped_at is not None and len(self._open) <= self._skipped_at:
+            self._skipped_at = None
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        self._flush()
+        if tag == "a" and self.collect_links:
+            # Navigation links are skipped from the text but still lead to the other pages
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(href.strip())
+        if tag in _VOID_TAGS:
+            return
+        if tag in _IMPLIED_END_TAGS and self._open and self._open[-1] == tag:
+            self._close(len(self._open) - 1)
+        if self._skipped_at is None and self._is_skipped(tag, attrs):
+            self._skipped_at = len(self._open)
+        self._open.append(tag)
+        if tag in ("article", "main"):
+            self._content_depth += 1
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        # Self-closing tags such as <br/> have no content to skip
+        self._flush()
+
+    def handle_endtag(self, tag: str) -> None:
+        self._flush()
+        # End tags without a matching open element are ignored, like a browser does
+        for depth in range(len(self._open) - 1, -1, -1):
+            if self._open[depth] == tag:
+                self._close(depth)
+                break
+
+    def handle_data(self, data: str) -> None:
+        # A text node can be delivered in several parts, it ends at the next tag
+        if self._skipped_at is None:
+            self._data.append(data)
+
+    def handle_comment(self, data: str) -> None:
+        self._flush()
+
+    def close(self) -> None:
+        super().close()
+        self._flush()
+
+    def text(self) -> str:
+        """
+        Get the text extracted so far.
+
+        Returns:
+            The text, one text node per line
+        """
+        return "\n".join(self.lines)
+
+
+def html_to_text(html: str, skip_chrome: Optional[bool] = None) -> str:
+    """
+    Extract the text of an HTML document.
+
+    Args:
+        html: The HTML document
+        skip_chrome: Whether to skip the navigation chrome, configuration.INPUT_TRIMMING_ENABLED by default
+
+    Returns:
+        The text, one text node per line
+    """
+    extractor = HTMLTextExtractor(configuration.INPUT_TRIMMING_ENABLED if skip_chrome is None else skip_chrome)
+    extractor.feed(html)
+    extractor.close()
+    return extractor.text()
+
+
+def stream_html_to_text(
+    chunks: Iterable[bytes],
+    encoding: Optional[str] = None,
+    max_bytes: Optional[int] = None,
+    skip_chrome: Optional[bool] = None
+) -> Tuple[str, bool]:
+    """
+    Extract the text of an HTML document read in chunks, without holding the document in memory.
+
+    Args:
+        chunks: The chunks of the HTML document
+        encoding: The character encoding of the document; by default the charset of its meta tag, or UTF-8
+        max_bytes: Maximum number of bytes read, configuration.URL_FETCH_MAX_BYTES by default
+        skip_chrome: Whether to skip the navigation chrome, configuration.INPUT_TRIMMING_ENABLED by default
+
+    Returns:
+        A tuple containing the text and whether the document was truncated at the byte limit
+    """
+    extractor = HTMLTextExtractor(configuration.INPUT_TRIMMING_ENABLED if skip_chrome is None else skip_chrome)
+    truncated = feed_html_stream(extractor, chunks, encoding, max_bytes)
+    return extractor.text(), truncated
+
+
+def feed_html_stream(
+    extractor: HTMLTextExtractor,
+    chunks: Iterable[bytes],
+    encoding: Optional[str] = None,
+    max_bytes: Optional[int] = None
+) -> bool:
+    """
+    Feed an HTML document read in chunks to an extractor, and close it.
+
+    Args:
+        extractor: The extractor
+        chunks: The chunks of the HTML document
+        encoding: The character encoding of the document; by default the charset of its meta tag, or UTF-8
+        max_bytes: Maximum number of bytes read, configuration.URL_FETCH_MAX_BYTES by default
+
+    Returns:
+        Whether the document was truncated at the byte limit
+    """
+    max_bytes = configuration.URL_FETCH_MAX_BYTES if max_bytes is None else max_bytes
+    decoder = None
+    size = 0
+    truncated = False
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if size + len(chunk) > max_bytes:
+            chunk = chunk[:max_bytes - size]
+            truncated = True
+        size += len(chunk)
+
+        if decoder is None:
+            # The charset is declared at the top of the document
+            if encoding is None:
+                match = _META_CHARSET.search(chunk[:4096])
+                encoding = match.group(1).decode("ascii") if match else "utf-8"
+            try:
+                decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+            except LookupError:
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        extractor.feed(decoder.decode(chunk))
+        if truncated:
+            break
+
+    if decoder is not None:
+        extractor.feed(decoder.decode(b"", final=True))
+    extractor.close()
+    return truncated
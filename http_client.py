@@ -0,0 +1,120 @@
+"""
+Module for making outgoing HTTP requests.
+This module provides a process-wide requests session with keep-alive connection pooling,
+default timeouts and retries with exponential backoff that honour Retry-After headers.
+"""
+
+import threading
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import configuration
+
+# Responses that are worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def _create_adapter(pool_size: int, retry_reads: bool = True) -> HTTPAdapter:
+    retry = Retry(
+        total=configuration.HTTP_MAX_RETRIES,
+        # A read error means the server may have processed the request, e.g. billed a completion
+        read=None if retry_reads else False,
+        backoff_factor=configuration.HTTP_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=None,  # Also retry POST requests after connection errors and retryable statuses
+        respect_retry_after_header=True,
+        raise_on_status=False,  # Return the last response so callers can report the error
+    )
+    return HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+
+def create_session(
+    host_pool_sizes: Optional[Dict[str, int]] = None,
+    no_read_retry_hosts: Iterable[str] = ()
+) -> requests.Session:
+    """
+    Create a requests session with connection pooling and retries.
+
+    Args:
+        host_pool_sizes: Connection pool sizes for specific hosts; other hosts use
+            configuration.HTTP_POOL_SIZE
+        no_read_retry_hosts: Hosts whose requests are not repeated after a read error or timeout,
+            only after connection errors and retryable statuses, e.g. paid model APIs
+
+    Returns:
+        The configured session
+    """
+    host_pool_sizes = host_pool_sizes or {}
+    no_read_retry_hosts = set(no_read_retry_hosts)
+    session = requests.Session()
+    default_adapter = _create_adapter(configuration.HTTP_POOL_SIZE)
+    session.mount("http://", default_adapter)
+    session.mount("https://", default_adapter)
+
+    for host in set(host_pool_sizes) | no_read_retry_hosts:
+        adapter = _create_adapter(
+            host_pool_sizes.get(host, configuration.HTTP_POOL_SIZE),
+            retry_reads=host not in no_read_retry_hosts
+        )
+        session.mount(f"http://{host}/", adapter)
+        session.mount(f"https://{host}/", adapter)
+
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Get the process-wide HTTP session, creating it on first use.
+
+    Returns:
+        The shared requests session
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # Every request to the OpenAI API is a completion, which is billed even if the response is lost
+                _session = create_session(
+                    configuration.HTTP_HOST_POOL_SIZES,
+                    no_read_retry_hosts=[urlparse(configuration.OPENAI_API_BASE_URL).netloc]
+                )
+    return _session
+
+
+def request(method: str, url: str, timeout=None, **kwargs) -> requests.Response:
+    """
+    Send an HTTP request through the shared session.
+
+    Args:
+        method: The HTTP method
+        url: The URL to request
+        timeout: A timeout in seconds, or a (connect, read) tuple; configuration.HTTP_TIMEOUT by default
+        **kwargs: Other arguments for requests.Session.request
+
+    Returns:
+        The response
+    """
+    return get_session().request(method, url, timeout=timeout or configuration.HTTP_TIMEOUT, **kwargs)
+
+
+def get(url: str, timeout=None, **kwargs) -> requests.Response:
+    """
+    Send a GET request through the shared session (see request).
+    """
+    return request("GET", url, timeout=timeout, **kwargs)
+
+
+def post(url: str, timeout=None, **kwargs) -> requests.Response:
+    """
+    Send a POST request through the shared session (see request).
+    """
+    return request("POST", url, timeout=timeout, **kwargs)
+
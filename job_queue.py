@@ -0,0 +1,253 @@
+"""
+Module for running analyses as background jobs.
+This module provides a small job queue backed by a local thread or process pool, so that
+long-running analyses do not block the web request that submitted them.
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import configuration
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+class Job:
+    """
+    A unit of work submitted to a job queue.
+    """
+
+    def __init__(self, job_id: str):
+        self.id = job_id
+        self.status = JOB_QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._chunks: List[str] = []
+        self._condition = threading.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status in (JOB_SUCCEEDED, JOB_FAILED)
+
+    def publish(self, chunk: str) -> None:
+        """
+        Record a chunk of partial output and wake up any readers waiting for it.
+
+        Args:
+            chunk: The chunk of output
+        """
+        with self._condition:
+            self._chunks.append(chunk)
+            self._condition.notify_all()
+
+    def wait_for_chunks(self, seen: int, timeout: float) -> Tuple[List[str], bool]:
+        """
+        Wait until new output has been published or the job has finished.
+
+        Args:
+            seen: The number of chunks the reader has already received
+            timeout: Maximum time to wait in seconds
+
+        Returns:
+            A tuple containing the new chunks and whether the job has finished
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._chunks) > seen or self.done, timeout=timeout)
+            return self._chunks[seen:], self.done
+
+    def finish(self, result: Any = None, error: Optional[str] = None) -> None:
+        """
+        Mark the job as finished and wake up any readers waiting for it.
+
+        Args:
+            result: The result of the job if it succeeded
+            error: The error message if it failed
+        """
+        with self._condition:
+            self.finished_at = time.time()
+            if error is not None:
+                self.error = error
+                self.status = JOB_FAILED
+            else:
+                self.result = result
+                self.status = JOB_SUCCEEDED
+            self._condition.notify_all()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Describe the job without its result.
+
+        Returns:
+            A dictionary with the job id, status, error and timestamps
+        """
+        return {
+            "id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    Base class for job queues. Subclasses decide where the submitted work runs.
+    """
+
+    def submit(self, func: Callable[..., Any], *args, **kwargs) -> Job:
+        """
+        Submit a function to run in the background.
+
+        Args:
+            func: The function to run
+            *args: Positional arguments for the function
+            **kwargs: Keyword arguments for the function
+
+        Returns:
+            The submitted job
+        """
+        raise NotImplementedError
+
+    def submit_streaming(self, func: Callable[..., Any], *args, **kwargs) -> Job:
+        """
+        Submit a function whose partial output can be followed while it runs.
+
+        The job's publish method is passed to the function as the on_chunk keyword argument.
+        Queues that cannot share partial output across processes run the function without it.
+
+        Args:
+            func: The function to run, accepting an on_chunk keyword argument
+            *args: Positional arguments for the function
+            **kwargs: Keyword arguments for the function
+
+        Returns:
+            The submitted job
+        """
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        Look up a job.
+
+        Args:
+            job_id: The id of the job
+
+        Returns:
+            The job, or None if it is unknown or has expired
+        """
+        raise NotImplementedError
+
+
+class ExecutorJobQueue(JobQueue):
+    """
+    Job queue running jobs on a concurrent.futures executor. Jobs are kept in memory
+    until they have been finished for longer than the retention time.
+    """
+
+    def __init__(self, executor: Executor, retention_seconds: int):
+        """
+        Args:
+            executor: The executor running the jobs
+            retention_seconds: How long finished jobs are kept for status and result lookups
+        """
+        self.executor = executor
+        self.retention_seconds = retention_seconds
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, func: Callable[..., Any], *args, **kwargs) -> Job:
+        job = self._create_job()
+        if isinstance(self.executor, ThreadPoolExecutor):
+            # Jobs running in this process can report when they start
+            future = self.executor.submit(self._run, job, func, *args, **kwargs)
+        else:
+            future = self.executor.submit(func, *args, **kwargs)
+        future.add_done_callback(lambda f: self._finish(job, f))
+        return job
+
+    def submit_streaming(self, func: Callable[..., Any], *args, **kwargs) -> Job:
+        if not isinstance(self.executor, ThreadPoolExecutor):
+            return self.submit(func, *args, **kwargs)
+
+        job = self._create_job()
+        future = self.executor.submit(self._run, job, func, *args, on_chunk=job.publish, **kwargs)
+        future.add_done_callback(lambda f: self._finish(job, f))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _create_job(self) -> Job:
+        job = Job(uuid.uuid4().hex)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        return job
+
+    @staticmethod
+    def _run(job: Job, func: Callable[..., Any], *args, **kwargs) -> Any:
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        return func(*args, **kwargs)
+
+    def _finish(self, job: Job, future: Future) -> None:
+        error = future.exception()
+        if error is not None:
+            job.finish(error=str(error))
+        else:
+            job.finish(result=future.result())
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items() if job.done and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+def _create_thread_queue() -> JobQueue:
+    executor = ThreadPoolExecutor(max_workers=configuration.JOB_QUEUE_MAX_WORKERS, thread_name_prefix="analysis-job")
+    return ExecutorJobQueue(executor, configuration.JOB_RETENTION_SECONDS)
+
+
+def _create_process_queue() -> JobQueue:
+    executor = ProcessPoolExecutor(max_workers=configuration.JOB_QUEUE_MAX_WORKERS)
+    return ExecutorJobQueue(executor, configuration.JOB_RETENTION_SECONDS)
+
+
+# Available job queue backends, selected with configuration.JOB_QUEUE_BACKEND
+JOB_QUEUE_BACKENDS: Dict[str, Callable[[], JobQueue]] = {
+    "thread": _create_thread_queue,
+    "process": _create_process_queue,
+}
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """
+    Get the process-wide job queue, creating it on first use.
+
+    Returns:
+        The shared JobQueue instance
+    """
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                backend = configuration.JOB_QUEUE_BACKEND
+                if backend not in JOB_QUEUE_BACKENDS:
+                    raise ValueError(f"Unsupported job queue backend: {backend}")
+                _job_queue = JOB_QUEUE_BACKENDS[backend]()
+    return _job_queue
@@ -0,0 +1,182 @@
+"""
+Module for handling uploaded media files without loading them into memory.
+This module streams uploads to disk while hashing them, and stages large media files in an
+object store so that they can be passed to the model by reference instead of inline.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+from typing import TYPE_CHECKING, BinaryIO, Optional, Tuple
+from urllib.parse import urlparse
+
+import configuration
+
+if TYPE_CHECKING:
+    from vertexai.generative_models import Part
+
+
+def save_stream(stream: BinaryIO, file_path: str, chunk_size: Optional[int] = None) -> Tuple[str, int]:
+    """
+    Write a stream to a file in chunks, hashing it on the fly.
+
+    Args:
+        stream: The stream to read from
+        file_path: Path of the file to write
+        chunk_size: Number of bytes read at a time
+
+    Returns:
+        A tuple containing the SHA-256 digest and the size of the written data
+    """
+    chunk_size = chunk_size or configuration.UPLOAD_CHUNK_BYTES
+    digest = hashlib.sha256()
+    size = 0
+
+    with open(file_path, "wb") as file:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            file.write(chunk)
+            size += len(chunk)
+
+    return digest.hexdigest(), size
+
+
+def file_digest(file_path: str, chunk_size: Optional[int] = None) -> str:
+    """
+    Compute the SHA-256 digest of a file without reading it into memory at once.
+
+    Args:
+        file_path: Path to the file
+        chunk_size: Number of bytes read at a time
+
+    Returns:
+        The hexadecimal SHA-256 digest of the file
+    """
+    chunk_size = chunk_size or configuration.UPLOAD_CHUNK_BYTES
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ObjectStore:
+    """
+    Base class for stores that media files are staged in before being passed to the model by URI.
+    """
+
+    def stage(self, file_path: str, mime_type: str, digest: str) -> str:
+        """
+        Copy a file into the store, unless it is already there.
+
+        Args:
+            file_path: Path to the file
+            mime_type: The MIME type of the file
+            digest: SHA-256 digest of the file, used as its object name
+
+        Returns:
+            The URI of the staged object
+        """
+        raise NotImplementedError
+
+
+class GCSObjectStore(ObjectStore):
+    """
+    Object store backed by a Google Cloud Storage bucket, whose objects Gemini can read directly.
+    """
+
+    def __init__(self, bucket_name: str, prefix: str = ""):
+        from google.cloud import storage
+
+        self.bucket = storage.Client(project=configuration.PROJECT_ID).bucket(bucket_name)
+        self.prefix = prefix.strip("/")
+
+    def stage(self, file_path: str, mime_type: str, digest: str) -> str:
+        name = f"{self.prefix}/{digest}" if self.prefix else digest
+        blob = self.bucket.blob(name)
+        if not blob.exists():
+            # Uploads from the file in chunks, the file is never read into memory
+            blob.upload_from_filename(file_path, content_type=mime_type)
+        return f"gs://{self.bucket.name}/{name}"
+
+
+class LocalObjectStore(ObjectStore):
+    """
+    Object store backed by a local directory, standing in for cloud storage during development.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def stage(self, file_path: str, mime_type: str, digest: str) -> str:
+        staged_path = os.path.join(self.directory, digest)
+        if not os.path.exists(staged_path):
+            try:
+                os.link(file_path, staged_path)
+            except OSError:
+                shutil.copyfile(file_path, staged_path)
+        return f"file://{os.path.abspath(staged_path)}"
+
+
+_object_store = None
+_object_store_lock = threading.Lock()
+
+
+def get_object_store() -> Optional[ObjectStore]:
+    """
+    Get the object store configured with configuration.MEDIA_STAGING_URI, creating it on first use.
+
+    Returns:
+        The shared ObjectStore instance, or None if staging is not configured
+    """
+    global _object_store
+    if _object_store is None and configuration.MEDIA_STAGING_URI:
+        with _object_store_lock:
+            if _object_store is None:
+                location = urlparse(configuration.MEDIA_STAGING_URI)
+                if location.scheme == "gs":
+                    _object_store = GCSObjectStore(location.netloc, location.path)
+                elif location.scheme == "file":
+                    _object_store = LocalObjectStore(location.path)
+                else:
+                    raise ValueError(f"Unsupported media staging URI: {configuration.MEDIA_STAGING_URI}")
+    return _object_store
+
+
+def media_part(file_path: str, mime_type: str, digest: Optional[str] = None) -> "Part":
+    """
+    Create a content part for a media file.
+
+    Files larger than configuration.MEDIA_INLINE_MAX_BYTES are staged in the object store and
+    passed by URI, and rejected when staging is not configured; smaller files are sent inline.
+
+    Args:
+        file_path: Path to the media file
+        mime_type: The MIME type of the file
+        digest: SHA-256 digest of the file, computed if not given
+
+    Returns:
+        The content part
+    """
+    from vertexai.generative_models import Part
+
+    object_store = get_object_store()
+    if os.path.getsize(file_path) > configuration.MEDIA_INLINE_MAX_BYTES:
+        if object_store is None:
+            raise ValueError(
+                f"The file is larger than {configuration.MEDIA_INLINE_MAX_BYTES // (1024 * 1024)}MB, the largest "
+                f"file that can be analyzed without media staging (MEDIA_STAGING_URI)"
+            )
+        uri = object_store.stage(file_path, mime_type, digest or file_digest(file_path))
+        return Part.from_uri(uri, mime_type)
+
+    with open(file_path, "rb") as file:
+        return Part.from_data(file.read(), mime_type)
@@ -0,0 +1,373 @@
+"""
+Module for the application metrics.
+This module keeps counters, gauges and histograms in process memory and renders them in the
+Prometheus text format for the /metrics endpoint. Stage timings are labelled with the content
+type and country of the analysis being run, which are set once per request with `labels` and
+picked up by every timed stage below it.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from data.country_data import COUNTRY_LANGUAGE_DESCRIPTION
+
+# Labels of the current analysis or transformation, e.g. content_type and country
+_context_labels: ContextVar[Dict[str, str]] = ContextVar("metric_labels", default={})
+
+_registry: List["Metric"] = []
+
+# Label values of the analyses, any other value from the request is recorded as OTHER_LABEL so
+# that the number of time series stays bounded
+CONTENT_TYPES = ("URL", "Website", "Document", "Image", "Video")
+OTHER_LABEL = "other"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = tuple(4 ** exponent for exponent in range(4, 15))  # 256B to 256MB
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 1000000)
+
+
+class Metric:
+    """
+    Base class for metrics with a fixed set of label names.
+
+    Label values missing from an update are taken from the labels of the current context (see
+    `labels`), or left empty.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        """
+        Args:
+            name: The metric name
+            documentation: The help text of the metric
+            label_names: The names of the labels of the metric
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, label_values: Dict[str, Any]) -> Tuple[str, ...]:
+        context = _context_labels.get()
+        return tuple(str(label_values.get(name, context.get(name, ""))) for name in self.label_names)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (
+            f'{name}="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+            for name, value in pairs
+        )
+        return "{" + ",".join(escaped) + "}"
+
+    def samples(self) -> List[str]:
+        """
+        Get the samples of the metric in the Prometheus text format.
+
+        Returns:
+            The sample lines
+        """
+        with self._lock:
+            return [f"{self.name}{self._format_labels(key)} {value}" for key, value in sorted(self._values.items())]
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value.
+    """
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **label_values: Any) -> None:
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Value that is set to its current state.
+    """
+
+    type = "gauge"
+
+    def set(self, value: float, **label_values: Any) -> None:
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values over cumulative buckets.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        Args:
+            name: The metric name
+            documentation: The help text of the metric
+            label_names: The names of the labels of the metric
+            buckets: The upper bounds of the buckets, in increasing order
+        """
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **label_values: Any) -> None:
+        key = self._key(label_values)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(f"{self.name}_bucket{self._format_labels(key, (('le', le),))} {cumulative}")
+                lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "compliance_stage_duration_seconds", "Duration of the processing stages of analyses and transformations",
+    ("stage", "content_type", "country")
+)
+STAGE_ERRORS = Counter(
+    "compliance_stage_errors_total", "Processing stages that raised an error", ("stage", "content_type", "country")
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "compliance_http_request_duration_seconds", "Time to produce the response of an HTTP request (streamed bodies excluded)",
+    ("endpoint", "method", "status")
+)
+MODEL_FIRST_CHUNK_SECONDS = Histogram(
+    "compliance_model_time_to_first_chunk_seconds", "Time from sending a prompt to receiving the first response chunk",
+    ("backend", "content_type", "country")
+)
+MODEL_SECONDS = Histogram(
+    "compliance_model_duration_seconds", "Time from sending a prompt to receiving the whole response",
+    ("backend", "content_type", "country")
+)
+MODEL_ERRORS = Counter("compliance_model_errors_total", "Model calls that failed", ("backend",))
+MODEL_BYTES = Histogram(
+    "compliance_model_bytes", "Size of the content sent to (in) and received from (out) the model per call",
+    ("direction", "backend", "content_type", "country"), buckets=BYTES_BUCKETS
+)
+MODEL_TOKENS = Histogram(
+    "compliance_model_tokens", "Estimated number of text tokens sent to (in) and received from (out) the model per call",
+    ("direction", "backend", "content_type", "country"), buckets=TOKEN_BUCKETS
+)
+INPUT_TOKENS = Histogram(
+    "compliance_input_tokens", "Estimated tokens of the text extracted from the content, before and after trimming",
+    ("stage", "content_type", "country"), buckets=TOKEN_BUCKETS
+)
+INPUT_TOKENS_SAVED = Histogram(
+    "compliance_input_tokens_saved", "Estimated tokens removed from the text of the content by trimming",
+    ("content_type", "country"), buckets=(0,) + TOKEN_BUCKETS
+)
+OVER_BUDGET_ANALYSES = Counter(
+    "compliance_over_budget_analyses_total", "Analyses split into chunks because their input exceeds the token budget",
+    ("content_type", "country")
+)
+TRANSFORMED_PAGES = Counter(
+    "compliance_transformed_pages_total",
+    "Document pages transformed, by mode: spans (flagged texts replaced), rewrite (whole page), translate, "
+    "and fallback (spans not found on the page, also counted as rewrite)",
+    ("mode", "content_type", "country")
+)
+STORAGE_FILES = Gauge("compliance_storage_files", "Files held per storage category", ("category",))
+STORAGE_BYTES = Gauge("compliance_storage_bytes", "Bytes held per storage category", ("category",))
+STORAGE_REMOVED = Gauge(
+    "compliance_storage_removed_files", "Files removed per storage category since startup", ("category", "reason")
+)
+CACHE_EVENTS = Gauge(
+    "compliance_cache_events", "Cache counters since startup (hits, misses, stores, evictions)", ("cache", "event")
+)
+CACHE_ENTRIES = Gauge("compliance_cache_entries", "Entries held per cache", ("cache",))
+
+
+@contextmanager
+def labels(**label_values: Any) -> Iterator[None]:
+    """
+    Set labels for all the metrics recorded in the current context, e.g. the content type and
+    country of an analysis.
+
+    Args:
+        **label_values: The label values
+    """
+    token = _context_labels.set({**_context_labels.get(), **{name: str(value) for name, value in label_values.items()}})
+    try:
+        yield
+    finally:
+        _context_labels.reset(token)
+
+
+def analysis_labels(content_type: Optional[str], country: Union[str, List[str], None]):
+    """
+    Set the content type and country labels of an analysis, see `labels`. Values from the request
+    outside of the known content types and configured countries are labelled OTHER_LABEL.
+
+    Args:
+        content_type: The type of content
+        country: The country, or the list of countries of a multi-country analysis
+
+    Returns:
+        The context manager setting the labels
+    """
+    countries = country if isinstance(country, list) else [country]
+    return labels(
+        content_type=content_type if content_type in CONTENT_TYPES else OTHER_LABEL,
+        country=",".join(name if name in COUNTRY_LANGUAGE_DESCRIPTION else OTHER_LABEL for name in countries)
+    )
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Record the duration of a processing stage, and count it as an error if it raises.
+
+    Can also be used as a function decorator.
+
+    Args:
+        stage: The name of the stage
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text, at about four characters per token.
+
+    Args:
+        text: The text
+
+    Returns:
+        The estimated number of tokens
+    """
+    return (len(text) + 3) // 4
+
+
+def content_size(parts: List[Any]) -> Tuple[int, int]:
+    """
+    Measure the content parts of a prompt.
+
+    Args:
+        parts: Strings or vertexai Part objects
+
+    Returns:
+        A tuple containing the size in bytes of the inline content and the estimated number of
+        text tokens
+    """
+    size = 0
+    tokens = 0
+    for part in parts:
+        text = part if isinstance(part, str) else _part_text(part)
+        if text is not None:
+            size += len(text.encode("utf-8"))
+            tokens += estimate_tokens(text)
+            continue
+        try:
+            size += len(part.inline_data.data)
+        except (AttributeError, ValueError):
+            # Content passed by reference
+            continue
+    return size, tokens
+
+
+def _part_text(part: Any) -> Optional[str]:
+    # vertexai Parts raise when reading the text of a binary part
+    try:
+        return part.text
+    except (AttributeError, ValueError):
+        return None
+
+
+def instrument_stream(chunks: Iterator[str], backend: str, size_in: int, tokens_in: int) -> Iterator[str]:
+    """
+    Record the timings and sizes of a streamed model response.
+
+    Args:
+        chunks: The response chunks
+        backend: The name of the model backend
+        size_in: Size in bytes of the prompt content
+        tokens_in: Estimated number of tokens of the prompt text
+
+    Returns:
+        An iterator of the same chunks
+    """
+    start = time.perf_counter()
+    size_out = 0
+    tokens_out = 0
+    first = True
+    try:
+        for chunk in chunks:
+            if first:
+                MODEL_FIRST_CHUNK_SECONDS.observe(time.perf_counter() - start, backend=backend)
+                first = False
+            size_out += len(chunk.encode("utf-8"))
+            tokens_out += estimate_tokens(chunk)
+            yield chunk
+    except Exception:
+        MODEL_ERRORS.inc(backend=backend)
+        raise
+    MODEL_SECONDS.observe(time.perf_counter() - start, backend=backend)
+    observe_model_sizes(backend, size_in, tokens_in, size_out, tokens_out)
+
+
+def observe_model_sizes(backend: str, size_in: int, tokens_in: int, size_out: int, tokens_out: int) -> None:
+    """
+    Record the sizes of a model call.
+
+    Args:
+        backend: The name of the model backend
+        size_in: Size in bytes of the prompt content
+        tokens_in: Estimated number of tokens of the prompt text
+        size_out: Size in bytes of the response
+        tokens_out: Estimated number of tokens of the response
+    """
+    MODEL_BYTES.observe(size_in, direction="in", backend=backend)
+    MODEL_BYTES.observe(size_out, direction="out", backend=backend)
+    MODEL_TOKENS.observe(tokens_in, direction="in", backend=backend)
+    MODEL_TOKENS.observe(tokens_out, direction="out", backend=backend)
+
+
+def render() -> str:
+    """
+    Render all the metrics in the Prometheus text format (version 0.0.4).
+
+    Returns:
+        The metrics text
+    """
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,438 @@
+"""
+Module for the model backends used by the AI services.
+This module hides which service runs the analysis and transformation prompts behind a small
+interface, with backends for VertexAI (Gemini), OpenAI and a deterministic local fake that
+allows load tests and benchmarks to run offline.
+"""
+
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import configuration
+import http_client
+import metrics
+
+
+class ModelBackend:
+    """
+    Base class for model backends.
+
+    Content parts are strings or vertexai Part objects, which are used as the common format
+    for text and binary content.
+    """
+
+    def generate(
+        self,
+        system_instruction: str,
+        parts: List[Any],
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        """
+        Send a prompt with content to the model and stream the response.
+
+        Args:
+            system_instruction: The system instruction for the model
+            parts: The content parts of the user message
+            response_schema: JSON schema the response must follow, or None for free-form output
+
+        Returns:
+            An iterator of response chunks
+        """
+        raise NotImplementedError
+
+    def complete(self, system_instruction: str, prompt: str, temperature: float = 0.5, max_tokens: int = 4000) -> str:
+        """
+        Send a text prompt to the model and return the whole response.
+
+        Args:
+            system_instruction: The system instruction for the model
+            prompt: The user message
+            temperature: The sampling temperature
+            max_tokens: The maximum number of tokens in the response
+
+        Returns:
+            The response text
+        """
+        return "".join(self.generate(system_instruction, [prompt]))
+
+
+class VertexBackend(ModelBackend):
+    """
+    Backend calling Gemini models through VertexAI.
+    """
+
+    def __init__(self, project: str, location: str, model_name: str):
+        import vertexai
+
+        vertexai.init(project=project, location=location)
+        self.model_name = model_name
+
+    def generate(
+        self,
+        system_instruction: str,
+        parts: List[Any],
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        from vertexai.generative_models import GenerationConfig
+        from model_registry import get_model
+
+        # Get the shared Gemini model for this system instruction
+        model = get_model(self.model_name, system_instruction)
+        generation_config = None
+        if response_schema is not None:
+            generation_config = GenerationConfig(response_mime_type="application/json", response_schema=response_schema)
+
+        response = model.generate_content(parts, generation_config=generation_config, stream=True)
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+    def complete(self, system_instruction: str, prompt: str, temperature: float = 0.5, max_tokens: int = 4000) -> str:
+        from vertexai.generative_models import GenerationConfig
+        from model_registry import get_model
+
+        model = get_model(self.model_name, system_instruction)
+        response = model.generate_content(
+            prompt,
+            generation_config=GenerationConfig(temperature=temperature, max_output_tokens=max_tokens)
+        )
+        return response.text
+
+
+class OpenAIBackend(ModelBackend):
+    """
+    Backend calling the OpenAI chat completions API.
+    """
+
+    def __init__(self, base_url: str, api_key: Optional[str], model_name: str):
+        self.api_url = f"{base_url}/chat/completions"
+        self.api_key = api_key
+        self.model_name = model_name
+
+    def _post(self, data: Dict[str, Any], stream: bool = False):
+        # Prepare headers with an API key
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        response = http_client.post(self.api_url, headers=headers, json=data, timeout=configuration.OPENAI_TIMEOUT,
+                                    stream=stream)
+
+        if response.status_code != 200:
+            print(f"\nOpenAI API error: {response.status_code} - {response.text}\n")
+            raise Exception(f"OpenAI API error: {response.status_code} - {response.text}")
+        return response
+
+    def generate(
+        self,
+        system_instruction: str,
+        parts: List[Any],
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        data = {
+            "model": self.model_name,
+            "messages": [
+                {"role": "system", "content": system_instruction},
+                {"role": "user", "content": [_to_openai_content(part) for part in parts]}
+            ],
+            "stream": True
+        }
+        if response_schema is not None:
+            # The JSON mode of the chat API, the schema itself is described by the prompt
+            data["response_format"] = {"type": "json_object"}
+
+        response = self._post(data, stream=True)
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            payload = line[len("data: "):]
+            if payload == "[DONE]":
+                break
+            choices = json.loads(payload).get("choices") or [{}]
+            content = choices[0].get("delta", {}).get("content")
+            if content:
+                yield content
+
+    def complete(self, system_instruction: str, prompt: str, temperature: float = 0.5, max_tokens: int = 4000) -> str:
+        data = {
+            "model": self.model_name,
+            "messages": [
+                {"role": "system", "content": system_instruction},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        response_data = self._post(data).json()
+        return response_data['choices'][0]['message']['content']
+
+
+def _to_openai_content(part: Any) -> Dict[str, Any]:
+    if isinstance(part, str):
+        return {"type": "text", "text": part}
+
+    part_data = part.to_dict()
+    if "text" in part_data:
+        return {"type": "text", "text": part_data["text"]}
+    inline_data = part_data.get("inline_data", {})
+    if inline_data.get("mime_type", "").startswith("image/"):
+        return {"type": "image_url", "image_url": {"url": f"data:{inline_data['mime_type']};base64,{inline_data['data']}"}}
+    mime_type = inline_data.get("mime_type") or part_data.get("file_data", {}).get("mime_type", "unknown")
+    raise ValueError(f"Content of type {mime_type} is not supported by the OpenAI backend")
+
+
+class FakeBackend(ModelBackend):
+    """
+    Deterministic local stand-in for a model, for load tests and benchmarks.
+
+    Responses only depend on the prompt and content, and follow the requested response schema.
+    Analyses quote lines of the analyzed text or PDF, so that the quotes can be found on its pages.
+    """
+
+    def __init__(self, latency: float = 0.5, chunk_size: int = 64, chunk_delay: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0):
+        """
+        Args:
+            latency: Seconds before the first chunk of a response
+            chunk_size: Number of characters per streamed chunk
+            chunk_delay: Seconds between two chunks
+            error_rate: Fraction of the calls that fail, between 0 and 1
+            seed: Seed of the random generator deciding which calls fail
+        """
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _digest(self, system_instruction: str, parts: List[Any]) -> str:
+        digest = hashlib.sha256(system_instruction.encode("utf-8"))
+        for part in parts:
+            if isinstance(part, str):
+                digest.update(part.encode("utf-8"))
+            else:
+                digest.update(json.dumps(part.to_dict(), sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _check_error(self) -> None:
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+        if failed:
+            raise Exception("Fake model error")
+
+    def _stream(self, text: str) -> Iterator[str]:
+        time.sleep(self.latency)
+        for index in range(0, len(text), self.chunk_size):
+            if index and self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            yield text[index:index + self.chunk_size]
+
+    def generate(
+        self,
+        system_instruction: str,
+        parts: List[Any],
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        self._check_error()
+        digest = self._digest(system_instruction, parts)
+
+        pages = _content_pages(parts)
+        if response_schema is not None:
+            result = _fake_instance(response_schema, digest, pages)
+        else:
+            result = _fake_analysis(digest, pages)
+
+        text = json.dumps(result, indent=2)
+        if response_schema is None:
+            text = f"```json\n{text}\n```"
+        return self._stream(text)
+
+    def complete(self, system_instruction: str, prompt: str, temperature: float = 0.5, max_tokens: int = 4000) -> str:
+        self._check_error()
+        time.sleep(self.latency)
+        return f"Compliant version ({self._digest(system_instruction, [prompt])[:8]}):\n\n{prompt[-2000:]}"
+
+
+def _content_pages(parts: List[Any]) -> List[str]:
+    # The analyzed content is the last part; text pages are separated by form feeds
+    if not parts:
+        return []
+    part = parts[-1]
+    if isinstance(part, str):
+        return part.split("\f")
+    # Text content is sent as a text Part, PDFs as inline data
+    part = part.to_dict()
+    if "text" in part:
+        return part["text"].split("\f")
+    inline_data = part.get("inline_data", {})
+    if inline_data.get("mime_type") == "application/pdf":
+        from document_text import extract_pdf_pages
+
+        return extract_pdf_pages(base64.b64decode(inline_data["data"]))
+    return []
+
+
+def _fake_instance(schema: Dict[str, Any], digest: str, pages: List[str]) -> Any:
+    schema_type = schema.get("type", "object").lower()
+    if schema_type == "object":
+        properties = schema.get("properties", {})
+        if "Compliant Status" in properties:
+            return _fake_analysis(digest, pages)
+        return {key: _fake_instance(value, hashlib.sha256((digest + key).encode("utf-8")).hexdigest(), pages)
+                for key, value in properties.items()}
+    if schema_type == "array":
+        return [_fake_instance(schema.get("items", {}), digest, pages)]
+    if schema_type in ("integer", "number"):
+        return int(digest[:2], 16) * 100 // 255
+    if schema_type == "boolean":
+        return int(digest[:2], 16) % 2 == 0
+    if schema.get("enum"):
+        return schema["enum"][0]
+    return f"Fake text {digest[:12]}."
+
+
+def _fake_quotes(page_text: str, page: int, digest: str) -> List[str]:
+    # Two distinct lines of the page, preferring sentences to headings and labels
+    lines = [line.strip() for line in page_text.splitlines() if any(char.isalpha() for char in line)]
+    lines = [line for line in lines if len(line) >= 20] or lines
+    if not lines:
+        return [f"Claim {page}.{item} of the document" for item in range(1, 3)]
+    start = int(digest[2:6], 16) % len(lines)
+    return list(dict.fromkeys(lines[(start + item) % len(lines)] for item in range(2)))
+
+
+def _fake_analysis(digest: str, pages: Optional[List[str]] = None) -> Dict[str, Any]:
+    percentage = int(digest[:2], 16) * 100 // 255
+    if percentage < 20:
+        percentage = 0
+    page_count = percentage // 20
+    if pages:
+        page_count = min(page_count, len(pages))
+    non_compliant_pages = [
+        {
+            "Page Number": page,
+            "Page Non-Compliance Percentage": percentage,
+            "Non-Compliant Text": [
+                {"Text": quote, "Reason": "The claim is not supported by evidence."}
+                for quote in _fake_quotes(pages[page - 1] if pages else "", page, digest)
+            ]
+        }
+        for page in range(1, page_count + 1)
+    ]
+    return {
+        "Compliant Status": "Compliant" if percentage == 0 else "Non Compliant",
+        "Non-Compliance Percentage": percentage,
+        "Detailed Analysis": f"Fake analysis {digest[:12]}.",
+        "Non-Compliant Pages": non_compliant_pages,
+    }
+
+
+class InstrumentedBackend(ModelBackend):
+    """
+    Backend recording the latency and sizes of the calls to another backend (see metrics.py).
+    """
+
+    def __init__(self, name: str, backend: ModelBackend):
+        """
+        Args:
+            name: The name of the backend, used as a metric label
+            backend: The backend to instrument
+        """
+        self.name = name
+        self.backend = backend
+
+    def generate(
+        self,
+        system_instruction: str,
+        parts: List[Any],
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        size_in, tokens_in = metrics.content_size([system_instruction] + list(parts))
+        chunks = self.backend.generate(system_instruction, parts, response_schema=response_schema)
+        return metrics.instrument_stream(chunks, self.name, size_in, tokens_in)
+
+    def complete(self, system_instruction: str, prompt: str, temperature: float = 0.5, max_tokens: int = 4000) -> str:
+        size_in, tokens_in = metrics.content_size([system_instruction, prompt])
+        start = time.perf_counter()
+        try:
+            response = self.backend.complete(system_instruction, prompt, temperature=temperature, max_tokens=max_tokens)
+        except Exception:
+            metrics.MODEL_ERRORS.inc(backend=self.name)
+            raise
+        metrics.MODEL_SECONDS.observe(time.perf_counter() - start, backend=self.name)
+        metrics.observe_model_sizes(self.name, size_in, tokens_in, len(response.encode("utf-8")),
+                                    metrics.estimate_tokens(response))
+        return response
+
+
+def _create_vertex_backend() -> ModelBackend:
+    return VertexBackend(configuration.PROJECT_ID, configuration.VERTEXT_AI_REGION_NAME, configuration.MODEL_NAME)
+
+
+def _create_openai_backend() -> ModelBackend:
+    return OpenAIBackend(configuration.OPENAI_API_BASE_URL, configuration.OPENAI_API_KEY, configuration.OPENAI_MODEL_NAME)
+
+
+def _create_fake_backend() -> ModelBackend:
+    return FakeBackend(
+        latency=configuration.FAKE_MODEL_LATENCY_SECONDS,
+        chunk_size=configuration.FAKE_MODEL_CHUNK_SIZE,
+        chunk_delay=configuration.FAKE_MODEL_CHUNK_DELAY_SECONDS,
+        error_rate=configuration.FAKE_MODEL_ERROR_RATE,
+        seed=configuration.FAKE_MODEL_SEED,
+    )
+
+
+MODEL_BACKENDS: Dict[str, Callable[[], ModelBackend]] = {
+    "vertex": _create_vertex_backend,
+    "openai": _create_openai_backend,
+    "fake": _create_fake_backend,
+}
+
+_backends: Dict[str, ModelBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name: Optional[str] = None) -> ModelBackend:
+    """
+    Get the process-wide instance of a model backend, creating it on first use.
+
+    Args:
+        name: The name of the backend (vertex, openai or fake), configuration.MODEL_BACKEND by default
+
+    Returns:
+        The shared ModelBackend instance, recording its latency and sizes in the metrics
+    """
+    name = name or configuration.MODEL_BACKEND
+    backend = _backends.get(name)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(name)
+            if backend is None:
+                if name not in MODEL_BACKENDS:
+                    raise ValueError(f"Unsupported model backend: {name}")
+                backend = InstrumentedBackend(name, MODEL_BACKENDS[name]())
+                _backends[name] = backend
+    return backend
+
+
+def backend_model_id(name: Optional[str] = None) -> str:
+    """
+    Identify the backend and model answering the prompts, to key the stored model outputs (cached
+    analyses, translations) so that the outputs of one model are never served for another.
+
+    Args:
+        name: The name of the backend (vertex, openai or fake), configuration.MODEL_BACKEND by default
+
+    Returns:
+        The backend name and its model name, e.g. "vertex:gemini-2.5-pro"
+    """
+    name = name or configuration.MODEL_BACKEND
+    model_names = {"vertex": configuration.MODEL_NAME, "openai": configuration.OPENAI_MODEL_NAME}
+    return f"{name}:{model_names.get(name, name)}"
@@ -0,0 +1,48 @@
+"""
+Module for sharing model instances across requests.
+This module builds each Gemini model once per (model name, system instruction) and reuses it, so
+that requests do not pay for creating a new model, prediction client and gRPC channel every time.
+"""
+
+import threading
+from typing import Dict, Optional, Tuple
+
+from vertexai.generative_models import GenerativeModel
+
+import configuration
+
+_models: Dict[Tuple[str, Optional[str]], GenerativeModel] = {}
+_models_lock = threading.Lock()
+
+
+def get_model(model_name: Optional[str] = None, system_instruction: Optional[str] = None) -> GenerativeModel:
+    """
+    Get the shared model for a model name and system instruction, creating it on first use.
+
+    The returned model is shared between threads and must only be used for stateless calls such
+    as generate_content, never for chat sessions.
+
+    Args:
+        model_name: The name of the model, configuration.MODEL_NAME by default
+        system_instruction: The system instruction for the model
+
+    Returns:
+        The shared GenerativeModel instance
+    """
+    key = (model_name or configuration.MODEL_NAME, system_instruction)
+    model = _models.get(key)
+    if model is None:
+        with _models_lock:
+            model = _models.get(key)
+            if model is None:
+                model = GenerativeModel(key[0], system_instruction=system_instruction)
+                _models[key] = model
+    return model
+
+
+def clear_models() -> None:
+    """
+    Drop all shared models, e.g. after the SDK has been re-initialized with other settings.
+    """
+    with _models_lock:
+        _models.clear()
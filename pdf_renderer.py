@@ -0,0 +1,188 @@
+"""
+Module for rendering the transformed documents as PDF.
+This module renders PDFs on a pool of background workers into the artifact store, so that the
+transform request can return as soon as the model output is ready. The state of a render is kept
+next to its artifact, in a pending marker and an error file, so that any worker of the server can
+wait for it. The reportlab stylesheet is built once and shared by all renders.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from typing import Dict, Optional
+from xml.sax.saxutils import escape
+
+import configuration
+import metrics
+from artifact_store import get_artifact_store
+
+_styles = None
+_styles_lock = threading.Lock()
+
+# Shared pool bounding the number of concurrent renders
+_render_executor = None
+_render_executor_lock = threading.Lock()
+
+# Renders still running in this process, keyed by artifact id; other workers poll the pending marker
+_pending: Dict[str, Future] = {}
+_pending_lock = threading.Lock()
+
+_PENDING_SUFFIX = ".pending"
+_ERROR_SUFFIX = ".error"
+_POLL_INTERVAL_SECONDS = 0.2
+
+
+def _get_styles():
+    global _styles
+    if _styles is None:
+        with _styles_lock:
+            if _styles is None:
+                # reportlab is only loaded when the first document is rendered
+                from reportlab.lib.styles import getSampleStyleSheet
+
+                _styles = getSampleStyleSheet()
+    return _styles
+
+
+@metrics.timed("pdf_render")
+def render_pdf(text: str, path: str) -> None:
+    """
+    Render a text as a PDF file.
+
+    Args:
+        text: The text to include in the PDF, paragraphs are separated by blank lines
+        path: Path of the PDF file to write
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+
+    doc = SimpleDocTemplate(path, pagesize=letter)
+    normal_style = _get_styles()['Normal']
+
+    # Split the text into paragraphs
+    paragraphs = text.split('\n\n')
+
+    # Create a list of followable
+    followable = []
+    for para in paragraphs:
+        if para.strip():
+            # The text is not markup, characters such as & and < must be escaped
+            followable.append(Paragraph(escape(para).replace('\n', '<br/>'), normal_style))
+            followable.append(Spacer(1, 12))
+
+    # Build the PDF
+    doc.build(followable)
+
+
+def render_to_artifact(text: str, artifact_id: str) -> str:
+    """
+    Render a text as a PDF artifact, then clear its pending marker. The message of a rendering
+    error is written next to the artifact for the workers waiting for it.
+
+    Args:
+        text: The text to include in the PDF
+        artifact_id: The id of the artifact to write
+
+    Returns:
+        The path of the artifact
+    """
+    store = get_artifact_store()
+    path = store.path(artifact_id)
+    try:
+        render_pdf(text, store.temporary_path(artifact_id))
+        return store.commit(artifact_id)
+    except Exception as e:
+        _remove(path + ".tmp")
+        with open(path + _ERROR_SUFFIX, "w", encoding="utf-8") as error_file:
+            error_file.write(str(e) or type(e).__name__)
+        raise
+    finally:
+        _remove(path + _PENDING_SUFFIX)
+
+
+def submit_render(text: str) -> str:
+    """
+    Render a text as a PDF artifact in the background.
+
+    Args:
+        text: The text to include in the PDF
+
+    Returns:
+        The id of the artifact, available once the render has finished (see wait_for_render)
+    """
+    store = get_artifact_store()
+    artifact_id = store.create(".pdf")
+    # The marker is written before the render starts, a download can follow right away on any worker
+    marker = store.path(artifact_id) + _PENDING_SUFFIX
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    with open(marker, "w"):
+        pass
+    with _pending_lock:
+        future = _get_render_executor().submit(copy_context().run, render_to_artifact, text, artifact_id)
+        _pending[artifact_id] = future
+    future.add_done_callback(lambda _: _forget(artifact_id))
+    return artifact_id
+
+
+def wait_for_render(artifact_id: str, timeout: Optional[float] = None) -> Optional[str]:
+    """
+    Wait for a PDF artifact to be rendered.
+
+    Args:
+        artifact_id: The id of the artifact
+        timeout: Maximum number of seconds to wait, configuration.PDF_RENDER_WAIT_SECONDS by default
+
+    Returns:
+        The path of the artifact, or None if it is unknown or has expired; rendering errors are raised
+    """
+    store = get_artifact_store()
+    try:
+        path = store.path(artifact_id)
+    except ValueError:
+        return None
+    deadline = time.monotonic() + (timeout if timeout is not None else configuration.PDF_RENDER_WAIT_SECONDS)
+
+    with _pending_lock:
+        future = _pending.get(artifact_id)
+    if future is not None:
+        # Rendered by this worker, its errors are also in the error file
+        wait([future], max(deadline - time.monotonic(), 0))
+    while os.path.exists(path + _PENDING_SUFFIX):
+        # Rendered by another worker
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"The render of {artifact_id} has not finished")
+        time.sleep(_POLL_INTERVAL_SECONDS)
+
+    try:
+        with open(path + _ERROR_SUFFIX, encoding="utf-8") as error_file:
+            error = error_file.read()
+    except FileNotFoundError:
+        return store.get(artifact_id)
+    raise RuntimeError(error)
+
+
+def _forget(artifact_id: str) -> None:
+    # The outcome of the render is in the artifact store, the future is no longer needed
+    with _pending_lock:
+        _pending.pop(artifact_id, None)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _get_render_executor() -> ThreadPoolExecutor:
+    global _render_executor
+    if _render_executor is None:
+        with _render_executor_lock:
+            if _render_executor is None:
+                _render_executor = ThreadPoolExecutor(
+                    max_workers=configuration.PDF_RENDER_MAX_WORKERS,
+                    thread_name_prefix="pdf-render"
+                )
+    return _render_executor
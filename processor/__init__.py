@@ -5,6 +5,6 @@ This package contains modules for processing documents, URLs, images, and videos
 
 # Import all processor functions for easy access
 from .document import process_document
-from .url import process_url
+from .url import process_url, process_site
 from .image import process_image
 from .video import process_video
\ No newline at end of file
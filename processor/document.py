@@ -3,11 +3,28 @@ Module for processing document files (PDF and TXT) using VertexAI.
 This module provides functionality to read document files and analyze them using VertexAI.
 """
 
+import io
+import json
 import os
-from typing import Iterator
-from vertexai.generative_models import Part
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple, Union
 
-from ai_service import analyze_content_with_gemini
+import configuration
+import metrics
+from ai_service import analyze_content, cached_analysis, split_country_results
+from document_text import extract_pdf_pages
+from result_cache import content_digest
+from structured_output import ANALYSIS_SCHEMA, parse_analysis_response
+from token_budget import estimate_tokens, exceeds_budget, split_pages, trim_pages
+
+if TYPE_CHECKING:
+    from vertexai.generative_models import Part
+
+# Shared pool bounding the number of concurrent page-range analyses across all requests
+_chunk_executor = None
+_chunk_executor_lock = threading.Lock()
 
 def read_document_file(file_path: str) -> tuple[bytes, str]:
     """
@@ -38,15 +55,16 @@ def read_document_file(file_path: str) -> tuple[bytes, str]:
 
 def process_document(
     file_path: str,
-    country:str,
+    country: Union[str, List[str]],
+    fan_out: Optional[bool] = None,
 ) -> Iterator[str]:
     """
     Process a document file (PDF or TXT) using VertexAI.
 
     Args:
         file_path: Path to the document file
-        prompt: The prompt to send to the model
-        system_instruction: The system instruction for the model
+        country: The country for which to check compliance, or a list of countries to check in a single model call
+        fan_out: Whether to analyze a PDF in page ranges (see analyze_document_data)
 
     Returns:
         An iterator of response chunks from the model
@@ -54,13 +72,328 @@ def process_document(
     # Read the document file
     document_data, file_type = read_document_file(file_path)
 
+    return analyze_document_data(document_data, file_type, country, fan_out=fan_out)
+
+
+def analyze_document_data(
+    document_data: bytes,
+    file_type: str,
+    country: Union[str, List[str]],
+    fan_out: Optional[bool] = None,
+) -> Iterator[str]:
+    """
+    Analyze the contents of a document file (PDF or TXT) using VertexAI.
+
+    Long PDFs are split into page ranges that are analyzed concurrently (see analyze_pdf_in_chunks),
+    as are documents exceeding the token budget. Boilerplate is removed from text documents.
+
+    Args:
+        document_data: The contents of the document file
+        file_type: The MIME type of the document
+        country: The country for which to check compliance, or a list of countries to check in a single model call
+        fan_out: Whether to analyze a PDF in page ranges; by default this is done for PDFs with at
+            least configuration.PDF_FAN_OUT_MIN_PAGES pages
+
+    Returns:
+        An iterator of response chunks from the model
+    """
+    if file_type == "text/plain":
+        return analyze_text_document(document_data, country)
+
+    if file_type == "application/pdf" and fan_out is not False:
+        page_count = count_pdf_pages(document_data)
+        pages_per_chunk = configuration.PDF_FAN_OUT_PAGES_PER_CHUNK
+        over_budget = exceeds_budget(page_count * configuration.PDF_PAGE_TOKENS)
+        if over_budget:
+            # Keep each page range within the token budget
+            metrics.OVER_BUDGET_ANALYSES.inc()
+            max_pages = max(1, configuration.MODEL_INPUT_TOKEN_BUDGET // configuration.PDF_PAGE_TOKENS)
+            pages_per_chunk = min(pages_per_chunk, max_pages)
+        if fan_out or over_budget or page_count >= configuration.PDF_FAN_OUT_MIN_PAGES:
+            return cached_analysis(
+                content_hash=content_digest(f"{content_digest(document_data)}:pages:{pages_per_chunk}"),
+                country=country,
+                analyze=lambda: analyze_pdf_in_chunks(document_data, country, pages_per_chunk)
+            )
+
     # Create content parts for analysis
+    from vertexai.generative_models import Part
+
     content_parts = [
         Part.from_data(document_data, file_type)
     ]
 
-    # Analyze the content using VertexAI Gemini Model
-    return analyze_content_with_gemini(
-        content_parts=content_parts,
-        country = country
+    # Analyze the content using VertexAI Gemini Model, reusing a cached result for identical content
+    return cached_analysis(
+        content_hash=content_digest(document_data),
+        country=country,
+        analyze=lambda: analyze_content(
+            content_parts=content_parts,
+            country=country
+        )
+    )
+
+
+def analyze_text_document(document_data: bytes, country: Union[str, List[str]]) -> Iterator[str]:
+    """
+    Analyze a text document, after removing its boilerplate.
+
+    Documents still exceeding the token budget are analyzed in page ranges (see analyze_text_in_chunks).
+
+    Args:
+        document_data: The contents of the text file, pages separated by form feeds
+        country: The country for which to check compliance, or a list of countries to check in a single model call
+
+    Returns:
+        An iterator of response chunks from the model
+    """
+    pages = trim_pages(document_data.decode('utf-8', errors='replace').split('\f'))
+    text = '\f'.join(pages)
+
+    if exceeds_budget(estimate_tokens(text)):
+        metrics.OVER_BUDGET_ANALYSES.inc()
+        max_tokens = configuration.MODEL_INPUT_TOKEN_BUDGET
+        return cached_analysis(
+            content_hash=content_digest(f"{content_digest(document_data)}:tokens:{max_tokens}"),
+            country=country,
+            analyze=lambda: analyze_text_in_chunks(pages, country, max_tokens)
+        )
+
+    return cached_analysis(
+        content_hash=content_digest(document_data),
+        country=country,
+        analyze=lambda: analyze_content(
+            content_parts=[text],
+            country=country
+        )
     )
+
+
+def count_pdf_pages(pdf_data: bytes) -> int:
+    """
+    Count the pages of a PDF document.
+
+    The count comes from the shared text extraction, so the text is ready for later use.
+
+    Args:
+        pdf_data: Binary data of the PDF file
+
+    Returns:
+        The number of pages
+    """
+    return len(extract_pdf_pages(pdf_data))
+
+
+def split_pdf(pdf_data: bytes, pages_per_chunk: int) -> List[Tuple[int, int, bytes]]:
+    """
+    Split a PDF document into smaller PDF documents covering consecutive page ranges.
+
+    Args:
+        pdf_data: Binary data of the PDF file
+        pages_per_chunk: Maximum number of pages in each chunk
+
+    Returns:
+        A list of tuples containing the first page number, the last page number (both 1-based)
+        and the binary data of each chunk
+    """
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_data))
+    page_count = len(reader.pages)
+
+    chunks = []
+    for start in range(0, page_count, pages_per_chunk):
+        end = min(start + pages_per_chunk, page_count)
+        writer = PyPDF2.PdfWriter()
+        for page_num in range(start, end):
+            writer.add_page(reader.pages[page_num])
+
+        output = io.BytesIO()
+        writer.write(output)
+        chunks.append((start + 1, end, output.getvalue()))
+
+    return chunks
+
+
+def analyze_pdf_in_chunks(
+    pdf_data: bytes,
+    country: Union[str, List[str]],
+    pages_per_chunk: int
+) -> Iterator[str]:
+    """
+    Analyze a PDF document by analyzing its page ranges concurrently and merging the results.
+
+    Args:
+        pdf_data: Binary data of the PDF file
+        country: The country for which to check compliance, or a list of countries to check in a single model call
+        pages_per_chunk: Maximum number of pages analyzed in a single model call
+
+    Returns:
+        An iterator yielding the merged analysis as a single JSON document
+    """
+    from vertexai.generative_models import Part
+
+    chunks = [
+        (first_page, last_page, Part.from_data(chunk_data, "application/pdf"))
+        for first_page, last_page, chunk_data in split_pdf(pdf_data, pages_per_chunk)
+    ]
+    return analyze_in_chunks(chunks, country)
+
+
+def analyze_text_in_chunks(
+    pages: List[str],
+    country: Union[str, List[str]],
+    max_tokens: int,
+    preamble: Optional[str] = None
+) -> Iterator[str]:
+    """
+    Analyze a text by analyzing its page ranges, each within a token budget, concurrently and merging the results.
+
+    Args:
+        pages: The text of each page
+        country: The country for which to check compliance, or a list of countries to check in a single model call
+        max_tokens: Maximum number of tokens of the text analyzed in a single model call
+        preamble: Text sent before each chunk, e.g. the URL of a web page
+
+    Returns:
+        An iterator yielding the merged analysis as a single JSON document
+    """
+    return analyze_in_chunks(
+        [
+            (first_page, last_page, f"{preamble}\n\n{text}" if preamble else text)
+            for first_page, last_page, text in split_pages(pages, max_tokens)
+        ],
+        country
+    )
+
+
+def analyze_in_chunks(
+    chunks: List[Tuple[int, int, Union[str, "Part"]]],
+    country: Union[str, List[str]]
+) -> Iterator[str]:
+    """
+    Analyze the page ranges of a document concurrently and merge the results.
+
+    Args:
+        chunks: A list of tuples containing the first page number, the last page number (both
+            1-based) and the content part of each page range
+        country: The country for which to check compliance, or a list of countries to check in a single model call
+
+    Returns:
+        An iterator yielding the merged analysis as a single JSON document
+    """
+    total_pages = chunks[-1][1] if chunks else 0
+
+    # Each chunk runs in the context of the caller, so that its metrics carry the same labels
+    futures = [
+        _get_chunk_executor().submit(
+            copy_context().run, _analyze_chunk, content, first_page, last_page, total_pages, country
+        )
+        for first_page, last_page, content in chunks
+    ]
+    chunk_results = [
+        (first_page, last_page, future.result())
+        for (first_page, last_page, _), future in zip(chunks, futures)
+    ]
+
+    if isinstance(country, str):
+        yield json.dumps(merge_chunk_analyses(chunk_results, total_pages))
+    else:
+        # Merge the chunks separately for each country of a multi-country analysis
+        country_chunk_results = [
+            (first_page, last_page, split_country_results(result, country))
+            for first_page, last_page, result in chunk_results
+        ]
+        yield json.dumps({
+            name: merge_chunk_analyses(
+                [(first_page, last_page, results[name]) for first_page, last_page, results in country_chunk_results],
+                total_pages
+            )
+            for name in country
+        })
+
+
+def merge_chunk_analyses(
+    chunk_results: List[Tuple[int, int, Dict[str, Any]]],
+    total_pages: int
+) -> Dict[str, Any]:
+    """
+    Merge the analyses of page ranges into the analysis of the whole document.
+
+    Page numbers are converted from chunk-relative to document page numbers, and the overall
+    non-compliance percentage is the page-weighted average of the chunk percentages (a page split
+    into several chunks counts once per chunk).
+
+    Args:
+        chunk_results: A list of tuples containing the first page number, the last page number and
+            the parsed analysis of each chunk
+        total_pages: The number of pages in the whole document
+
+    Returns:
+        The merged analysis
+    """
+    non_compliant_pages = []
+    detailed_analysis = []
+    weighted_percentage = 0.0
+    weights = 0
+    is_compliant = True
+
+    for first_page, last_page, analysis in chunk_results:
+        if str(analysis.get("Compliant Status", "")).strip().lower() != "compliant":
+            is_compliant = False
+
+        weighted_percentage += _parse_percentage(analysis.get("Non-Compliance Percentage")) * (last_page - first_page + 1)
+        weights += last_page - first_page + 1
+
+        if analysis.get("Detailed Analysis"):
+            detailed_analysis.append(f"Pages {first_page}-{last_page}: {analysis['Detailed Analysis']}")
+
+        for page in analysis.get("Non-Compliant Pages") or []:
+            page = dict(page)
+            try:
+                page["Page Number"] = int(page.get("Page Number")) + first_page - 1
+            except (TypeError, ValueError):
+                pass
+            non_compliant_pages.append(page)
+
+    return {
+        "Compliant Status": "Compliant" if is_compliant else "Non Compliant",
+        "Non-Compliance Percentage": round(weighted_percentage / weights) if weights else 0,
+        "Detailed Analysis": "\n\n".join(detailed_analysis),
+        "Non-Compliant Pages": non_compliant_pages,
+    }
+
+
+def _analyze_chunk(
+    content: Union[str, "Part"],
+    first_page: int,
+    last_page: int,
+    total_pages: int,
+    country: Union[str, List[str]]
+) -> Dict[str, Any]:
+    content_parts = [
+        f"This excerpt contains pages {first_page} to {last_page} of a {total_pages} page document. "
+        f"Number the pages of this excerpt starting from 1.",
+        content
+    ]
+    result_text = "".join(analyze_content(content_parts=content_parts, country=country))
+    return parse_analysis_response(result_text, schema=None if isinstance(country, list) else ANALYSIS_SCHEMA)
+
+
+def _parse_percentage(value: Any) -> float:
+    try:
+        return float(str(value).strip().rstrip("%"))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _get_chunk_executor() -> ThreadPoolExecutor:
+    global _chunk_executor
+    if _chunk_executor is None:
+        with _chunk_executor_lock:
+            if _chunk_executor is None:
+                _chunk_executor = ThreadPoolExecutor(
+                    max_workers=configuration.PDF_FAN_OUT_MAX_WORKERS,
+                    thread_name_prefix="pdf-chunk"
+                )
+    return _chunk_executor
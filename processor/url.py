@@ -1,24 +1,38 @@
 """
 Module for processing URLs using web scraping and VertexAI.
-This module provides functionality to fetch content from URLs and analyze them using VertexAI.
+This module provides functionality to fetch content from URLs, or crawl the pages of a web site,
+and analyze them using VertexAI.
 """
 
-import requests
-from typing import Iterator
-from bs4 import BeautifulSoup
-from vertexai.generative_models import Part
+import json
+import sys
+from typing import Iterator, List, Optional, Union
 
-from ai_service import analyze_content_with_gemini
+import configuration
+import http_client
+import metrics
+
+from ai_service import analyze_content, cached_analysis
+from html_text import stream_html_to_text
+from processor.document import analyze_in_chunks, analyze_text_in_chunks
+from result_cache import content_digest
+from site_crawler import crawl_site
+from token_budget import estimate_tokens, exceeds_budget, split_pages, trim_pages
+
+# Size of the chunks of the response read and parsed at a time
+_READ_CHUNK_BYTES = 64 * 1024
 
 def fetch_url_content(url: str) -> str:
     """
     Fetch content from a URL and return it as a string.
 
+    The response is parsed as it is read, up to configuration.URL_FETCH_MAX_BYTES.
+
     Args:
         url: URL to fetch content from
 
     Returns:
-        The HTML content of the URL as a string
+        The text content of the URL as a string
     """
     try:
         # Add http:// if not present
@@ -27,51 +41,139 @@ def fetch_url_content(url: str) -> str:
 
         # Fetch the URL content
         headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            'User-Agent': configuration.URL_FETCH_USER_AGENT
         }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()  # Raise an exception for HTTP errors
+        response = http_client.get(url, headers=headers, timeout=configuration.URL_FETCH_TIMEOUT, stream=True)
+        try:
+            response.raise_for_status()  # Raise an exception for HTTP errors
 
-        # Parse HTML content
-        soup = BeautifulSoup(response.text, 'html.parser')
+            # Extract the text as the page is downloaded, skipping scripts, styles and navigation
+            # chrome; the charset of the Content-Type header wins over the one of the page
+            charset = response.encoding if "charset" in response.headers.get("Content-Type", "").lower() else None
+            text, truncated = stream_html_to_text(response.iter_content(_READ_CHUNK_BYTES), encoding=charset)
+        finally:
+            response.close()
 
-        # Extract text content (remove scripts, styles, etc.)
-        for script in soup(["script", "style"]):
-            script.extract()
-
-        # Get text content
-        text = soup.get_text(separator='\n', strip=True)
+        if truncated:
+            print(f"URL content truncated at {configuration.URL_FETCH_MAX_BYTES} bytes: {url}")
+        if not text.strip():
+            # Nothing to analyze, e.g. a page rendered by scripts or only made of navigation
+            raise ValueError("no text found on the page")
 
         return text
     except Exception as e:
         raise Exception(f"Error fetching URL content: {str(e)}")
 
+
 def process_url(
     url: str,
-    country:str,
+    country: Union[str, List[str]],
 ) -> Iterator[str]:
     """
     Process a URL using web scraping and VertexAI.
 
     Args:
         url: URL to process
-        prompt: The prompt to send to the model
-        system_instruction: The system instruction for the model
+        country: The country for which to check compliance, or a list of countries to check in a single model call
 
     Returns:
         An iterator of response chunks from the model
     """
     # Fetch the URL content
     url_content = fetch_url_content(url)
+    text = trim_pages([url_content], repeated_lines=True)[0]
+
+    if exceeds_budget(estimate_tokens(text)):
+        # Analyze the page in parts, each within the token budget
+        metrics.OVER_BUDGET_ANALYSES.inc()
+        max_tokens = configuration.MODEL_INPUT_TOKEN_BUDGET
+        return cached_analysis(
+            content_hash=content_digest(f"{content_digest(url_content)}:tokens:{max_tokens}"),
+            country=country,
+            analyze=lambda: analyze_text_in_chunks([text], country, max_tokens, preamble=f"URL: {url}")
+        )
 
     # Create content parts for analysis
     content_parts = [
         f"URL: {url}",
-        f"Content:\n{url_content}"
+        f"Content:\n{text}"
     ]
 
-    # Analyze the content using VertexAI
-    return analyze_content_with_gemini(
-        content_parts=content_parts,
-        country=country
+    # Analyze the content using VertexAI, keyed on the extracted text so unchanged pages hit the cache
+    return cached_analysis(
+        content_hash=content_digest(url_content),
+        country=country,
+        analyze=lambda: analyze_content(
+            content_parts=content_parts,
+            country=country
+        )
+    )
+
+
+def process_site(
+    url: str,
+    country: Union[str, List[str]],
+    max_depth: Optional[int] = None,
+    max_pages: Optional[int] = None
+) -> Iterator[str]:
+    """
+    Crawl a web site from a URL and analyze its pages together using VertexAI.
+
+    The pages are analyzed like the pages of a document, in page ranges within the token budget,
+    after removing the lines repeated across the site. The "Page Number" of each non-compliant
+    page in the analysis is the URL of the page.
+
+    Args:
+        url: URL of the start page
+        country: The country for which to check compliance, or a list of countries to check in a single model call
+        max_depth: Maximum number of links followed from the start page, configuration.CRAWL_MAX_DEPTH by default
+        max_pages: Maximum number of pages, configuration.CRAWL_MAX_PAGES by default
+
+    Returns:
+        An iterator yielding the analysis as a single JSON document
+    """
+    pages = crawl_site(url, max_depth, max_pages)
+    if not pages:
+        raise Exception(f"No content found at {url}")
+
+    urls = [page_url for page_url, _ in pages]
+    # Form feeds separate the pages of a page range
+    texts = trim_pages([text.replace("\f", " ") for _, text in pages], repeated_lines=True)
+
+    max_tokens = configuration.MODEL_INPUT_TOKEN_BUDGET or sys.maxsize
+    if exceeds_budget(sum(estimate_tokens(text) for text in texts)):
+        metrics.OVER_BUDGET_ANALYSES.inc()
+
+    # Label each page with its number in the page range and its URL
+    chunks = []
+    for first_page, last_page, text in split_pages(texts, max_tokens):
+        page_texts = text.split("\f") if last_page > first_page else [text]
+        chunks.append((first_page, last_page, "\n\n".join(
+            [f"These are pages of the web site {urls[0]}, each starting with its page number and URL."] +
+            [
+                f"Page {number}: {urls[first_page + number - 2]}\n{page_text}"
+                for number, page_text in enumerate(page_texts, start=1)
+            ]
+        )))
+
+    site_content = json.dumps(pages)
+    return cached_analysis(
+        content_hash=content_digest(f"{content_digest(site_content)}:site:{max_tokens}"),
+        country=country,
+        analyze=lambda: _with_page_urls(analyze_in_chunks(chunks, country), urls, country)
     )
+
+
+def _with_page_urls(result_chunks: Iterator[str], urls: List[str], country: Union[str, List[str]]) -> Iterator[str]:
+    # Replace the page numbers of the merged analysis with the URLs of the pages
+    result = json.loads("".join(result_chunks))
+    analyses = [result] if isinstance(country, str) else [result.get(name) or {} for name in country]
+    for analysis in analyses:
+        for page in analysis.get("Non-Compliant Pages") or []:
+            try:
+                number = int(page.get("Page Number"))
+            except (TypeError, ValueError):
+                continue
+            if 1 <= number <= len(urls):
+                page["Page Number"] = urls[number - 1]
+    yield json.dumps(result)
@@ -4,29 +4,26 @@ This module provides functionality to read video files and analyze them using Ve
 """
 
 import os
-from typing import Iterator
-from vertexai.generative_models import Part
+from typing import Iterator, List, Optional, Union
 
-from ai_service import analyze_content_with_gemini
+from ai_service import analyze_content, cached_analysis
+from media_storage import file_digest, media_part
 
-def read_video_file(file_path: str) -> tuple[bytes, str]:
+def get_video_file_type(file_path: str) -> str:
     """
-    Read a video file (MP4, WEBM, MKV) and return its contents as bytes and the file type.
+    Determine the MIME type of a video file (MP4, WEBM, MKV).
 
     Args:
         file_path: Path to the video file
 
     Returns:
-        A tuple containing the contents of the video file as bytes and the file type
+        The file type
     """
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
 
     file_extension = os.path.splitext(file_path)[1].lower()
 
-    with open(file_path, "rb") as file:
-        file_data = file.read()
-
     if file_extension == '.mp4':
         file_type = "video/mp4"
     elif file_extension == '.webm':
@@ -36,33 +33,53 @@ def read_video_file(file_path: str) -> tuple[bytes, str]:
     else:
         raise ValueError(f"Unsupported file type: {file_extension}. Only MP4, WEBM, and MKV files are supported.")
 
+    return file_type
+
+def read_video_file(file_path: str) -> tuple[bytes, str]:
+    """
+    Read a video file (MP4, WEBM, MKV) and return its contents as bytes and the file type.
+
+    Args:
+        file_path: Path to the video file
+
+    Returns:
+        A tuple containing the contents of the video file as bytes and the file type
+    """
+    file_type = get_video_file_type(file_path)
+
+    with open(file_path, "rb") as file:
+        file_data = file.read()
+
     return file_data, file_type
 
 def process_video(
     file_path: str,
-    country:str,
+    country: Union[str, List[str]],
+    content_hash: Optional[str] = None,
 ) -> Iterator[str]:
     """
     Process a video file (MP4, WEBM, MKV) using VertexAI.
 
+    The file is not read into memory here: it is hashed in chunks for the result cache, and only
+    loaded (or staged in the object store, for large files) when the model has to be called.
+
     Args:
         file_path: Path to the video file
-        prompt: The prompt to send to the model
-        system_instruction: The system instruction for the model
+        country: The country for which to check compliance, or a list of countries to check in a single model call
+        content_hash: SHA-256 digest of the file if already known, e.g. computed during upload
 
     Returns:
         An iterator of response chunks from the model
     """
-    # Read the video file
-    video_data, file_type = read_video_file(file_path)
-
-    # Create content parts for analysis
-    content_parts = [
-        Part.from_data(video_data, file_type)
-    ]
-
-    # Analyze the content using VertexAI
-    return analyze_content_with_gemini(
-        content_parts=content_parts,
-        country=country
+    file_type = get_video_file_type(file_path)
+    content_hash = content_hash or file_digest(file_path)
+
+    # Analyze the content using VertexAI, reusing a cached result for identical content
+    return cached_analysis(
+        content_hash=content_hash,
+        country=country,
+        analyze=lambda: analyze_content(
+            content_parts=[media_part(file_path, file_type, content_hash)],
+            country=country
+        )
     )
@@ -0,0 +1,217 @@
+"""
+Module for caching analysis results.
+This module provides a persistent, content-addressed cache for model analysis results,
+so that repeated analyses of the same content return instantly without calling the model.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional
+
+import configuration
+
+
+def content_digest(data) -> str:
+    """
+    Compute the SHA-256 digest of some content.
+
+    Args:
+        data: The content as bytes or text
+
+    Returns:
+        The hexadecimal SHA-256 digest of the content
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_cache_key(content_hash: str, country: str, model_name: str, prompt_hash: str) -> str:
+    """
+    Build a cache key from everything that influences an analysis result.
+
+    Args:
+        content_hash: SHA-256 digest of the analyzed content
+        country: The country the content is checked against
+        model_name: The backend and model used for the analysis, see model_backend.backend_model_id
+        prompt_hash: Digest of the prompt text sent to the model
+
+    Returns:
+        The cache key
+    """
+    return content_digest("\x1f".join([content_hash, country or "", model_name, prompt_hash]))
+
+
+class ResultCache:
+    """
+    SQLite-backed cache of analysis results with TTL and size based eviction.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int, max_entries: int):
+        """
+        Args:
+            path: Path to the SQLite database file
+            ttl_seconds: Time after which an entry expires
+            max_entries: Maximum number of entries kept; least recently used entries are evicted first
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached result.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            The cached result text, or None if there is no valid entry
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            value, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self._connection.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        """
+        Store a result and evict expired or least recently used entries.
+
+        Args:
+            key: The cache key
+            value: The result text to store
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self.stores += 1
+
+            # Drop expired entries
+            cursor = self._connection.execute(
+                "DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+            self.evictions += max(cursor.rowcount, 0)
+
+            # Trim the cache down to its maximum size
+            cursor = self._connection.execute(
+                "DELETE FROM results WHERE key IN ("
+                " SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.evictions += max(cursor.rowcount, 0)
+
+    def stream(
+        self,
+        key: str,
+        producer: Callable[[], Iterator[str]],
+        validate: Optional[Callable[[str], bool]] = None
+    ) -> Iterator[str]:
+        """
+        Serve a result from the cache, or stream it from the producer and cache it.
+
+        The result is only stored once the producer has been fully consumed without errors, and
+        only if it passes validation, so that a bad response is not served again.
+
+        Args:
+            key: The cache key
+            producer: A callable returning an iterator of response chunks
+            validate: A callable checking the complete result text before it is stored
+
+        Returns:
+            An iterator of response chunks
+        """
+        cached = self.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        for chunk in producer():
+            chunks.append(chunk)
+            yield chunk
+
+        result = "".join(chunks)
+        if validate is None or validate(result):
+            self.set(key, result)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the cache counters.
+
+        Returns:
+            A dictionary with hit, miss, store and eviction counters and the current number of entries
+        """
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "entries": entries,
+        }
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """
+    Get the process-wide result cache, creating it on first use.
+
+    Returns:
+        The shared ResultCache instance
+    """
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache(
+                    configuration.RESULT_CACHE_PATH,
+                    configuration.RESULT_CACHE_TTL_SECONDS,
+                    configuration.RESULT_CACHE_MAX_ENTRIES
+                )
+    return _result_cache
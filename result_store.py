@@ -0,0 +1,208 @@
+"""
+Module for storing analysis data between requests.
+This module keeps the analysis data of each user in a dedicated store, so that the session only
+needs to hold a small analysis id and several application instances can share the data.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+import configuration
+
+
+class ResultStore:
+    """
+    Base class for analysis data stores.
+    """
+
+    def save(self, analysis: Dict[str, Any]) -> str:
+        """
+        Store new analysis data.
+
+        Args:
+            analysis: The analysis data, which must be JSON serializable
+
+        Returns:
+            The id of the stored analysis
+        """
+        analysis_id = uuid.uuid4().hex
+        self.put(analysis_id, analysis)
+        return analysis_id
+
+    def update(self, analysis_id: str, fields: Dict[str, Any]) -> None:
+        """
+        Add or replace fields of stored analysis data.
+
+        Args:
+            analysis_id: The id of the analysis
+            fields: The fields to set
+        """
+        analysis = self.load(analysis_id)
+        if analysis is None:
+            raise KeyError(f"Analysis not found: {analysis_id}")
+        analysis.update(fields)
+        self.put(analysis_id, analysis)
+
+    def put(self, analysis_id: str, analysis: Dict[str, Any]) -> None:
+        """
+        Store analysis data under an id.
+
+        Args:
+            analysis_id: The id of the analysis
+            analysis: The analysis data
+        """
+        raise NotImplementedError
+
+    def load(self, analysis_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Load stored analysis data.
+
+        Args:
+            analysis_id: The id of the analysis
+
+        Returns:
+            The analysis data, or None if it is unknown or has expired
+        """
+        raise NotImplementedError
+
+
+class SQLiteResultStore(ResultStore):
+    """
+    Result store backed by a local SQLite database. Entries expire after the TTL.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            " id TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+
+    def put(self, analysis_id: str, analysis: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO analyses (id, data, updated_at) VALUES (?, ?, ?)",
+                (analysis_id, json.dumps(analysis), now)
+            )
+            self._connection.execute("DELETE FROM analyses WHERE updated_at < ?", (now - self.ttl_seconds,))
+
+    def load(self, analysis_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM analyses WHERE id = ? AND updated_at >= ?",
+                (analysis_id, time.time() - self.ttl_seconds)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+class RedisResultStore(ResultStore):
+    """
+    Result store backed by a Redis-compatible client (anything with get and set(name, value, ex=...)).
+    """
+
+    def __init__(self, client, ttl_seconds: int, prefix: str = "analysis:"):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def put(self, analysis_id: str, analysis: Dict[str, Any]) -> None:
+        self.client.set(self.prefix + analysis_id, json.dumps(analysis), ex=self.ttl_seconds)
+
+    def load(self, analysis_id: str) -> Optional[Dict[str, Any]]:
+        data = self.client.get(self.prefix + analysis_id)
+        return json.loads(data) if data else None
+
+
+class InMemoryRedis:
+    """
+    Minimal in-process stand-in for a Redis client, for development and tests.
+    """
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(name)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                del self._data[name]
+                return None
+            return value
+
+    def set(self, name: str, value, ex: Optional[int] = None) -> bool:
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        with self._lock:
+            self._data[name] = (value, time.time() + ex if ex else None)
+        return True
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            return sum(self._data.pop(name, None) is not None for name in names)
+
+
+def create_result_store(url: str, ttl_seconds: int) -> ResultStore:
+    """
+    Create a result store from a URL.
+
+    Supported URLs are sqlite:///path/to/file.sqlite3, redis://host:port/db (requires the redis
+    package) and memory:// for an in-process stand-in of Redis.
+
+    Args:
+        url: The URL of the store
+        ttl_seconds: Time after which stored analyses expire
+
+    Returns:
+        The result store
+    """
+    location = urlparse(url)
+    if location.scheme == "sqlite":
+        return SQLiteResultStore(location.path, ttl_seconds)
+    if location.scheme in ("redis", "rediss"):
+        import redis
+
+        return RedisResultStore(redis.Redis.from_url(url), ttl_seconds)
+    if location.scheme == "memory":
+        return RedisResultStore(InMemoryRedis(), ttl_seconds)
+    raise ValueError(f"Unsupported result store URL: {url}")
+
+
+_result_store = None
+_result_store_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    """
+    Get the process-wide result store configured with configuration.RESULT_STORE_URL.
+
+    Returns:
+        The shared ResultStore instance
+    """
+    global _result_store
+    if _result_store is None:
+        with _result_store_lock:
+            if _result_store is None:
+                _result_store = create_result_store(configuration.RESULT_STORE_URL, configuration.RESULT_STORE_TTL_SECONDS)
+    return _result_store
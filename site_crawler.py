@@ -0,0 +1,405 @@
+"""
+Module for crawling the pages of a web site.
+This module follows the links of a start page to the other pages of the same site, breadth first
+up to a depth and a number of pages, fetching the pages of each level concurrently. Requests to
+a host are spaced by a minimum interval, and pages are revalidated with conditional GETs (ETag
+and Last-Modified) against a persistent SQLite cache of their extracted text and links, so that
+unchanged pages are neither downloaded nor parsed again.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urldefrag, urljoin, urlsplit, urlunsplit
+
+import configuration
+import http_client
+import metrics
+from html_text import HTMLTextExtractor, feed_html_stream
+
+# Size of the chunks of a response read and parsed at a time
+_READ_CHUNK_BYTES = 64 * 1024
+# Extensions of the links to files rather than web pages
+_NON_PAGE_EXTENSIONS = {
+    ".pdf", ".zip", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".jpg", ".jpeg", ".png", ".gif", ".svg",
+    ".webp", ".ico", ".mp3", ".mp4", ".webm", ".mkv", ".css", ".js", ".json", ".xml", ".rss"
+}
+
+# Shared pool bounding the number of concurrent page fetches across all crawls
+_crawl_executor = None
+_crawl_executor_lock = threading.Lock()
+
+
+def normalize_url(url: str, base: Optional[str] = None) -> Optional[str]:
+    """
+    Make a link absolute and drop its fragment, so that each page has a single URL.
+
+    Args:
+        url: The URL or link
+        base: The URL of the page containing the link
+
+    Returns:
+        The normalized URL, or None if it is not an HTTP(S) URL
+    """
+    url, _ = urldefrag(urljoin(base, url) if base else url)
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return None
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path or "/", parts.query, ""))
+
+
+def site_name(url: str) -> str:
+    """
+    Get the name of the site of a URL, the same for its http, https and www variants.
+
+    Args:
+        url: The URL
+
+    Returns:
+        The host name of the URL without its "www." prefix
+    """
+    host = (urlsplit(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def is_page_link(url: str) -> bool:
+    """
+    Check whether a URL looks like a web page rather than a file to download.
+
+    Args:
+        url: The URL
+
+    Returns:
+        False for the URLs of documents, images, media, styles and scripts
+    """
+    return os.path.splitext(urlsplit(url).path)[1].lower() not in _NON_PAGE_EXTENSIONS
+
+
+class HostRateLimiter:
+    """
+    Spaces the requests to each host by a minimum interval, across all threads.
+    """
+
+    def __init__(self, min_interval_seconds: float):
+        """
+        Args:
+            min_interval_seconds: Minimum time between the starts of two requests to the same host
+        """
+        self.min_interval_seconds = min_interval_seconds
+        self._next_slots: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host: str) -> None:
+        """
+        Block until a request to a host is allowed.
+
+        Args:
+            host: The host name
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slots.get(host, now))
+            self._next_slots[host] = slot + self.min_interval_seconds
+            if len(self._next_slots) > 1000:
+                # Forget the hosts that have not been requested recently
+                self._next_slots = {name: next_slot for name, next_slot in self._next_slots.items() if next_slot > now}
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class PageCache:
+    """
+    SQLite-backed cache of the text and links of crawled pages, with their validators.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        """
+        Args:
+            path: Path to the SQLite database file
+            max_entries: Maximum number of pages kept; least recently used ones are evicted first
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " url TEXT PRIMARY KEY,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " final_url TEXT NOT NULL,"
+            " text TEXT NOT NULL,"
+            " links TEXT NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)")
+
+    def get(self, url: str) -> Optional[Tuple[Optional[str], Optional[str], str, str, List[str]]]:
+        """
+        Look up a page.
+
+        Args:
+            url: The requested URL of the page
+
+        Returns:
+            A tuple containing the ETag, the Last-Modified date, the final URL after redirects,
+            the text and the links of the page, or None if the page is not cached
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT etag, last_modified, final_url, text, links FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, final_url, text, links = row
+        return etag, last_modified, final_url, text, json.loads(links)
+
+    def revalidated(self, url: str, hit: bool) -> None:
+        """
+        Record the outcome of a conditional request for a cached page.
+
+        Args:
+            url: The requested URL of the page
+            hit: Whether the server answered that the page is unchanged
+        """
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self._connection.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), url))
+            else:
+                self.misses += 1
+
+    def put(
+        self,
+        url: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        final_url: str,
+        text: str,
+        links: List[str]
+    ) -> None:
+        """
+        Store a page and evict the least recently used ones beyond the maximum size.
+
+        Args:
+            url: The requested URL of the page
+            etag: The ETag header of the response
+            last_modified: The Last-Modified header of the response
+            final_url: The URL of the page after redirects
+            text: The text of the page
+            links: The normalized links of the page
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO pages (url, etag, last_modified, final_url, text, links, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, final_url, text, json.dumps(links), time.time())
+            )
+            self.stores += 1
+
+            cursor = self._connection.execute(
+                "DELETE FROM pages WHERE rowid IN ("
+                " SELECT rowid FROM pages ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.evictions += max(cursor.rowcount, 0)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the page cache counters.
+
+        Returns:
+            A dictionary with hit (unchanged page), miss (changed page), store and eviction
+            counters and the current number of pages
+        """
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "entries": entries,
+        }
+
+
+def fetch_page(url: str, cache: Optional[PageCache] = None) -> Tuple[str, Optional[str], List[str]]:
+    """
+    Fetch a web page and extract its text and links.
+
+    Args:
+        url: The normalized URL of the page
+        cache: The page cache used for conditional requests, if any
+
+    Returns:
+        A tuple containing the URL of the page after redirects, its text (None if the response is
+        not an HTML page) and its normalized links
+    """
+    headers = {'User-Agent': configuration.URL_FETCH_USER_AGENT}
+    cached = cache.get(url) if cache is not None else None
+    if cached is not None:
+        etag, last_modified = cached[0], cached[1]
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+    get_rate_limiter().wait(urlsplit(url).hostname)
+    with metrics.timed("crawl_fetch"):
+        response = http_client.get(url, headers=headers, timeout=configuration.URL_FETCH_TIMEOUT, stream=True)
+        try:
+            if cached is not None:
+                cache.revalidated(url, response.status_code == 304)
+                if response.status_code == 304:
+                    return cached[2], cached[3], cached[4]
+            response.raise_for_status()
+
+            if "html" not in response.headers.get("Content-Type", "text/html").lower():
+                return response.url, None, []
+
+            charset = response.encoding if "charset" in response.headers.get("Content-Type", "").lower() else None
+            extractor = HTMLTextExtractor(configuration.INPUT_TRIMMING_ENABLED, collect_links=True)
+            truncated = feed_html_stream(extractor, response.iter_content(_READ_CHUNK_BYTES), encoding=charset)
+        finally:
+            response.close()
+
+    final_url = normalize_url(response.url) or url
+    links = []
+    for link in extractor.links:
+        link = normalize_url(link, final_url)
+        if link is not None and link not in links:
+            links.append(link)
+    text = extractor.text()
+
+    etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+    if cache is not None and (etag or last_modified) and not truncated:
+        cache.put(url, etag, last_modified, final_url, text, links)
+    return final_url, text, links
+
+
+def crawl_site(
+    start_url: str,
+    max_depth: Optional[int] = None,
+    max_pages: Optional[int] = None
+) -> List[Tuple[str, str]]:
+    """
+    Crawl the pages of a web site, following its links breadth first from a start page.
+
+    Only the links to pages of the same site as the start page are followed. The pages of each
+    level are fetched concurrently; pages that fail to load are skipped, except the start page.
+
+    Args:
+        start_url: The URL of the start page
+        max_depth: Maximum number of links followed from the start page, configuration.CRAWL_MAX_DEPTH by default
+        max_pages: Maximum number of pages, configuration.CRAWL_MAX_PAGES by default
+
+    Returns:
+        A list of tuples containing the URL and the text of each page, in the order they were found
+    """
+    max_depth = configuration.CRAWL_MAX_DEPTH if max_depth is None else max_depth
+    max_pages = configuration.CRAWL_MAX_PAGES if max_pages is None else max_pages
+
+    start_url = normalize_url(start_url if start_url.startswith(('http://', 'https://')) else 'https://' + start_url)
+    if start_url is None:
+        raise ValueError("Invalid URL")
+    site = site_name(start_url)
+    cache = get_page_cache() if configuration.CRAWL_CACHE_ENABLED else None
+
+    pages = []
+    seen = {start_url}
+    level = [start_url]
+    for depth in range(max_depth + 1):
+        # Each page is fetched in the context of the caller, so that its metrics carry the same labels
+        futures = [_get_crawl_executor().submit(copy_context().run, fetch_page, url, cache) for url in level]
+        next_level = []
+        for url, future in zip(level, futures):
+            try:
+                final_url, text, links = future.result()
+            except Exception as e:
+                if depth == 0:
+                    raise Exception(f"Error fetching URL content: {str(e)}")
+                print(f"Error crawling {url}: {str(e)}")
+                continue
+
+            # Redirects can lead to a page that was already crawled, or to another site
+            if final_url != url:
+                if final_url in seen or site_name(final_url) != site:
+                    continue
+                seen.add(final_url)
+            if text:
+                pages.append((final_url, text))
+            elif text is not None:
+                print(f"No text found on {final_url}, the page is not analyzed")
+
+            for link in links:
+                if link not in seen and site_name(link) == site and is_page_link(link):
+                    seen.add(link)
+                    next_level.append(link)
+
+        level = next_level[:max_pages - len(pages)]
+        if not level:
+            break
+
+    return pages
+
+
+_rate_limiter = None
+_page_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_rate_limiter() -> HostRateLimiter:
+    """
+    Get the process-wide rate limiter of the crawled hosts, creating it on first use.
+
+    Returns:
+        The shared HostRateLimiter instance
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _shared_lock:
+            if _rate_limiter is None:
+                _rate_limiter = HostRateLimiter(configuration.CRAWL_HOST_MIN_INTERVAL_SECONDS)
+    return _rate_limiter
+
+
+def get_page_cache() -> PageCache:
+    """
+    Get the process-wide page cache, creating it on first use.
+
+    Returns:
+        The shared PageCache instance
+    """
+    global _page_cache
+    if _page_cache is None:
+        with _shared_lock:
+            if _page_cache is None:
+                _page_cache = PageCache(configuration.CRAWL_CACHE_PATH, configuration.CRAWL_CACHE_MAX_ENTRIES)
+    return _page_cache
+
+
+def _get_crawl_executor() -> ThreadPoolExecutor:
+    global _crawl_executor
+    if _crawl_executor is None:
+        with _crawl_executor_lock:
+            if _crawl_executor is None:
+                _crawl_executor = ThreadPoolExecutor(
+                    max_workers=configuration.CRAWL_MAX_WORKERS,
+                    thread_name_prefix="site-crawl"
+                )
+    return _crawl_executor
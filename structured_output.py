@@ -0,0 +1,425 @@
+"""
+Module for parsing the structured (JSON) output of the model.
+This module finds the outermost JSON object of a response with a single brace-matching pass,
+which also works on a response that is still streaming, and validates it against the expected
+compliance fields. Responses without any JSON fall back to a best-effort plain text parser.
+"""
+
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Fields of a compliance analysis and the JSON types allowed for each of them
+ANALYSIS_SCHEMA = {
+    "Compliant Status": (str,),
+    "Non-Compliance Percentage": (int, float, str),
+    "Detailed Analysis": (str,),
+    "Non-Compliant Pages": (list,),
+}
+
+# Typed schema of a compliance analysis for the structured output mode of the model (OpenAPI subset).
+# The summary fields come first so that they can be shown while the rest of the response streams.
+_PERCENTAGE_SCHEMA = {"type": "integer", "minimum": 0, "maximum": 100}
+
+ANALYSIS_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "Compliant Status": {"type": "string", "enum": ["Compliant", "Non Compliant"]},
+        "Non-Compliance Percentage": _PERCENTAGE_SCHEMA,
+        "Detailed Analysis": {"type": "string"},
+        "Non-Compliant Pages": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "Page Number": {"type": "integer"},
+                    "Page Non-Compliance Percentage": _PERCENTAGE_SCHEMA,
+                    "Non-Compliant Text": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "Text": {"type": "string"},
+                                "Reason": {"type": "string"},
+                            },
+                            "required": ["Text", "Reason"],
+                            "property_ordering": ["Text", "Reason"],
+                        },
+                    },
+                },
+                "required": ["Page Number", "Page Non-Compliance Percentage", "Non-Compliant Text"],
+                "property_ordering": ["Page Number", "Page Non-Compliance Percentage", "Non-Compliant Text"],
+            },
+        },
+    },
+    "required": list(ANALYSIS_SCHEMA),
+    "property_ordering": list(ANALYSIS_SCHEMA),
+}
+
+
+def multi_country_response_schema(countries: List[str]) -> Dict[str, Any]:
+    """
+    Build the structured output schema of an analysis for several countries.
+
+    Args:
+        countries: The countries for which compliance is checked
+
+    Returns:
+        A schema of an object with one analysis per country
+    """
+    return {
+        "type": "object",
+        "properties": {country: ANALYSIS_RESPONSE_SCHEMA for country in countries},
+        "required": list(countries),
+        "property_ordering": list(countries),
+    }
+
+
+DEFAULT_ANALYSIS = {
+    "Compliant Status": "Unknown",
+    "Non-Compliance Percentage": "0%",
+    "Detailed Analysis": "No detailed analysis available.",
+    "Non-Compliant Pages": []
+}
+
+# Characters that change the state of the scanner, everything else is skipped at C speed
+_OUTSIDE = re.compile(r'\{')
+_STRUCTURE = re.compile(r'[{}\[\]",:]')
+_NESTED = re.compile(r'[{}\[\]"]')
+_STRING = re.compile(r'["\\]')
+
+
+class IncrementalJSONParser:
+    """
+    Single-pass parser locating the top-level JSON objects in a model response.
+
+    Text outside of JSON objects (Markdown fences, explanations) is ignored. The response can be
+    fed in chunks as it streams; every chunk is scanned once, so parsing is linear in the length
+    of the response.
+    """
+
+    def __init__(self, fields: Optional[List[str]] = None):
+        """
+        Args:
+            fields: Names of the top-level fields reported by feed, all fields by default
+        """
+        self.fields = set(fields) if fields is not None else None
+        self.objects: List[str] = []
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._object_start = 0
+        # State of the top-level field being read in the current object
+        self._expect_key = False
+        self._key_start = None
+        self._key = None
+        self._value_start = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Add a chunk of the response and report the top-level fields that became complete.
+
+        Args:
+            chunk: The next chunk of the response
+
+        Returns:
+            A list of (field name, value) tuples for the fields completed by this chunk
+        """
+        # Concatenate to a local variable that holds the only reference, so that CPython can
+        # extend the string in place instead of copying the whole buffer for every chunk
+        buffer, self._buffer = self._buffer, ""
+        buffer += chunk
+        completed = []
+        pos = self._pos
+
+        while True:
+            if self._in_string:
+                match = _STRING.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                pos = match.start()
+                if buffer[pos] == "\\":
+                    if pos + 1 >= len(buffer):
+                        # The escaped character is in the next chunk
+                        break
+                    pos += 2
+                    continue
+                self._in_string = False
+                pos += 1
+                if self._depth == 1 and self._key_start is not None:
+                    self._key = _loads(buffer[self._key_start:pos])
+                    self._key_start = None
+                continue
+
+            if self._depth == 0:
+                match = _OUTSIDE.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                pos = match.start()
+                self._depth = 1
+                self._object_start = pos
+                self._expect_key = True
+                self._key = None
+                self._value_start = None
+                pos += 1
+                continue
+
+            # Separators only matter for the top-level fields
+            match = (_STRUCTURE if self._depth == 1 else _NESTED).search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+            pos = match.start()
+            char = buffer[pos]
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_start = pos
+                    self._expect_key = False
+            elif char in "{[":
+                self._depth += 1
+            elif char == "]":
+                self._depth = max(self._depth - 1, 1)
+            elif self._depth == 1 and char == ":":
+                self._value_start = pos + 1
+            elif self._depth == 1 and char in ",}":
+                self._complete_field(buffer[self._value_start:pos] if self._value_start is not None else None, completed)
+                self._expect_key = True
+                if char == "}":
+                    self._depth = 0
+                    self.objects.append(buffer[self._object_start:pos + 1])
+            elif char == "}":
+                self._depth -= 1
+            pos += 1
+
+        if self._depth == 0:
+            # Drop the text that can no longer be part of an object
+            buffer = buffer[pos:]
+            pos = 0
+        self._buffer = buffer
+        self._pos = pos
+
+        return completed
+
+    def _complete_field(self, value_text: Optional[str], completed: List[Tuple[str, Any]]) -> None:
+        key, self._key, self._value_start = self._key, None, None
+        if value_text is None or not isinstance(key, str):
+            return
+        if self.fields is not None and key not in self.fields:
+            return
+        try:
+            completed.append((key, json.loads(value_text)))
+        except json.JSONDecodeError:
+            pass
+
+    def close(self, schema: Optional[Dict[str, tuple]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Finish parsing and return the JSON object of the response.
+
+        Args:
+            schema: Expected fields and their types; objects matching it are preferred
+
+        Returns:
+            The first object matching the schema, otherwise the largest valid object, or None if
+            the response contains no valid JSON object
+        """
+        largest = None
+        for text in self.objects:
+            try:
+                data = json.loads(text)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(data, dict):
+                continue
+            if schema is not None and not check_schema(data, schema):
+                return data
+            if largest is None or len(text) > largest[0]:
+                largest = (len(text), data)
+        return largest[1] if largest else None
+
+
+def _loads(text: str) -> Any:
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return None
+
+
+def check_schema(data: Dict[str, Any], schema: Dict[str, tuple]) -> List[str]:
+    """
+    Check that a parsed response has the expected fields.
+
+    Args:
+        data: The parsed response
+        schema: The expected fields and the types allowed for each of them
+
+    Returns:
+        A list of problems, empty if the response matches the schema
+    """
+    problems = []
+    for field, types in schema.items():
+        if field not in data:
+            problems.append(f"Missing field: {field}")
+        elif not isinstance(data[field], types) or isinstance(data[field], bool):
+            problems.append(f"Unexpected type for {field}: {type(data[field]).__name__}")
+    return problems
+
+
+def parse_json_response(text: str, schema: Optional[Dict[str, tuple]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Find the JSON object of a complete response.
+
+    Args:
+        text: The response text, which may contain Markdown or other formatting
+        schema: Expected fields and their types; objects matching it are preferred
+
+    Returns:
+        The parsed object, or None if the response contains no valid JSON object
+    """
+    # Responses in the structured output mode are plain JSON and only need one json.loads
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict) and (schema is None or not check_schema(data, schema)):
+            return data
+    except (TypeError, json.JSONDecodeError):
+        pass
+
+    parser = IncrementalJSONParser(fields=[])
+    parser.feed(text or "")
+    return parser.close(schema)
+
+
+def parse_analysis_response(text: str, schema: Optional[Dict[str, tuple]] = ANALYSIS_SCHEMA) -> Dict[str, Any]:
+    """
+    Parse a compliance analysis from a response of the model.
+
+    Args:
+        text: The response text
+        schema: Expected fields and their types, ANALYSIS_SCHEMA by default
+
+    Returns:
+        The parsed analysis; a default "Unknown" analysis if nothing could be parsed
+    """
+    if not text:
+        return {}
+
+    data = parse_json_response(text, schema)
+    if data is not None:
+        problems = check_schema(data, schema) if schema is not None else []
+        if problems:
+            print(f"Analysis response does not match the expected format: {'; '.join(problems)}")
+        return data
+
+    data = parse_plain_text_analysis(text)
+    if data is None:
+        return {**DEFAULT_ANALYSIS, "Non-Compliant Pages": []}
+    return data
+
+
+def parse_plain_text_analysis(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Build an analysis from a response that is not JSON, by looking for key patterns like
+    "Compliant Status: X".
+
+    Args:
+        text: The response text
+
+    Returns:
+        The analysis, or None if none of the patterns were found
+    """
+    try:
+        result = {}
+
+        # Extract compliance status (the new format uses "Compliant Status")
+        status_match = re.search(r'Compliant Status:?\s*([A-Za-z\s]+)', text, re.IGNORECASE)
+        if status_match:
+            result["Compliant Status"] = status_match.group(1).strip()
+        else:
+            # Try an old format as a fallback
+            status_match = re.search(r'Compliance Status:?\s*([A-Za-z\s]+)', text, re.IGNORECASE)
+            if status_match:
+                result["Compliant Status"] = status_match.group(1).strip()
+
+        # Extract percentage (a new format uses "Non-Compliance Percentage")
+        percentage_match = re.search(r'Non-Compliance Percentage:?\s*(\d+(?:\.\d+)?)\s*%?', text, re.IGNORECASE)
+        if percentage_match:
+            result["Non-Compliance Percentage"] = percentage_match.group(1).strip() + "%"
+        else:
+            # Try an old format as a fallback
+            percentage_match = re.search(r'Percentage of Non-Compliance:?\s*(\d+(?:\.\d+)?)\s*%?', text, re.IGNORECASE)
+            if percentage_match:
+                result["Non-Compliance Percentage"] = percentage_match.group(1).strip() + "%"
+
+        # Extract detailed analysis
+        detailed_analysis_match = re.search(r'Detailed Analysis:?\s*([^\n]+(?:\n[^\n]+)*?)(?:\n\n|\n(?=Non-Compliant Pages))', text, re.IGNORECASE)
+        if detailed_analysis_match:
+            result["Detailed Analysis"] = detailed_analysis_match.group(1).strip()
+
+        # Extract non-compliant pages, each page block runs until the start of the next one
+        pages = []
+        page_matches = list(re.finditer(
+            r'Page Number:?\s*(\d+)(?:\s*Percentage of Non-Compliance:?\s*(\d+(?:\.\d+)?)\s*%?)?',
+            text, re.IGNORECASE
+        ))
+
+        for index, page_match in enumerate(page_matches):
+            page_number = page_match.group(1).strip()
+            page_percentage = page_match.group(2).strip() + "%" if page_match.group(2) else "100%"
+
+            end_pos = page_matches[index + 1].start() if index + 1 < len(page_matches) else len(text)
+            page_block_text = text[page_match.start():end_pos]
+
+            # Extract non-compliant text items
+            non_compliant_texts = []
+            text_blocks = re.finditer(
+                r'Text:?\s*([^\n]+)(?:\s*Reason:?\s*([^\n]+))?',
+                page_block_text, re.IGNORECASE
+            )
+
+            for text_match in text_blocks:
+                text_item = {
+                    "Text": text_match.group(1).strip() if text_match.group(1) else "",
+                    "Reason": text_match.group(2).strip() if text_match.group(2) else "No reason provided"
+                }
+                non_compliant_texts.append(text_item)
+
+            page = {
+                "Page Number": page_number,
+                "Percentage of Non-Compliance": page_percentage,
+                "Non-Compliant Text": non_compliant_texts
+            }
+            pages.append(page)
+
+        if pages:
+            result["Non-Compliant Pages"] = pages
+        else:
+            # Fallback to old format if no pages found
+            sections = []
+            section_matches = re.finditer(
+                r'Headline:?\s*([^\n]+)(?:\s*Details:?\s*([^\n]+))?(?:\s*Percentage:?\s*(\d+(?:\.\d+)?)\s*%?)?', text,
+                re.IGNORECASE)
+
+            for match in section_matches:
+                section = {
+                    "Headline": match.group(1).strip() if match.group(1) else "Unknown Section",
+                    "Details": match.group(2).strip() if match.group(2) else "No details available",
+                    "Percentage": match.group(3).strip() + "%" if match.group(3) else "0%"
+                }
+                sections.append(section)
+
+            if sections:
+                result["Non-Compliant Sections"] = sections
+            else:
+                result["Non-Compliant Pages"] = []
+
+        # If we have at least some data, return it
+        if len(result) > 0:
+            return result
+    except Exception as e:
+        print(f"Error parsing text: {str(e)}")
+
+    return None
@@ -0,0 +1,136 @@
+"""
+Module for budgeting the text sent to the model.
+This module removes boilerplate from extracted text before it is analyzed (lines repeated on
+most pages such as headers, footers and disclaimers, and repeated short lines such as navigation
+links), and splits text exceeding the per-request token budget into page ranges that are
+analyzed separately. Token counts are estimated, see metrics.estimate_tokens.
+"""
+
+from collections import Counter
+from typing import List, Tuple
+
+import configuration
+import metrics
+from metrics import estimate_tokens
+
+# Repeated lines up to this length are navigation links, buttons or labels rather than content
+SHORT_LINE_MAX_CHARS = 60
+
+
+def _normalize(line: str) -> str:
+    return " ".join(line.split())
+
+
+def trim_pages(pages: List[str], repeated_lines: bool = False) -> List[str]:
+    """
+    Remove boilerplate from the text of the pages of a document, keeping its first occurrence.
+
+    Lines found on at least configuration.BOILERPLATE_MIN_PAGE_FRACTION of the pages of a document
+    of three pages or more are boilerplate, as are runs of blank lines. The number of tokens
+    before and after trimming is recorded in the metrics.
+
+    Args:
+        pages: The text of each page
+        repeated_lines: Whether to also remove the repetitions of short lines, for web pages whose
+            navigation links are repeated in menus, headers and footers
+
+    Returns:
+        The trimmed text of each page, in the same number of pages
+    """
+    if not configuration.INPUT_TRIMMING_ENABLED:
+        return pages
+
+    boilerplate = set()
+    if len(pages) >= 3:
+        page_counts = Counter(line for page in pages for line in {_normalize(line) for line in page.splitlines()} if line)
+        min_pages = max(2, configuration.BOILERPLATE_MIN_PAGE_FRACTION * len(pages))
+        boilerplate = {line for line, count in page_counts.items() if count >= min_pages}
+
+    seen = set()
+    trimmed_pages = []
+    for page in pages:
+        lines = []
+        for line in page.splitlines():
+            normalized = _normalize(line)
+            if not normalized:
+                # Keep a single blank line between paragraphs
+                if lines and lines[-1]:
+                    lines.append("")
+                continue
+            if normalized in seen and (normalized in boilerplate or (repeated_lines and len(normalized) <= SHORT_LINE_MAX_CHARS)):
+                continue
+            seen.add(normalized)
+            lines.append(line.rstrip())
+        trimmed_pages.append("\n".join(lines).strip())
+
+    tokens_before = sum(estimate_tokens(page) for page in pages)
+    tokens_after = sum(estimate_tokens(page) for page in trimmed_pages)
+    metrics.INPUT_TOKENS.observe(tokens_before, stage="extracted")
+    metrics.INPUT_TOKENS.observe(tokens_after, stage="trimmed")
+    metrics.INPUT_TOKENS_SAVED.observe(tokens_before - tokens_after)
+    return trimmed_pages
+
+
+def exceeds_budget(tokens: int) -> bool:
+    """
+    Check an estimated number of input tokens against the per-request token budget.
+
+    Args:
+        tokens: The number of tokens
+
+    Returns:
+        True if configuration.MODEL_INPUT_TOKEN_BUDGET is set and the tokens exceed it
+    """
+    return bool(configuration.MODEL_INPUT_TOKEN_BUDGET) and tokens > configuration.MODEL_INPUT_TOKEN_BUDGET
+
+
+def split_pages(pages: List[str], max_tokens: int) -> List[Tuple[int, int, str]]:
+    """
+    Group consecutive pages into chunks within a token budget.
+
+    A page exceeding the budget on its own is split at line boundaries into several chunks
+    covering that single page.
+
+    Args:
+        pages: The text of each page
+        max_tokens: Maximum number of tokens per chunk
+
+    Returns:
+        A list of tuples containing the first page number, the last page number (both 1-based)
+        and the text of each chunk, its pages separated by form feeds
+    """
+    chunks = []
+    first_page = None
+    texts: List[str] = []
+    tokens = 0
+
+    def flush(last_page: int) -> None:
+        nonlocal first_page, texts, tokens
+        if texts:
+            chunks.append((first_page, last_page, "\f".join(texts)))
+        first_page, texts, tokens = None, [], 0
+
+    for page_number, page in enumerate(pages, start=1):
+        page_tokens = estimate_tokens(page)
+        if page_tokens > max_tokens:
+            flush(page_number - 1)
+            part: List[str] = []
+            part_tokens = 0
+            for line in page.splitlines():
+                line_tokens = estimate_tokens(line) + 1
+                if part and part_tokens + line_tokens > max_tokens:
+                    chunks.append((page_number, page_number, "\n".join(part)))
+                    part, part_tokens = [], 0
+                part.append(line)
+                part_tokens += line_tokens
+            if part:
+                chunks.append((page_number, page_number, "\n".join(part)))
+            continue
+        if texts and tokens + page_tokens > max_tokens:
+            flush(page_number - 1)
+        if first_page is None:
+            first_page = page_number
+        texts.append(page)
+        tokens += page_tokens
+    flush(len(pages))
+    return chunks
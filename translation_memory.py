@@ -0,0 +1,174 @@
+"""
+Module for the translation memory of the transform step.
+This module keeps the translation of every text segment (paragraph) sent to the model, per
+language and model, in a persistent SQLite database, so that boilerplate such as safety statements,
+disclaimers and footers is only translated once across all transformed documents.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable
+
+import configuration
+from result_cache import content_digest
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def segment_key(segment: str, model: str) -> str:
+    """
+    Compute the key of a text segment translated by a model, ignoring differences in whitespace.
+
+    Args:
+        segment: The text segment
+        model: The backend and model translating the segment, see model_backend.backend_model_id
+
+    Returns:
+        The hexadecimal SHA-256 digest of the model and the normalized segment
+    """
+    return content_digest(model + "\x1f" + _WHITESPACE.sub(" ", segment).strip())
+
+
+class TranslationMemory:
+    """
+    SQLite-backed translation memory with least recently used eviction.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        """
+        Args:
+            path: Path to the SQLite database file
+            max_entries: Maximum number of translations kept; least recently used ones are evicted first
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            " language TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " translation TEXT NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " PRIMARY KEY (language, key))"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS translations_accessed_at ON translations (accessed_at)")
+
+    def get_many(self, language: str, segments: Iterable[str], model: str) -> Dict[str, str]:
+        """
+        Look up the translations of text segments.
+
+        Args:
+            language: The target language
+            segments: The text segments
+            model: The backend and model whose translations to use
+
+        Returns:
+            A dictionary mapping the segments found in the memory to their translation
+        """
+        keys = {segment: segment_key(segment, model) for segment in segments}
+        if not keys:
+            return {}
+
+        now = time.time()
+        found = {}
+        with self._lock:
+            key_list = list(set(keys.values()))
+            # Stay below the SQLite limit on the number of query parameters
+            for start in range(0, len(key_list), 500):
+                batch = key_list[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT key, translation FROM translations WHERE language = ? AND key IN ({placeholders})",
+                    [language] + batch
+                ).fetchall()
+                found.update(rows)
+                self._connection.execute(
+                    f"UPDATE translations SET accessed_at = ? WHERE language = ? AND key IN ({placeholders})",
+                    [now, language] + batch
+                )
+
+            translations = {segment: found[key] for segment, key in keys.items() if key in found}
+            self.hits += len(translations)
+            self.misses += len(keys) - len(translations)
+        return translations
+
+    def put_many(self, language: str, translations: Dict[str, str], model: str) -> None:
+        """
+        Store translations and evict the least recently used ones beyond the maximum size.
+
+        Args:
+            language: The target language
+            translations: A dictionary mapping text segments to their translation
+            model: The backend and model that translated the segments
+        """
+        if not translations:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO translations (language, key, translation, accessed_at) VALUES (?, ?, ?, ?)",
+                [(language, segment_key(segment, model), translation, now) for segment, translation in translations.items()]
+            )
+            self.stores += len(translations)
+
+            cursor = self._connection.execute(
+                "DELETE FROM translations WHERE rowid IN ("
+                " SELECT rowid FROM translations ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.evictions += max(cursor.rowcount, 0)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the translation memory counters.
+
+        Returns:
+            A dictionary with hit, miss, store and eviction counters (in segments) and the current
+            number of translations
+        """
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "entries": entries,
+        }
+
+
+_translation_memory = None
+_translation_memory_lock = threading.Lock()
+
+
+def get_translation_memory() -> TranslationMemory:
+    """
+    Get the process-wide translation memory, creating it on first use.
+
+    Returns:
+        The shared TranslationMemory instance
+    """
+    global _translation_memory
+    if _translation_memory is None:
+        with _translation_memory_lock:
+            if _translation_memory is None:
+                _translation_memory = TranslationMemory(
+                    configuration.TRANSLATION_MEMORY_PATH,
+                    configuration.TRANSLATION_MEMORY_MAX_ENTRIES
+                )
+    return _translation_memory